@@ -3,13 +3,28 @@ from discord.ext import commands, tasks
 from discord import app_commands
 import asyncio
 import json
+import csv
 import os
 from datetime import datetime, timedelta
 import random
 import io
+import time
+import zlib
+import html
+import tempfile
+import shutil
+import heapq
+import bisect
+import itertools
+from collections import Counter, OrderedDict, deque
 from dotenv import load_dotenv
 import re
+import unicodedata
 from deep_translator import GoogleTranslator
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # Compression zstd indisponible : les transcripts retombent sur gzip
 load_dotenv()
 # Configuration du bot
 intents = discord.Intents.all()
@@ -22,105 +37,903 @@ bot = commands.Bot(
 # Stockage en mémoire des données
 guild_data = {}
 giveaways = {}
+polls = {}
 warnings = {}
 sticky_messages = {}
 temp_voice_channels = set()
 voice_temp_rooms = {}
-user_cooldowns = {}
 free_key_users = {}
 # NOUVEAU : Suivi temps réel de l'activité des tickets
 ticket_activity_tracker = {}  # {guild_id: {channel_id: {'last_activity': datetime, 'creator_id': int, 'warning_sent': bool, 'warning_message_id': int}}}
-def get_guild_data(guild_id):
-    """Obtenir les données d'une guilde"""
-    if guild_id not in guild_data:
-        guild_data[guild_id] = {
-            'config': {
-                'logs_channel': None,
-                'autorole': None,
-                'allowed_roles': [],
-                'automod': False,
-                'antilink': {'status': False, 'action': 'warn'},
-                'antispam': {'status': False, 'action': 'warn'},
-                'antiraid': {'status': False, 'action': 'ban'},
-                'badword_action': 'warn',
-                'whitelist_domains': ['youtube.com', 'discord.com'],
-                'badwords': [],
-                'welcome_channel': None,
-                'welcome_message': 'Bienvenue {user} sur notre serveur !',
-                'seemember_channel_id': None,
-                'seemembervoc_channel_id': None,
-                'ticket_category': None,
-                'ticket_roles': [],
-                'ticket_logs_channel': None,
-                'ticket_category_map': {},
-                'ticket_ping_roles': [],
-                'key_cooldown': 60,
-                'key_roles': [],
-                'vouch_config': {
-                    'title': 'Avis Client',
-                    'color': '#a30174',
-                    'footer': 'Système de Vouch',
-                    'thumbnail': True
-                },
-                'ticket_embed': {
-                    'title': '🎫 Système de Tickets',
-                    'description': 'Sélectionnez une catégorie pour ouvrir un ticket:',
-                    'color': '#a30174',
-                    'image_url': None,
-                    'thumbnail_url': None
-                },
-                'freekey_embed': {
-                    'title': '🆓 Free Keys',
-                    'description': 'Récupérez votre clé gratuite\n\nUne clé par utilisateur',
-                    'color': '#00ff00',
-                    'image_url': None,
-                    'button_label': 'Récupérer Free Key'
-                },
-                'key_embed': {
-                    'title': '🔑 Clés Promoteur',
-                    'description': 'Récupérez vos clés promoteur',
-                    'color': '#0099ff',
+# PERSISTANCE (write-behind : les commandes modifient la mémoire, une tâche de fond écrit en base)
+DATA_DIR = os.getenv('BOT_DATA_DIR', 'data')
+STORAGE_BACKEND = os.getenv('BOT_STORAGE', 'sqlite')  # sqlite / memory
+STATE_FLUSH_SECONDS = float(os.getenv('BOT_FLUSH_SECONDS', '5'))
+STATE_FLUSH_BATCH = 500  # Lignes max par transaction
+JOURNAL_COMMIT_SECONDS = float(os.getenv('BOT_JOURNAL_COMMIT_MS', '50')) / 1000  # Fenêtre de group commit
+JOURNAL_COMPACT_BYTES = int(float(os.getenv('BOT_JOURNAL_COMPACT_MB', '8')) * 1024 * 1024)
+# Namespaces chargés à la demande avec la guilde (clé = guild_id)
+# 'key_stock' : stocks de clés et registre des clés utilisées, séparés du blob 'guild' car volumineux ;
+# leurs mutations vivent dans le journal, la ligne n'est réécrite qu'à la compaction
+GUILD_NAMESPACES = ('guild', 'key_stock', 'warnings', 'sticky', 'free_key_users', 'ticket_activity', 'tickets')
+# Namespaces chargés au démarrage (clé = id de message / salon, ou 0 pour un singleton)
+GLOBAL_NAMESPACES = ('giveaways', 'voice_temp_rooms', 'cooldowns', 'polls')
+storage = None
+dirty_state = set()  # {(namespace, key)} à réécrire au prochain flush
+state_digests = {}  # {(namespace, key): hash du dernier JSON écrit}
+state_flush_lock = asyncio.Lock()
+# Journal append-only des mutations (rejoué au démarrage par-dessus les snapshots)
+journal_seq = 0
+journal_buffer = []  # Lignes en attente du prochain group commit
+journal_file = None
+journal_segment = 0
+journal_bytes = 0  # Taille cumulée des segments non compactés
+journal_pending = {}  # {(namespace, clé): [(seq, op, args)]} lus au démarrage, pas encore appliqués
+journal_unsnapshotted = set()  # {(namespace, clé)} modifiés dans le journal depuis la dernière compaction
+journal_lock = asyncio.Lock()
+class StorageBackend:
+    """Interface d'un backend de persistance : des blobs JSON rangés par (namespace, clé)"""
+    def load_guild(self, guild_id):
+        """Retourner {namespace: (json, seq)} pour les namespaces d'une guilde"""
+        raise NotImplementedError
+    def load_namespace(self, namespace):
+        """Retourner [(clé, json, seq)] pour tout un namespace"""
+        raise NotImplementedError
+    def write_batch(self, rows):
+        """Écrire [(namespace, clé, json ou None pour supprimer, seq)] dans une transaction"""
+        raise NotImplementedError
+    def max_seq(self):
+        """Plus grand numéro de journal déjà intégré aux lignes"""
+        raise NotImplementedError
+    def close(self):
+        pass
+class MemoryStorage(StorageBackend):
+    """Backend sans disque (tests, BOT_STORAGE=memory) : rien ne survit au redémarrage"""
+    def __init__(self):
+        self.rows = {}
+    def load_guild(self, guild_id):
+        return {ns: self.rows[(ns, guild_id)] for ns in GUILD_NAMESPACES if (ns, guild_id) in self.rows}
+    def load_namespace(self, namespace):
+        return [(key, *row) for (ns, key), row in self.rows.items() if ns == namespace]
+    def write_batch(self, rows):
+        for namespace, key, payload, seq in rows:
+            if payload is None:
+                self.rows.pop((namespace, key), None)
+            else:
+                self.rows[(namespace, key)] = (payload, seq)
+    def max_seq(self):
+        return max((seq for _, seq in self.rows.values()), default=0)
+class SQLiteStorage(StorageBackend):
+    """Backend SQLite en mode WAL : lectures sur la boucle, écritures dans un thread dédié"""
+    def __init__(self, path):
+        import sqlite3
+        import threading
+        self.path = path
+        self._writer = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._writer.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "namespace TEXT NOT NULL, key INTEGER NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "seq INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (namespace, key))"
+        )
+        # Migration : bases créées avant l'ajout du journal
+        columns = {row[1] for row in self._writer.execute("PRAGMA table_info(state)")}
+        if 'seq' not in columns:
+            self._writer.execute("ALTER TABLE state ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+        # Connexion de lecture séparée : WAL permet de lire pendant qu'un flush écrit
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._write_lock = threading.Lock()
+    def load_guild(self, guild_id):
+        placeholders = ','.join('?' for _ in GUILD_NAMESPACES)
+        cursor = self._reader.execute(
+            f"SELECT namespace, data, seq FROM state WHERE namespace IN ({placeholders}) AND key = ?",
+            (*GUILD_NAMESPACES, guild_id)
+        )
+        return {namespace: (payload, seq) for namespace, payload, seq in cursor.fetchall()}
+    def load_namespace(self, namespace):
+        return self._reader.execute("SELECT key, data, seq FROM state WHERE namespace = ?", (namespace,)).fetchall()
+    def write_batch(self, rows):
+        now = datetime.now().timestamp()
+        upserts = [(ns, key, payload, now, seq) for ns, key, payload, seq in rows if payload is not None]
+        deletes = [(ns, key) for ns, key, payload, seq in rows if payload is None]
+        with self._write_lock:
+            self._writer.execute("BEGIN")
+            try:
+                if upserts:
+                    self._writer.executemany(
+                        "INSERT INTO state (namespace, key, data, updated_at, seq) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT(namespace, key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at, seq = excluded.seq",
+                        upserts
+                    )
+                if deletes:
+                    self._writer.executemany("DELETE FROM state WHERE namespace = ? AND key = ?", deletes)
+                self._writer.execute("COMMIT")
+            except Exception:
+                self._writer.execute("ROLLBACK")
+                raise
+    def max_seq(self):
+        return self._reader.execute("SELECT COALESCE(MAX(seq), 0) FROM state").fetchone()[0]
+    def close(self):
+        with self._write_lock:
+            self._reader.close()
+            self._writer.close()
+STORAGE_BACKENDS = {
+    'sqlite': lambda: SQLiteStorage(os.path.join(DATA_DIR, 'bot.db')),
+    'memory': MemoryStorage
+}
+STATE_CONTAINERS = {
+    'guild': guild_data,
+    'warnings': warnings,
+    'sticky': sticky_messages,
+    'free_key_users': free_key_users,
+    'ticket_activity': ticket_activity_tracker,
+    'giveaways': giveaways,
+    'polls': polls,
+    'voice_temp_rooms': voice_temp_rooms
+}
+class KeyPool:
+    """Stock de clés : file (deque) pour distribuer dans l'ordre d'ajout en O(1), index (dict) pour
+    les doublons et les retraits en O(1). Un retrait laisse une entrée périmée dans la file,
+    reconnue à son jeton et ignorée au tirage. claim() ne rend jamais la main à la boucle
+    asyncio : deux clics simultanés ne peuvent pas recevoir la même clé"""
+    __slots__ = ('queue', 'index', 'tokens')
+    def __init__(self, keys=()):
+        self.queue = deque()  # (clé, jeton) dans l'ordre d'ajout
+        self.index = {}  # {clé: jeton de son entrée vivante}
+        self.tokens = itertools.count()
+        self.add_many(keys)
+    def __len__(self):
+        return len(self.index)
+    def __contains__(self, key):
+        return key in self.index
+    def __iter__(self):
+        return (key for key, token in self.queue if self.index.get(key) == token)
+    def add(self, key):
+        if key in self.index:
+            return False
+        token = next(self.tokens)
+        self.index[key] = token
+        self.queue.append((key, token))
+        return True
+    def add_many(self, keys):
+        """Ajouter des clés ; retourne celles qui n'étaient pas déjà en stock"""
+        return [key for key in keys if self.add(key)]
+    def remove(self, key):
+        if self.index.pop(key, None) is None:
+            return False
+        if len(self.queue) > 2 * len(self.index) + 1024:
+            self.queue = deque(entry for entry in self.queue if self.index.get(entry[0]) == entry[1])
+        return True
+    def claim(self):
+        """Retirer et retourner la plus ancienne clé, None si le stock est vide"""
+        while self.queue:
+            key, token = self.queue.popleft()
+            if self.index.get(key) == token:
+                del self.index[key]
+                return key
+        return None
+KEY_POOL_FIELDS = ('keys', 'free_keys')
+KEY_STOCK_FIELDS = KEY_POOL_FIELDS + ('used_keys',)  # Champs de la guilde rangés dans la ligne 'key_stock'
+class CooldownStore:
+    """Cooldowns à clés tuples sur horloge monotone. Vérification en O(1) avec expiration paresseuse ;
+    chaque échéance est aussi rangée dans une tranche de bucket_seconds, et les tranches écoulées
+    sont purgées d'un bloc à chaque écriture : la mémoire reste bornée aux cooldowns actifs"""
+    __slots__ = ('expiry', 'buckets', 'bucket_seconds', 'next_bucket')
+    def __init__(self, bucket_seconds=60):
+        self.expiry = {}  # {clé: échéance time.monotonic()}
+        self.buckets = {}  # {numéro de tranche: {clés}}
+        self.bucket_seconds = bucket_seconds
+        self.next_bucket = int(time.monotonic() // bucket_seconds)
+    def __len__(self):
+        return len(self.expiry)
+    def remaining(self, key):
+        """Secondes restantes (0 si aucun cooldown actif)"""
+        deadline = self.expiry.get(key)
+        if deadline is None:
+            return 0
+        left = deadline - time.monotonic()
+        if left <= 0:
+            del self.expiry[key]
+            return 0
+        return left
+    def active(self, key):
+        return self.remaining(key) > 0
+    def set(self, key, seconds):
+        now = time.monotonic()
+        deadline = now + seconds
+        self.expiry[key] = deadline
+        self.buckets.setdefault(int(deadline // self.bucket_seconds), set()).add(key)
+        self._evict(now)
+    def clear(self, key):
+        self.expiry.pop(key, None)
+    def _evict(self, now):
+        current = int(now // self.bucket_seconds)
+        if current - self.next_bucket > len(self.buckets):
+            # Longue inactivité : parcourir les tranches existantes plutôt que chaque numéro
+            expired = [bucket for bucket in self.buckets if bucket < current]
+        else:
+            expired = range(self.next_bucket, current)
+        for bucket in expired:
+            for key in self.buckets.pop(bucket, ()):
+                if self.expiry.get(key, now + 1) <= now:
+                    del self.expiry[key]
+        self.next_bucket = max(self.next_bucket, current)
+    def snapshot(self):
+        """[(clé, datetime de fin)] des cooldowns actifs, pour la persistance (horloge murale)"""
+        now = time.monotonic()
+        wall = datetime.now()
+        return [(key, wall + timedelta(seconds=deadline - now)) for key, deadline in self.expiry.items() if deadline > now]
+    def restore(self, entries):
+        wall = datetime.now()
+        for key, until in entries:
+            seconds = (until - wall).total_seconds()
+            if seconds > 0:
+                self.set(tuple(key), seconds)
+def _cooldown_key(raw):
+    """Anciennes clés texte "guild_user_usage" -> (guild_id, user_id, usage)"""
+    if isinstance(raw, str):
+        guild_id, user_id, usage = raw.split('_', 2)
+        return (int(guild_id), int(user_id), usage)
+    return tuple(raw)
+user_cooldowns = CooldownStore()  # {(guild_id, user_id, usage): échéance}, persisté
+class RedemptionLedger:
+    """Clés utilisées : index par clé (validation en O(1)), index secondaire par utilisateur et
+    horodatages triés (ajouts chronologiques) pour filtrer une période par dichotomie"""
+    __slots__ = ('entries', 'by_user', 'order', 'times')
+    def __init__(self, entries=()):
+        self.entries = {}  # {clé: (user_id, datetime ou None)}
+        self.by_user = {}  # {user_id: [clés]}
+        self.order = []  # Clés dans l'ordre d'utilisation
+        self.times = []  # Timestamps alignés sur order, non décroissants (date inconnue : celui de l'entrée précédente)
+        for key, user_id, redeemed_at in entries:
+            self.record(key, user_id, redeemed_at)
+    def __len__(self):
+        return len(self.entries)
+    def __contains__(self, key):
+        return key in self.entries
+    def __iter__(self):
+        return ((key, *self.entries[key]) for key in self.order)
+    def get(self, key):
+        return self.entries.get(key)
+    def record(self, key, user_id, redeemed_at=None):
+        if key in self.entries:
+            return False
+        self.entries[key] = (user_id, redeemed_at)
+        self.by_user.setdefault(user_id, []).append(key)
+        self.order.append(key)
+        self.times.append(redeemed_at.timestamp() if redeemed_at else (self.times[-1] if self.times else 0))
+        return True
+    def query(self, user_id=None, since=None, until=None):
+        """Entrées (clé, user_id, date) dans l'ordre, filtrées par utilisateur et/ou période"""
+        if user_id is not None:
+            keys = self.by_user.get(user_id, [])
+            entries = [(key, *self.entries[key]) for key in keys]
+            if since or until:
+                entries = [entry for entry in entries if entry[2]
+                           and (not since or entry[2] >= since) and (not until or entry[2] <= until)]
+            return entries
+        low = bisect.bisect_left(self.times, since.timestamp()) if since else 0
+        high = bisect.bisect_right(self.times, until.timestamp()) if until else len(self.order)
+        entries = [(key, *self.entries[key]) for key in self.order[low:high]]
+        if since or until:
+            # Comme pour le filtre par utilisateur : une entrée sans date n'appartient à aucune période
+            entries = [entry for entry in entries if entry[2]]
+        return entries
+def _encode_state(value):
+    """Convertir l'état mémoire en JSON (sets, datetimes et clés entières conservés)"""
+    if isinstance(value, KeyPool):
+        return {'__keypool__': list(value)}
+    if isinstance(value, CooldownStore):
+        return {'__cooldowns__': [[list(key), _encode_state(until)] for key, until in value.snapshot()]}
+    if isinstance(value, RedemptionLedger):
+        return {'__ledger__': [_encode_state(list(entry)) for entry in value]}
+    if isinstance(value, dict):
+        if value and all(isinstance(k, int) for k in value):
+            return {'__int_keys__': {str(k): _encode_state(v) for k, v in value.items()}}
+        return {k: _encode_state(v) for k, v in value.items()}
+    if isinstance(value, (set, frozenset)):
+        return {'__set__': [_encode_state(v) for v in value]}
+    if isinstance(value, (list, tuple)):
+        return [_encode_state(v) for v in value]
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    return value
+def _decode_state(obj):
+    """object_hook inverse de _encode_state"""
+    if '__int_keys__' in obj:
+        return {int(k): v for k, v in obj['__int_keys__'].items()}
+    if '__set__' in obj:
+        return set(obj['__set__'])
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    if '__keypool__' in obj:
+        return KeyPool(obj['__keypool__'])
+    if '__cooldowns__' in obj:
+        return obj['__cooldowns__']
+    if '__ledger__' in obj:
+        return RedemptionLedger(obj['__ledger__'])
+    return obj
+def _decode_tree(value):
+    """Appliquer _decode_state à une valeur déjà parsée (arguments du journal, décodés à la demande)"""
+    if isinstance(value, dict):
+        return _decode_state({k: _decode_tree(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_decode_tree(v) for v in value]
+    return value
+def dump_state(value):
+    return json.dumps(_encode_state(value), ensure_ascii=False, separators=(',', ':'))
+def load_state(payload):
+    return json.loads(payload, object_hook=_decode_state)
+def _get_state_value(namespace, key):
+    """Valeur mémoire correspondant à (namespace, clé), None si absente"""
+    if namespace == 'cooldowns':
+        return user_cooldowns
+    if namespace in ('guild', 'key_stock'):
+        data = guild_data.get(key)
+        if data is None:
+            return None
+        if namespace == 'key_stock':
+            return {field: data[field] for field in KEY_STOCK_FIELDS}
+        return {field: value for field, value in data.items() if field not in KEY_STOCK_FIELDS}
+    if namespace == 'tickets':
+        return {channel_id: ticket_registry[channel_id] for channel_id in tickets_by_guild.get(key, ())}
+    return STATE_CONTAINERS[namespace].get(key)
+def _set_state_value(namespace, key, value):
+    if namespace == 'giveaways' and isinstance(value.get('participants'), list):
+        value['participants'] = set(value['participants'])  # Ancien format : liste
+    if namespace == 'cooldowns':
+        # Format actuel : [[clé, fin], ...] ; ancien : {"guild_user_usage": fin}
+        entries = value.items() if isinstance(value, dict) else value
+        user_cooldowns.restore((_cooldown_key(key), until) for key, until in entries)
+        return
+    if namespace == 'tickets':
+        tickets_persisted.add(key)
+        for record in value.values():
+            register_ticket(**record)
+        return
+    STATE_CONTAINERS[namespace][key] = value
+    if namespace == 'voice_temp_rooms':
+        temp_voice_channels.add(key)
+def mark_state_dirty(namespace, key):
+    """Signaler qu'une entrée a changé et doit être réécrite"""
+    dirty_state.add((namespace, key))
+def mark_guild_dirty(guild_id, *namespaces):
+    """Signaler qu'une guilde a changé (tous ses namespaces par défaut : à réserver aux migrations)"""
+    for namespace in namespaces or GUILD_NAMESPACES:
+        dirty_state.add((namespace, guild_id))
+def _merge_defaults(defaults, stored):
+    """Compléter une config sauvegardée avec les clés ajoutées depuis"""
+    for key, value in defaults.items():
+        if key not in stored:
+            stored[key] = value
+        elif isinstance(value, dict) and isinstance(stored[key], dict) and key != 'ticket_categories':
+            _merge_defaults(value, stored[key])
+    return stored
+def _hydrate_guild(guild_id, rows=None):
+    """Charger une guilde depuis le stockage (ou créer ses données par défaut).
+    `rows` : lignes déjà lues hors de la boucle (preload_guild_data) ; sinon lecture synchrone"""
+    data = _default_guild_data()
+    if rows is None:
+        rows = storage.load_guild(guild_id) if storage else {}
+    # 'guild' d'abord : _merge_defaults renvoie le dict sauvegardé, complété des nouveaux champs
+    for namespace in sorted(rows, key=lambda ns: ns != 'guild'):
+        payload, seq = rows[namespace]
+        state_digests[(namespace, guild_id)] = hash(payload)
+        value = load_state(payload)
+        if namespace == 'guild':
+            data = _merge_defaults(data, value)
+        elif namespace == 'key_stock':
+            data.update(value)
+        else:
+            _set_state_value(namespace, guild_id, value)
+    for field in KEY_POOL_FIELDS:
+        if not isinstance(data[field], KeyPool):
+            data[field] = KeyPool(data[field])  # Ancien format : liste
+    if not isinstance(data['used_keys'], RedemptionLedger):
+        data['used_keys'] = RedemptionLedger((k, v, None) for k, v in data['used_keys'].items())  # Ancien format : {clé: user}
+    guild_data[guild_id] = data
+    if 'guild' in rows and 'key_stock' not in rows:
+        mark_guild_dirty(guild_id, 'guild', 'key_stock')  # Ancien format : clés dans le blob 'guild'
+    # Rejouer les mutations journalisées après le dernier snapshot de la guilde ; elles restent
+    # dans le journal jusqu'à la prochaine compaction, qui réécrira les lignes concernées
+    for namespace in GUILD_NAMESPACES:
+        row_seq = rows[namespace][1] if namespace in rows else 0
+        if replay_journal_ops(namespace, guild_id, row_seq):
+            journal_unsnapshotted.add((namespace, guild_id))
+async def preload_guild_data(guild_ids):
+    """Charger les guildes au démarrage, lectures SQLite dans un thread plutôt que sur la boucle"""
+    for guild_id in guild_ids:
+        if guild_id in guild_data or storage is None:
+            continue
+        rows = await asyncio.to_thread(storage.load_guild, guild_id)
+        if guild_id not in guild_data:
+            _hydrate_guild(guild_id, rows)
+def touch_guild_state(guild_id, *namespaces):
+    """Charger l'état persistant d'une guilde et marquer les namespaces modifiés"""
+    get_guild_data(guild_id, mark_dirty=False)
+    mark_guild_dirty(guild_id, *namespaces)
+def _collect_dirty_rows():
+    """Sérialiser les entrées modifiées ; ignore celles identiques au dernier écrit"""
+    pending = list(dirty_state)
+    dirty_state.clear()
+    rows = []
+    digests = {}
+    for namespace, key in pending:
+        if namespace in GUILD_NAMESPACES and key not in guild_data:
+            continue
+        value = _get_state_value(namespace, key)
+        payload = dump_state(value) if value is not None else None
+        digest = hash(payload) if payload is not None else None
+        if state_digests.get((namespace, key)) == digest:
+            continue
+        rows.append((namespace, key, payload, journal_seq))
+        digests[(namespace, key)] = digest
+    return pending, rows, digests
+async def flush_state():
+    """Écrire les entrées modifiées par lots, hors de la boucle d'événements (False si un lot a échoué)"""
+    if storage is None or not dirty_state:
+        return True
+    async with state_flush_lock:
+        pending, rows, digests = _collect_dirty_rows()
+        for start in range(0, len(rows), STATE_FLUSH_BATCH):
+            batch = rows[start:start + STATE_FLUSH_BATCH]
+            try:
+                await asyncio.to_thread(storage.write_batch, batch)
+            except Exception as e:
+                print(f"[STORAGE] ❌ Erreur d'écriture ({len(batch)} entrées): {e}")
+                dirty_state.update((ns, key) for ns, key, _, _ in rows[start:])
+                return False
+            for namespace, key, _, _ in batch:
+                state_digests[(namespace, key)] = digests[(namespace, key)]
+        return True
+def flush_state_sync():
+    """Flush final bloquant, utilisé à l'arrêt du bot"""
+    if storage is None:
+        return
+    journal_close()
+    pending, rows, digests = _collect_dirty_rows()
+    if rows:
+        storage.write_batch(rows)
+        state_digests.update(digests)
+        print(f"[STORAGE] {len(rows)} entrée(s) sauvegardée(s) à l'arrêt")
+@tasks.loop(seconds=STATE_FLUSH_SECONDS)
+async def state_flush_loop():
+    """Tâche de fond : sauvegarde périodique des guildes modifiées"""
+    await flush_state()
+    if journal_file is not None and journal_bytes >= JOURNAL_COMPACT_BYTES:
+        await compact_journal()
+async def start_background_services():
+    """Démarrer les tâches de fond (idempotent : on_ready est rappelé après chaque reconnexion)"""
+    global antiraid_worker_task
+    await preload_guild_data([guild.id for guild in bot.guilds])
+    if not state_flush_loop.is_running():
+        state_flush_loop.start()
+    if journal_file is not None and not journal_commit_loop.is_running():
+        journal_commit_loop.start()
+    if not antiraid_monitor.is_running():
+        antiraid_monitor.start()
+    if not ticket_capture_loop.is_running():
+        ticket_capture_loop.start()
+    if antiraid_worker_task is None or antiraid_worker_task.done():
+        antiraid_worker_task = asyncio.create_task(antiraid_worker())
+    inactivity_scheduler.start()
+    if poll_scheduler.runner is None:
+        schedule_active_polls()
+    poll_scheduler.start()
+    if giveaway_scheduler.runner is None:
+        # Les giveaways échus hors ligne attendent leur resynchronisation dans end_giveaway
+        giveaway_resync_pending.update(key for key, giveaway in giveaways.items() if giveaway['active'])
+        schedule_active_giveaways()
+        asyncio.create_task(resync_active_giveaways())
+    giveaway_scheduler.start()
+    if not cleanup_temp_voice.is_running():
+        cleanup_temp_voice.start()
+    for guild in bot.guilds:
+        if guild.id not in voctemp_pool_warmed:
+            voctemp_pool_warmed.add(guild.id)
+            if get_guild_data(guild.id, mark_dirty=False)['config']['voctemp'].get('pool_size'):
+                ensure_voctemp_pool(guild)
+# ÉCHÉANCES
+SCHEDULER_MAX_SLEEP = 300  # Réveil de sécurité (changement d'heure système, mise en veille)
+class DeadlineScheduler:
+    """Tas d'échéances (timestamp, clé) : le handler est appelé à l'échéance de chaque clé,
+    plusieurs clés dues en parallèle sous un sémaphore. Reprogrammer une clé remplace son
+    échéance ; l'ancienne entrée du tas est ignorée à sa sortie"""
+    def __init__(self, name, handler, concurrency=8):
+        self.name = name
+        self.handler = handler
+        self.heap = []
+        self.deadlines = {}  # {clé: échéance en vigueur}
+        self.counter = itertools.count()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.wakeup = asyncio.Event()
+        self.tasks = set()
+        self.runner = None
+    def __len__(self):
+        return len(self.deadlines)
+    def get(self, key):
+        return self.deadlines.get(key)
+    def schedule(self, key, when):
+        self.deadlines[key] = when
+        heapq.heappush(self.heap, (when, next(self.counter), key))
+        if self.heap[0][2] == key:
+            self.wakeup.set()
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            # Trop d'entrées périmées : reconstruire le tas
+            self.heap = [(when, next(self.counter), key) for key, when in self.deadlines.items()]
+            heapq.heapify(self.heap)
+    def cancel(self, key):
+        self.deadlines.pop(key, None)
+    def start(self):
+        if self.runner is None or self.runner.done():
+            self.runner = asyncio.create_task(self._run())
+    async def run_now(self, key):
+        """Traiter la clé tout de suite (le handler la reprogramme si elle n'est pas encore due)"""
+        self.cancel(key)
+        await self._dispatch(key)
+    async def _dispatch(self, key):
+        async with self.semaphore:
+            try:
+                await self.handler(key)
+            except Exception as e:
+                print(f"[{self.name}] ❌ Erreur échéance {key}: {e}")
+    async def _run(self):
+        while True:
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                when, _, key = heapq.heappop(self.heap)
+                if self.deadlines.get(key) != when:
+                    continue
+                del self.deadlines[key]
+                task = asyncio.create_task(self._dispatch(key))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            self.wakeup.clear()
+            timeout = min(self.heap[0][0] - now, SCHEDULER_MAX_SLEEP) if self.heap else SCHEDULER_MAX_SLEEP
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+# FILES DE TRAVAIL
+class KeyedWorkQueue:
+    """Une file par clé (guilde) : les tâches d'une même clé s'exécutent une à une dans l'ordre
+    d'arrivée, des clés différentes en parallèle. Le worker d'une clé s'arrête quand sa file est vide.
+    Une tâche en erreur est journalisée et sa future reçoit None : la file continue"""
+    def __init__(self, name):
+        self.name = name
+        self.queues = {}  # {clé: deque de (fabrique de coroutine, future)}
+        self.workers = {}  # {clé: tâche worker}
+    def pending(self, key):
+        return len(self.queues.get(key, ()))
+    def submit(self, key, job):
+        """Mettre en file `job` (fonction sans argument renvoyant une coroutine) ; renvoie une future"""
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(key, deque()).append((job, future))
+        if key not in self.workers:
+            self.workers[key] = asyncio.create_task(self._work(key))
+        return future
+    async def run(self, key, job):
+        return await self.submit(key, job)
+    async def _work(self, key):
+        queue = self.queues[key]
+        try:
+            while queue:
+                job, future = queue.popleft()
+                if future.cancelled():
+                    continue
+                try:
+                    result = await job()
+                except Exception as e:
+                    print(f"[{self.name}] ❌ Erreur dans la file {key}: {e}")
+                    result = None
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.queues.pop(key, None)
+            self.workers.pop(key, None)
+# JOURNAL
+def _journal_path(segment):
+    return os.path.join(DATA_DIR, 'journal', f'journal-{segment:08d}.jsonl')
+def _journal_segments():
+    """Numéros des segments présents sur disque, dans l'ordre"""
+    folder = os.path.join(DATA_DIR, 'journal')
+    return sorted(int(name[8:16]) for name in os.listdir(folder) if re.fullmatch(r'journal-\d{8}\.jsonl', name))
+def journal_record(namespace, key, op, /, **args):
+    """Journaliser une mutation : un simple ajout en mémoire, écrit au prochain group commit.
+    Inutile de marquer l'entrée modifiée : la compaction réécrira sa ligne avant de purger le journal"""
+    global journal_seq
+    if journal_file is None:
+        return
+    journal_unsnapshotted.add((namespace, key))
+    journal_seq += 1
+    journal_buffer.append(json.dumps(
+        {'s': journal_seq, 'n': namespace, 'k': key, 'o': op, 'a': _encode_state(args)},
+        ensure_ascii=False, separators=(',', ':')
+    ) + '\n')
+def _journal_write(file, lines):
+    data = ''.join(lines).encode('utf-8')
+    file.write(data)
+    file.flush()
+    os.fsync(file.fileno())
+    return len(data)
+async def journal_commit():
+    """Écrire et fsync toutes les mutations en attente en une seule fois"""
+    global journal_bytes
+    if not journal_buffer or journal_file is None:
+        return
+    async with journal_lock:
+        lines = journal_buffer[:]
+        journal_buffer.clear()
+        try:
+            journal_bytes += await asyncio.to_thread(_journal_write, journal_file, lines)
+        except Exception as e:
+            print(f"[JOURNAL] ❌ Erreur d'écriture: {e}")
+            journal_buffer[:0] = lines
+@tasks.loop(seconds=JOURNAL_COMMIT_SECONDS)
+async def journal_commit_loop():
+    await journal_commit()
+def _apply_put(namespace, key, args):
+    _set_state_value(namespace, key, args['value'])
+def _apply_drop(namespace, key, args):
+    STATE_CONTAINERS[namespace].pop(key, None)
+    if namespace == 'voice_temp_rooms':
+        temp_voice_channels.discard(key)
+def _apply_key_add(namespace, key, args):
+    guild_data[key][args['field']].add_many(args['keys'])
+def _apply_key_remove(namespace, key, args):
+    guild_data[key][args['field']].remove(args['key'])
+def _apply_key_redeem(namespace, key, args):
+    _apply_key_remove(namespace, key, {'field': 'keys', 'key': args['key']})
+    guild_data[key]['used_keys'].record(args['key'], args['user'], args.get('at'))
+def _apply_ticket_counter(namespace, key, args):
+    guild_data[key]['ticket_counter'] = max(guild_data[key]['ticket_counter'], args['value'])
+def _apply_warning_add(namespace, key, args):
+    warnings.setdefault(key, {}).setdefault(args['user'], []).append(args['warning'])
+def _apply_warnings_clear(namespace, key, args):
+    if args['user'] in warnings.get(key, {}):
+        warnings[key][args['user']] = []
+def _apply_free_key_claim(namespace, key, args):
+    free_key_users.setdefault(key, set()).add(args['user'])
+def _apply_free_key_reset(namespace, key, args):
+    if key in free_key_users:
+        free_key_users[key] = set()
+def _apply_giveaway_join(namespace, key, args):
+    if key in giveaways:
+        giveaways[key]['participants'].add(args['user'])
+def _apply_giveaway_leave(namespace, key, args):
+    if key in giveaways:
+        giveaways[key]['participants'].discard(args['user'])
+def _apply_poll_vote(namespace, key, args):
+    if key in polls:
+        set_poll_vote(polls[key], args['user'], args['option'])
+def _apply_ticket_activity(namespace, key, args):
+    if args['entry'] is None:
+        ticket_activity_tracker.get(key, {}).pop(args['channel'], None)
+    else:
+        ticket_activity_tracker.setdefault(key, {})[args['channel']] = args['entry']
+def _apply_cooldown_set(namespace, key, args):
+    user_cooldowns.restore([(_cooldown_key(args['key']), args['until'])])
+JOURNAL_APPLIERS = {
+    'put': _apply_put,
+    'drop': _apply_drop,
+    'key_add': _apply_key_add,
+    'key_remove': _apply_key_remove,
+    'key_redeem': _apply_key_redeem,
+    'ticket_counter': _apply_ticket_counter,
+    'warning_add': _apply_warning_add,
+    'warnings_clear': _apply_warnings_clear,
+    'free_key_claim': _apply_free_key_claim,
+    'free_key_reset': _apply_free_key_reset,
+    'giveaway_join': _apply_giveaway_join,
+    'giveaway_leave': _apply_giveaway_leave,
+    'poll_vote': _apply_poll_vote,
+    'ticket_activity': _apply_ticket_activity,
+    'cooldown_set': _apply_cooldown_set
+}
+def replay_journal_ops(namespace, key, after_seq):
+    """Appliquer les mutations journalisées plus récentes que le snapshot ; True si au moins une"""
+    ops = journal_pending.pop((namespace, key), None)
+    applied = False
+    for seq, op, args in ops or ():
+        if seq > after_seq:
+            JOURNAL_APPLIERS[op](namespace, key, _decode_tree(args))
+            applied = True
+    return applied
+def _read_journal_segment(segment):
+    """Lire un segment ; une dernière ligne tronquée (crash pendant l'écriture) arrête la lecture"""
+    global journal_seq
+    count = 0
+    with open(_journal_path(segment), 'rb') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"[JOURNAL] Segment {segment}: ligne tronquée ignorée après {count} entrées")
+                break
+            journal_pending.setdefault((record['n'], record['k']), []).append((record['s'], record['o'], record['a']))
+            journal_seq = max(journal_seq, record['s'])
+            count += 1
+    return count
+def journal_open():
+    """Relire les segments existants puis ouvrir un nouveau segment pour les écritures"""
+    global journal_seq, journal_file, journal_segment, journal_bytes
+    os.makedirs(os.path.join(DATA_DIR, 'journal'), exist_ok=True)
+    journal_seq = storage.max_seq()
+    segments = _journal_segments()
+    start = datetime.now()
+    total = sum(_read_journal_segment(segment) for segment in segments)
+    journal_bytes = sum(os.path.getsize(_journal_path(segment)) for segment in segments)
+    journal_segment = (segments[-1] + 1) if segments else 1
+    journal_file = open(_journal_path(journal_segment), 'ab')
+    if total:
+        elapsed = (datetime.now() - start).total_seconds()
+        print(f"[JOURNAL] {total} mutation(s) relue(s) depuis {len(segments)} segment(s) en {elapsed:.2f}s")
+def journal_close():
+    """Écrire les mutations restantes et fermer le segment courant (arrêt du bot)"""
+    global journal_file
+    if journal_file is None:
+        return
+    if journal_buffer:
+        _journal_write(journal_file, journal_buffer)
+        journal_buffer.clear()
+    journal_file.close()
+    journal_file = None
+async def compact_journal():
+    """Snapshot + compaction : intégrer les segments clos aux lignes SQLite puis les supprimer"""
+    global journal_file, journal_segment, journal_bytes
+    await journal_commit()
+    async with journal_lock:
+        old_file = journal_file
+        old_segments = [segment for segment in _journal_segments() if segment <= journal_segment]
+        journal_segment += 1
+        journal_file = open(_journal_path(journal_segment), 'ab')
+        await asyncio.to_thread(old_file.close)
+        compacted_bytes, journal_bytes = journal_bytes, 0
+    # Les guildes jamais rechargées depuis le démarrage ont encore des mutations en attente
+    for namespace, key in list(journal_pending):
+        if namespace in GUILD_NAMESPACES:
+            get_guild_data(key, mark_dirty=False)
+        elif replay_journal_ops(namespace, key, 0):
+            mark_state_dirty(namespace, key)
+    # Tout ce qui n'existe que dans le journal doit être intégré aux lignes avant la purge
+    snapshot = set(journal_unsnapshotted)
+    journal_unsnapshotted.clear()
+    dirty_state.update(snapshot)
+    if not await flush_state():
+        journal_unsnapshotted.update(snapshot)
+        print("[JOURNAL] Compaction reportée : le snapshot a échoué")
+        journal_bytes += compacted_bytes
+        return
+    for segment in old_segments:
+        try:
+            os.remove(_journal_path(segment))
+        except OSError:
+            pass
+    print(f"[JOURNAL] Compaction terminée ({len(old_segments)} segment(s) supprimé(s))")
+def init_storage():
+    """Ouvrir le backend configuré et charger les namespaces globaux"""
+    global storage
+    os.makedirs(DATA_DIR, exist_ok=True)
+    storage = STORAGE_BACKENDS[STORAGE_BACKEND]()
+    if STORAGE_BACKEND != 'memory':
+        journal_open()
+    for namespace in GLOBAL_NAMESPACES:
+        loaded = set()
+        for key, payload, seq in storage.load_namespace(namespace):
+            state_digests[(namespace, key)] = hash(payload)
+            _set_state_value(namespace, key, load_state(payload))
+            loaded.add(key)
+            if replay_journal_ops(namespace, key, seq):
+                journal_unsnapshotted.add((namespace, key))
+        # Entrées créées et modifiées depuis le dernier flush : uniquement dans le journal
+        for pending_ns, key in [k for k in journal_pending if k[0] == namespace and k[1] not in loaded]:
+            if replay_journal_ops(pending_ns, key, 0):
+                journal_unsnapshotted.add((pending_ns, key))
+    print(f"[STORAGE] Backend {STORAGE_BACKEND} prêt ({len(giveaways)} giveaways, {len(polls)} sondages, {len(voice_temp_rooms)} vocs temporaires)")
+def _default_guild_data():
+    """Structure par défaut des données d'une guilde"""
+    return {
+        'config': {
+            'logs_channel': None,
+            'autorole': None,
+            'allowed_roles': [],
+            'automod': False,
+            'antilink': {'status': False, 'action': 'warn'},
+            'antispam': {'status': False, 'action': 'warn'},
+            'antiraid': {'status': False, 'action': 'ban'},
+            'badword_action': 'warn',
+            'badword_options': {'whole_word': False, 'fold': False},  # Mot entier / accents + leetspeak
+            'whitelist_domains': ['youtube.com', 'discord.com'],
+            'badwords': [],
+            'welcome_channel': None,
+            'welcome_message': 'Bienvenue {user} sur notre serveur !',
+            'seemember_channel_id': None,
+            'seemembervoc_channel_id': None,
+            'ticket_category': None,
+            'ticket_roles': [],
+            'ticket_logs_channel': None,
+            'ticket_transcript': {'format': 'txt', 'compression': 'none'},  # txt/jsonl/html + none/gzip/zstd
+            'ticket_category_map': {},
+            'ticket_ping_roles': [],
+            'key_cooldown': 60,
+            'key_roles': [],
+            'vouch_config': {
+                'title': 'Avis Client',
+                'color': '#a30174',
+                'footer': 'Système de Vouch',
+                'thumbnail': True
+            },
+            'ticket_embed': {
+                'title': '🎫 Système de Tickets',
+                'description': 'Sélectionnez une catégorie pour ouvrir un ticket:',
+                'color': '#a30174',
+                'image_url': None,
+                'thumbnail_url': None
+            },
+            'freekey_embed': {
+                'title': '🆓 Free Keys',
+                'description': 'Récupérez votre clé gratuite\n\nUne clé par utilisateur',
+                'color': '#00ff00',
+                'image_url': None,
+                'button_label': 'Récupérer Free Key'
+            },
+            'key_embed': {
+                'title': '🔑 Clés Promoteur',
+                'description': 'Récupérez vos clés promoteur',
+                'color': '#0099ff',
+                'image_url': None,
+                'button_label': 'Récupérer Clé'
+            },
+            # NOUVEAU : Configuration système d'inactivité
+            'inactivity_config': {
+                'enabled': False,  # Désactivé par défaut
+                'delay_hours': 24,  # Délai avant premier avertissement
+                'final_close_hours': 48,  # Fermeture auto après 48h total
+                'notify_staff': True,  # Notifier le staff
+                'embed': {
+                    'title': '⏰ Ticket Inactif',
+                    'description': 'Ce ticket est inactif depuis **{hours}h**.\n\n{mention}, souhaitez-vous :\n• Le garder ouvert 24h de plus ?\n• Le fermer définitivement ?\n\n⚠️ **Fermeture automatique dans 24h** si pas de réponse.',
+                    'color': '#ff9900',
                     'image_url': None,
-                    'button_label': 'Récupérer Clé'
-                },
-                # NOUVEAU : Configuration système d'inactivité
-                'inactivity_config': {
-                    'enabled': False,  # Désactivé par défaut
-                    'delay_hours': 24,  # Délai avant premier avertissement
-                    'final_close_hours': 48,  # Fermeture auto après 48h total
-                    'notify_staff': True,  # Notifier le staff
-                    'embed': {
-                        'title': '⏰ Ticket Inactif',
-                        'description': 'Ce ticket est inactif depuis **{hours}h**.\n\n{mention}, souhaitez-vous :\n• Le garder ouvert 24h de plus ?\n• Le fermer définitivement ?\n\n⚠️ **Fermeture automatique dans 24h** si pas de réponse.',
-                        'color': '#ff9900',
-                        'image_url': None,
-                        'button_keep': '🔄 Garder Ouvert',
-                        'button_close': '🔒 Fermer le Ticket'
-                    }
-                },
-                'voctemp': {
-                    'source_channel_id': None
+                    'button_keep': '🔄 Garder Ouvert',
+                    'button_close': '🔒 Fermer le Ticket'
                 }
             },
-            'keys': [],
-            'free_keys': [],
-            'vouch_count': 0,
-            'ticket_counter': 0,
-            'ticket_categories': {
-                'support': {'name': 'Support', 'description': 'Support technique', 'emoji': '🛠️'},
-                'bug': {'name': 'Bug Report', 'description': 'Signaler un bug', 'emoji': '🐛'},
-                'other': {'name': 'Autre', 'description': 'Autres demandes', 'emoji': '❓'}
-            },
-            # NOUVEAU : Suivi d'activité des tickets
-            'ticket_activity': {}
-        }
+            'voctemp': {
+                'source_channel_id': None,
+                'pool_size': 0  # Paires voc + panel pré-créées (0 = désactivé)
+            }
+        },
+        'keys': KeyPool(),
+        'free_keys': KeyPool(),
+        'used_keys': RedemptionLedger(),
+        'voctemp_pool': [],  # [[voc_id, panel_id], ...] salons cachés prêts à être attribués
+        'vouch_count': 0,
+        'ticket_counter': 0,
+        'ticket_categories': {
+            'support': {'name': 'Support', 'description': 'Support technique', 'emoji': '🛠️'},
+            'bug': {'name': 'Bug Report', 'description': 'Signaler un bug', 'emoji': '🐛'},
+            'other': {'name': 'Autre', 'description': 'Autres demandes', 'emoji': '❓'}
+        },
+        # NOUVEAU : Suivi d'activité des tickets
+        'ticket_activity': {}
+    }
+def get_guild_data(guild_id, mark_dirty=False):
+    """Obtenir les données d'une guilde (chargées depuis le stockage au premier accès).
+    mark_dirty=True pour une commande qui modifie la config : seul le blob 'guild' sera réécrit.
+    Les stocks de clés passent par le journal (key_add / key_remove / key_redeem)"""
+    if guild_id not in guild_data:
+        _hydrate_guild(guild_id)
+    if mark_dirty:
+        mark_guild_dirty(guild_id, 'guild')
     return guild_data[guild_id]
 def get_voice_member_count(guild: discord.Guild) -> int:
     """Compter les membres actuellement connectés dans des salons vocaux."""
     return sum(1 for member in guild.members if member.voice and member.voice.channel)
 async def update_counter_channel_names(guild: discord.Guild):
     """Mettre à jour les noms des salons compteurs membres / membres vocaux."""
-    data = get_guild_data(guild.id)
+    data = get_guild_data(guild.id, mark_dirty=False)
     config = data['config']
     total_channel_id = config.get('seemember_channel_id')
     if total_channel_id:
@@ -168,6 +981,7 @@ def is_admin_or_authorized(interaction: discord.Interaction) -> bool:
     return any(role_id in user_roles for role_id in allowed_roles)
 def update_ticket_activity(guild_id, channel_id, creator_id):
     """Mettre à jour l'activité d'un ticket"""
+    get_guild_data(guild_id, mark_dirty=False)
     if guild_id not in ticket_activity_tracker:
         ticket_activity_tracker[guild_id] = {}
     
@@ -178,6 +992,9 @@ def update_ticket_activity(guild_id, channel_id, creator_id):
         'warning_message_id': None,
         'extensions': 0  # Nombre de fois que le ticket a été gardé ouvert
     }
+    journal_record('ticket_activity', guild_id, 'ticket_activity', channel=channel_id, entry=ticket_activity_tracker[guild_id][channel_id])
+    mark_guild_dirty(guild_id, 'ticket_activity')
+    schedule_ticket_inactivity(guild_id, channel_id)
     print(f"[INACTIVITY] Activité mise à jour pour ticket {channel_id}")
 def get_ticket_inactivity_hours(guild_id, channel_id):
     """Obtenir le nombre d'heures d'inactivité d'un ticket"""
@@ -195,7 +1012,87 @@ def remove_ticket_from_tracker(guild_id, channel_id):
     if guild_id in ticket_activity_tracker:
         if channel_id in ticket_activity_tracker[guild_id]:
             del ticket_activity_tracker[guild_id][channel_id]
+            journal_record('ticket_activity', guild_id, 'ticket_activity', channel=channel_id, entry=None)
+            mark_guild_dirty(guild_id, 'ticket_activity')
+            inactivity_scheduler.cancel((guild_id, channel_id))
             print(f"[INACTIVITY] Ticket {channel_id} retiré du suivi")
+# REGISTRE DES TICKETS
+ticket_registry = {}  # {channel_id: {'guild_id', 'channel_id', 'creator_id', 'category', 'number', 'opened_at'}}
+tickets_by_creator = {}  # {(guild_id, creator_id): channel_id}
+tickets_by_category = {}  # {(guild_id, catégorie): {channel_id}}
+tickets_by_guild = {}  # {guild_id: {channel_id}}
+tickets_persisted = set()  # Guildes dont le registre a été relu depuis le stockage
+ticket_registry_ready = set()  # Guildes indexées depuis le démarrage (registre relu ou salons parcourus)
+# Topic posé par create_ticket : "Ticket #12 de Pseudo (ID: 123) - Catégorie: Support"
+TICKET_TOPIC_PATTERN = re.compile(r'Ticket #(\d+) de .*\(ID: (\d+)\) - Catégorie: (.*)$', re.S)
+def register_ticket(guild_id, channel_id, creator_id, category, number, opened_at=None):
+    """Ajouter un ticket au registre et à ses index"""
+    unregister_ticket(channel_id)
+    record = {
+        'guild_id': guild_id,
+        'channel_id': channel_id,
+        'creator_id': creator_id,
+        'category': category,
+        'number': number,
+        'opened_at': opened_at or datetime.now()
+    }
+    ticket_registry[channel_id] = record
+    mark_guild_dirty(guild_id, 'tickets')
+    tickets_by_guild.setdefault(guild_id, set()).add(channel_id)
+    tickets_by_category.setdefault((guild_id, category), set()).add(channel_id)
+    if creator_id:
+        tickets_by_creator[(guild_id, creator_id)] = channel_id
+    return record
+def unregister_ticket(channel_id):
+    """Retirer un ticket du registre ; retourne son enregistrement ou None"""
+    record = ticket_registry.pop(channel_id, None)
+    if record is None:
+        return None
+    guild_id = record['guild_id']
+    mark_guild_dirty(guild_id, 'tickets')
+    tickets_by_guild.get(guild_id, set()).discard(channel_id)
+    tickets_by_category.get((guild_id, record['category']), set()).discard(channel_id)
+    if tickets_by_creator.get((guild_id, record['creator_id'])) == channel_id:
+        del tickets_by_creator[(guild_id, record['creator_id'])]
+    return record
+def get_ticket(channel_id):
+    return ticket_registry.get(channel_id)
+def find_open_ticket(guild_id, creator_id):
+    """Salon du ticket ouvert par ce membre, ou None"""
+    return tickets_by_creator.get((guild_id, creator_id))
+def get_guild_tickets(guild_id):
+    return [ticket_registry[channel_id] for channel_id in tickets_by_guild.get(guild_id, ())]
+def _ticket_record_from_channel(channel):
+    """Reconstituer un ticket depuis le topic (ou, à défaut, le nom) d'un salon existant"""
+    match = TICKET_TOPIC_PATTERN.search(channel.topic or '')
+    if match:
+        return int(match.group(2)), match.group(3).strip(), match.group(1)
+    parts = channel.name.split('-')
+    # Nom de secours : ticket-<user_id>-<numéro>
+    if len(parts) == 3 and parts[1].isdigit():
+        return int(parts[1]), "N/A", parts[2]
+    # Format : ticket-catégorie-pseudo-numéro (créateur inconnu)
+    if len(parts) >= 4:
+        return None, parts[1].title(), parts[-1]
+    return None, "N/A", "N/A"
+def rebuild_ticket_registry(guild):
+    """Indexer une fois au démarrage les tickets déjà ouverts d'une guilde : le registre persisté
+    suffit (on retire seulement les salons supprimés hors ligne) ; les topics ne sont parcourus
+    qu'à la toute première exécution, avant qu'un registre n'ait été sauvegardé"""
+    get_guild_data(guild.id)
+    ticket_registry_ready.add(guild.id)
+    tickets_by_guild.setdefault(guild.id, set())
+    if guild.id in tickets_persisted:
+        for channel_id in list(tickets_by_guild[guild.id]):
+            if guild.get_channel(channel_id) is None:
+                unregister_ticket(channel_id)
+        return len(tickets_by_guild[guild.id])
+    for channel in guild.text_channels:
+        if channel.name.startswith('ticket-') and channel.id not in ticket_registry:
+            creator_id, category, number = _ticket_record_from_channel(channel)
+            register_ticket(guild.id, channel.id, creator_id, category, number, opened_at=channel.created_at)
+    mark_guild_dirty(guild.id, 'tickets')
+    return len(tickets_by_guild[guild.id])
 def create_key_embed(guild_id):
     """Créer l'embed des keys promoteur avec la configuration sauvegardée"""
     data = get_guild_data(guild_id)
@@ -258,6 +1155,7 @@ def get_next_ticket_number(guild_id):
     """Obtenir le prochain numéro de ticket"""
     data = get_guild_data(guild_id)
     data['ticket_counter'] += 1
+    journal_record('guild', guild_id, 'ticket_counter', value=data['ticket_counter'])
     return data['ticket_counter']
 def get_category_display_name(guild_id, category_key):
     """Obtenir le nom d'affichage d'une catégorie"""
@@ -313,6 +1211,7 @@ def refresh_ticket_categories(guild_id):
     for key, default_data in default_categories.items():
         if key not in categories:
             categories[key] = default_data
+            mark_guild_dirty(guild_id, 'guild')
     
     return categories
 def create_ticket_options(guild_id):
@@ -348,55 +1247,369 @@ def get_ticket_target_category(guild: discord.Guild, category_key: str):
         if isinstance(fallback, discord.CategoryChannel):
             return fallback
     return None
-async def create_ticket_transcript(channel):
-    """Créer un transcript complet du ticket"""
-    messages_list = []
-    
-    # Récupérer tous les messages
-    async for message in channel.history(limit=None, oldest_first=True):
-        # Format du timestamp
-        timestamp = message.created_at.strftime("%Y-%m-%d %H:%M:%S")
-        
-        # Contenu du message
-        content = message.content if message.content else "[Aucun contenu texte]"
-        
-        # Ajouter les embeds
-        if message.embeds:
-            for embed in message.embeds:
-                if embed.title:
-                    content += f"\n[EMBED] Titre: {embed.title}"
-                if embed.description:
-                    content += f"\n[EMBED] Description: {embed.description}"
-        
-        # Ajouter les pièces jointes
-        if message.attachments:
-            for attachment in message.attachments:
-                content += f"\n[FICHIER] {attachment.filename} - {attachment.url}"
-        
-        # Format de la ligne
-        line = f"[{timestamp}] {message.author.name}#{message.author.discriminator} ({message.author.id}): {content}"
-        messages_list.append(line)
-    
-    # Créer le transcript
-    transcript = "\n".join(messages_list)
-    return transcript
-async def send_ticket_log(guild, channel_name, ticket_info, transcript, closed_by):
+# TRANSCRIPTS
+TRANSCRIPT_SPOOL_BYTES = 1024 * 1024  # Au-delà, la partie en cours passe de la mémoire au disque
+TRANSCRIPT_PART_BYTES = int(float(os.getenv('TRANSCRIPT_PART_MB', '8')) * 1024 * 1024)  # Taille max d'un fichier envoyé
+TRANSCRIPT_FILES_PER_MESSAGE = 10  # Limite Discord de pièces jointes par message
+def transcript_record(message):
+    """Enregistrement d'un message tel qu'il apparaît dans un transcript"""
+    return {
+        'id': message.id,
+        'timestamp': message.created_at,
+        'author': f"{message.author.name}#{message.author.discriminator}",
+        'author_id': message.author.id,
+        'content': message.content,
+        'embeds': [(embed.title, embed.description) for embed in message.embeds],
+        'attachments': [(attachment.filename, attachment.url) for attachment in message.attachments]
+    }
+async def iter_transcript_records(channel, after=None, before=None):
+    """Parcourir l'historique du salon message par message, sans tout garder en mémoire"""
+    after = discord.Object(id=after) if after else None
+    before = discord.Object(id=before) if before else None
+    async for message in channel.history(limit=None, oldest_first=True, after=after, before=before):
+        yield transcript_record(message)
+def format_transcript_line(record):
+    """[timestamp] auteur (id): contenu, suivi des embeds et pièces jointes"""
+    content = record['content'] if record['content'] else "[Aucun contenu texte]"
+    for title, description in record['embeds']:
+        if title:
+            content += f"\n[EMBED] Titre: {title}"
+        if description:
+            content += f"\n[EMBED] Description: {description}"
+    for filename, url in record['attachments']:
+        content += f"\n[FICHIER] {filename} - {url}"
+    timestamp = record['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
+    return f"[{timestamp}] {record['author']} ({record['author_id']}): {content}\n"
+def format_transcript_jsonl(record):
+    """Une ligne JSON par message, pour les outils qui relisent les transcripts"""
+    return json.dumps({
+        'id': record['id'],
+        'timestamp': record['timestamp'].isoformat(),
+        'author': record['author'],
+        'author_id': record['author_id'],
+        'content': record['content'],
+        'embeds': [{'title': title, 'description': description} for title, description in record['embeds']],
+        'attachments': [{'filename': filename, 'url': url} for filename, url in record['attachments']]
+    }, ensure_ascii=False) + "\n"
+TRANSCRIPT_HTML_HEADER = """<!DOCTYPE html>
+<html lang="fr"><head><meta charset="utf-8"><title>{title}</title>
+<style>
+body{{background:#313338;color:#dbdee1;font-family:"gg sans","Helvetica Neue",Arial,sans-serif;margin:0;padding:16px}}
+h1{{font-size:18px;color:#f2f3f5}}
+.msg{{padding:6px 0;border-bottom:1px solid #3f4147}}
+.author{{font-weight:600;color:#f2f3f5}}
+.meta{{color:#949ba4;font-size:12px;margin-left:6px}}
+.content{{white-space:pre-wrap;word-wrap:break-word;margin-top:2px}}
+.embed{{border-left:4px solid #a30174;background:#2b2d31;padding:6px 10px;margin-top:4px;border-radius:4px}}
+.file a{{color:#00a8fc}}
+</style></head><body><h1>{title}</h1>
+"""
+TRANSCRIPT_HTML_FOOTER = "</body></html>\n"
+def format_transcript_html(record):
+    """Bloc HTML d'un message (styles inclus dans l'en-tête du fichier)"""
+    timestamp = record['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
+    blocks = [
+        f'<div class="msg"><span class="author">{html.escape(record["author"])}</span>'
+        f'<span class="meta">{record["author_id"]} · {timestamp}</span>'
+    ]
+    if record['content']:
+        blocks.append(f'<div class="content">{html.escape(record["content"])}</div>')
+    for title, description in record['embeds']:
+        blocks.append(f'<div class="embed"><b>{html.escape(title or "")}</b><div class="content">{html.escape(description or "")}</div></div>')
+    for filename, url in record['attachments']:
+        blocks.append(f'<div class="file">📎 <a href="{html.escape(url or "", quote=True)}">{html.escape(filename or "")}</a></div>')
+    return "".join(blocks) + "</div>\n"
+TRANSCRIPT_FORMATS = {
+    'txt': {'extension': 'txt', 'line': format_transcript_line, 'header': None, 'footer': None},
+    'jsonl': {'extension': 'jsonl', 'line': format_transcript_jsonl, 'header': None, 'footer': None},
+    'html': {'extension': 'html', 'line': format_transcript_html, 'header': TRANSCRIPT_HTML_HEADER, 'footer': TRANSCRIPT_HTML_FOOTER},
+}
+def _open_transcript_compressor(compression):
+    """(compress, sync_flush, finish) pour la compression choisie ; sync_flush vide le tampon interne"""
+    if compression == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    if compression == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=10).compressobj()
+        return compressor.compress, lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), compressor.flush
+    return bytes, bytes, bytes
+TRANSCRIPT_COMPRESSIONS = {'none': None, 'gzip': 'gz', 'zstd': 'zst'}
+def transcript_settings(config):
+    """Format et compression du serveur (zstd sans le module zstandard : gzip)"""
+    settings = config.get('ticket_transcript') or {}
+    fmt = settings.get('format') if settings.get('format') in TRANSCRIPT_FORMATS else 'txt'
+    compression = settings.get('compression') if settings.get('compression') in TRANSCRIPT_COMPRESSIONS else 'none'
+    if compression == 'zstd' and zstandard is None:
+        compression = 'gzip'
+    return fmt, compression
+def _new_transcript_part(compression='none'):
+    compress, sync_flush, finish = _open_transcript_compressor(compression)
+    return {'fp': tempfile.SpooledTemporaryFile(max_size=TRANSCRIPT_SPOOL_BYTES), 'size': 0, 'pending': 0,
+            'compressed': compression != 'none', 'compress': compress, 'sync_flush': sync_flush, 'finish': finish}
+def _part_write(part, data):
+    output = part['compress'](data)
+    part['fp'].write(output)
+    part['size'] += len(output)
+    if part['compressed']:
+        part['pending'] += len(data)  # Majorant : octets bruts pas encore synchronisés
+def _part_sync(part):
+    output = part['sync_flush']()
+    part['fp'].write(output)
+    part['size'] += len(output)
+    part['pending'] = 0
+def _part_finish(part):
+    output = part['finish']()
+    part['fp'].write(output)
+    part['size'] += len(output)
+    for key in ('compressed', 'compress', 'sync_flush', 'finish', 'pending'):
+        part.pop(key)
+def _name_transcript_parts(parts, base_name, extension):
+    for index, part in enumerate(parts, 1):
+        suffix = f"-part{index}" if len(parts) > 1 else ""
+        part['filename'] = f"{base_name}{suffix}.{extension}"
+    return parts
+TRANSCRIPT_PART_MARGIN = 1024  # Réserve pour le pied de page et la fin du flux compressé
+async def write_transcript_parts(records, base_name, max_bytes=TRANSCRIPT_PART_BYTES, fmt='txt', compression='none'):
+    """Écrire les messages dans des fichiers temporaires (format et compression au choix),
+    en changeant de partie avant max_bytes. La taille compressée n'est connue qu'après un flush :
+    on borne par octets écrits + octets encore dans le compresseur, et on ne synchronise
+    qu'à l'approche de la limite"""
+    exporter = TRANSCRIPT_FORMATS[fmt]
+    header = exporter['header'].format(title=html.escape(base_name)).encode('utf-8') if exporter['header'] else b''
+    footer = exporter['footer'].encode('utf-8') if exporter['footer'] else b''
+    limit = max(max_bytes - len(footer) - TRANSCRIPT_PART_MARGIN, 1)
+    def open_part():
+        part = _new_transcript_part(compression)
+        if header:
+            _part_write(part, header)
+        return part
+    parts = [open_part()]
+    fresh = True
+    async for record in records:
+        line = exporter['line'](record).encode('utf-8')
+        part = parts[-1]
+        if not fresh and part['size'] + part['pending'] + len(line) > limit:
+            if compression != 'none':
+                _part_sync(part)
+            if part['size'] + len(line) > limit:
+                if footer:
+                    _part_write(part, footer)
+                _part_finish(part)
+                part = open_part()
+                parts.append(part)
+        _part_write(part, line)
+        fresh = False
+    if footer:
+        _part_write(parts[-1], footer)
+    _part_finish(parts[-1])
+    extension = exporter['extension']
+    if TRANSCRIPT_COMPRESSIONS[compression]:
+        extension += f".{TRANSCRIPT_COMPRESSIONS[compression]}"
+    return _name_transcript_parts(parts, base_name, extension)
+def transcript_from_text(text, base_name):
+    """Transcript d'une seule partie à partir d'un texte (message d'erreur par exemple)"""
+    part = _new_transcript_part()
+    _part_write(part, text.encode('utf-8'))
+    _part_finish(part)
+    return _name_transcript_parts([part], base_name, 'txt')
+async def create_ticket_transcript(channel, max_bytes=None):
+    """Créer le transcript complet du ticket, découpé en parties de taille bornée"""
+    base_name = f"transcript-{channel.name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    limit = min(max_bytes or TRANSCRIPT_PART_BYTES, channel.guild.filesize_limit)
+    fmt, compression = transcript_settings(get_guild_data(channel.guild.id, mark_dirty=False)['config'])
+    # Journal de capture disponible : lecture locale + petite réconciliation ; sinon historique complet
+    await flush_ticket_capture(channel.id)
+    if os.path.exists(_capture_path(channel.id)):
+        records = iter_captured_records(channel)
+    else:
+        records = iter_transcript_records(channel)
+    return await write_transcript_parts(records, base_name, limit, fmt, compression)
+# CAPTURE INCRÉMENTALE DES TICKETS
+TICKET_CAPTURE_FLUSH_SECONDS = 2
+TICKET_CAPTURE_READ_BATCH = 1000  # Lignes lues par aller-retour vers le thread
+ticket_capture_buffers = {}  # {channel_id: [lignes JSON]} en attente d'écriture
+ticket_capture_first_id = {}  # {channel_id: premier message capturé depuis le démarrage}
+ticket_capture_lock = asyncio.Lock()
+def _capture_path(channel_id):
+    return os.path.join(DATA_DIR, 'transcripts', f'{channel_id}.jsonl')
+def _capture_append(entry):
+    channel_id = entry.pop('channel_id')
+    ticket_capture_buffers.setdefault(channel_id, []).append(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+def capture_ticket_message(message):
+    """Ajouter un message au journal de son ticket (écrit au prochain flush)"""
+    record = transcript_record(message)
+    record['timestamp'] = record['timestamp'].isoformat()
+    ticket_capture_first_id.setdefault(message.channel.id, message.id)
+    _capture_append({'channel_id': message.channel.id, 't': 'message', **record})
+def capture_ticket_edit(payload):
+    """Ajouter une modification ; seuls les champs présents dans l'événement sont gardés"""
+    data = payload.data
+    edit = {'channel_id': payload.channel_id, 't': 'edit', 'id': payload.message_id}
+    if 'content' in data:
+        edit['content'] = data['content']
+    if 'embeds' in data:
+        edit['embeds'] = [(embed.get('title'), embed.get('description')) for embed in data['embeds']]
+    if 'attachments' in data:
+        edit['attachments'] = [(attachment.get('filename'), attachment.get('url')) for attachment in data['attachments']]
+    _capture_append(edit)
+def _capture_write(pending):
+    os.makedirs(os.path.join(DATA_DIR, 'transcripts'), exist_ok=True)
+    for channel_id, lines in pending.items():
+        with open(_capture_path(channel_id), 'a', encoding='utf-8') as file:
+            file.writelines(lines)
+async def flush_ticket_capture(channel_id=None):
+    """Écrire les captures en attente (toutes, ou celles d'un seul ticket)"""
+    async with ticket_capture_lock:
+        if channel_id is None:
+            pending = dict(ticket_capture_buffers)
+            ticket_capture_buffers.clear()
+        else:
+            lines = ticket_capture_buffers.pop(channel_id, None)
+            pending = {channel_id: lines} if lines else {}
+        if pending:
+            await asyncio.to_thread(_capture_write, pending)
+@tasks.loop(seconds=TICKET_CAPTURE_FLUSH_SECONDS)
+async def ticket_capture_loop():
+    await flush_ticket_capture()
+def discard_ticket_capture(channel_id):
+    """Ticket fermé : oublier son journal de capture"""
+    ticket_capture_buffers.pop(channel_id, None)
+    ticket_capture_first_id.pop(channel_id, None)
+    try:
+        os.remove(_capture_path(channel_id))
+    except OSError:
+        pass
+def _read_capture_edits(path):
+    """Première passe : dernière version connue de chaque message modifié"""
+    edits = {}
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry['t'] == 'edit':
+                edits.setdefault(entry['id'], {}).update({k: v for k, v in entry.items() if k not in ('t', 'id')})
+    return edits
+def _read_capture_batch(file):
+    entries = []
+    for line in file:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if entry['t'] == 'message':
+            entries.append(entry)
+            if len(entries) >= TICKET_CAPTURE_READ_BATCH:
+                break
+    return entries
+async def iter_captured_records(channel):
+    """Relire le journal du ticket en appliquant les modifications, puis compléter via l'API :
+    les messages antérieurs à la première capture, le trou laissé par un redémarrage du bot
+    et les messages arrivés après la dernière capture"""
+    path = _capture_path(channel.id)
+    edits = await asyncio.to_thread(_read_capture_edits, path)
+    session_first_id = ticket_capture_first_id.get(channel.id)
+    last_id = None
+    gap_filled = session_first_id is None
+    with open(path, encoding='utf-8') as file:
+        while True:
+            batch = await asyncio.to_thread(_read_capture_batch, file)
+            if not batch:
+                break
+            for record in batch:
+                if last_id and record['id'] <= last_id:
+                    continue
+                if last_id is None:
+                    # Messages antérieurs à la première capture (ticket ouvert avant la capture,
+                    # ou réindexé au démarrage) : ils ne viennent que de l'API
+                    async for missing in iter_transcript_records(channel, before=record['id']):
+                        yield missing
+                    gap_filled = gap_filled or record['id'] >= session_first_id
+                elif not gap_filled and record['id'] >= session_first_id:
+                    gap_filled = True
+                    async for missing in iter_transcript_records(channel, after=last_id, before=session_first_id):
+                        yield missing
+                record.pop('t')
+                record.update(edits.get(record['id'], {}))
+                record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+                yield record
+                last_id = record['id']
+    async for record in iter_transcript_records(channel, after=last_id):
+        yield record
+def transcript_files(parts):
+    """discord.File prêts à l'envoi ; réutilisables tant que close_transcript n'a pas été appelé"""
+    files = []
+    for part in parts:
+        part['fp'].seek(0)
+        files.append(discord.File(part['fp'], filename=part['filename']))
+    return files
+def copy_transcript(parts):
+    """Copie indépendante des parties : deux uploads simultanés ne peuvent pas partager la même position de lecture"""
+    copies = []
+    for part in parts:
+        fp = tempfile.SpooledTemporaryFile(max_size=TRANSCRIPT_SPOOL_BYTES)
+        part['fp'].seek(0)
+        shutil.copyfileobj(part['fp'], fp)
+        copies.append({'fp': fp, 'filename': part['filename']})
+    return copies
+def close_transcript(parts):
+    for part in parts:
+        part['fp'].close()
+async def send_transcript(destination, parts, **kwargs):
+    """Envoyer les parties par lots de 10 ; le premier message porte l'embed. Retourne les messages envoyés"""
+    files = transcript_files(parts)
+    messages = [await destination.send(files=files[:TRANSCRIPT_FILES_PER_MESSAGE], **kwargs)]
+    for start in range(TRANSCRIPT_FILES_PER_MESSAGE, len(files), TRANSCRIPT_FILES_PER_MESSAGE):
+        messages.append(await destination.send(files=files[start:start + TRANSCRIPT_FILES_PER_MESSAGE]))
+    return messages
+# Archives externes : coroutines (guild, channel_name, ticket_info, parts, urls) appelées à chaque fermeture.
+# urls contient [(filename, url)] si le transcript a été uploadé dans le salon de logs, sinon []
+transcript_archive_sinks = []
+async def send_transcript_dm(user, parts, embed, log_tag):
+    """DM du créateur avec les fichiers du transcript (les liens des pièces jointes Discord expirent)"""
+    try:
+        await send_transcript(user, parts, embed=embed)
+        print(f"{log_tag} ✅ DM envoyé à {user.name}")
+    except discord.Forbidden:
+        print(f"{log_tag} ❌ DM fermés pour {user.name}")
+    except Exception as e:
+        print(f"{log_tag} ❌ Erreur envoi DM: {e}")
+async def _run_archive_sink(sink, guild, channel_name, ticket_info, parts, urls, log_tag):
+    try:
+        await sink(guild, channel_name, ticket_info, parts, urls)
+    except Exception as e:
+        print(f"{log_tag} ❌ Archive {getattr(sink, '__name__', sink)}: {e}")
+async def deliver_ticket_transcript(guild, channel_name, ticket_info, parts, closed_by, creator_user=None, dm_embed=None, log_tag="[LOGS]"):
+    """Salon de logs et DM du créateur en parallèle, chacun avec les fichiers du transcript ;
+    les archives suivent l'upload des logs (elles reçoivent les liens de ses pièces jointes)"""
+    dm_parts = []
+    try:
+        async def log_and_archive():
+            log_messages = await send_ticket_log(guild, channel_name, ticket_info, parts, closed_by)
+            urls = [(attachment.filename, attachment.url) for message in log_messages for attachment in message.attachments]
+            await asyncio.gather(*(_run_archive_sink(sink, guild, channel_name, ticket_info, parts, urls, log_tag) for sink in transcript_archive_sinks))
+        jobs = [log_and_archive()]
+        if creator_user and dm_embed:
+            dm_parts = await asyncio.to_thread(copy_transcript, parts)
+            jobs.append(send_transcript_dm(creator_user, dm_parts, dm_embed, log_tag))
+        for result in await asyncio.gather(*jobs, return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f"{log_tag} ❌ Erreur envoi transcript: {result}")
+    finally:
+        close_transcript(dm_parts)
+        close_transcript(parts)
+async def send_ticket_log(guild, channel_name, ticket_info, transcript_parts, closed_by):
     """Envoyer les logs du ticket dans le salon dédié"""
     data = get_guild_data(guild.id)
     log_channel_id = data['config']['ticket_logs_channel']
     
     if not log_channel_id:
-        return None
+        return []
     
     log_channel = guild.get_channel(log_channel_id)
     if not log_channel:
-        return None
-    
-    # Créer le fichier transcript
-    transcript_file = discord.File(
-        io.StringIO(transcript),
-        filename=f"transcript-{channel_name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
-    )
+        return []
     
     # Créer l'embed de log
     embed = discord.Embed(
@@ -415,42 +1628,21 @@ async def send_ticket_log(guild, channel_name, ticket_info, transcript, closed_b
     embed.set_footer(text=f"Ticket #{ticket_info.get('number', 'N/A')}")
     
     try:
-        log_message = await log_channel.send(embed=embed, file=transcript_file)
-        return log_message
+        return await send_transcript(log_channel, transcript_parts, embed=embed)
     except Exception as e:
         print(f"Erreur lors de l'envoi du log: {e}")
-        return None
-@bot.event
-async def on_ready():
-    print(f'{bot.user} est connecté!')
-    print(f'Bot ID: {bot.user.id}')
-    print(f'Serveurs: {len(bot.guilds)}')
-    
-    try:
-        synced = await bot.tree.sync()
-        print(f"✅ Synchronisé {len(synced)} commande(s) globalement")
-        
-        if synced:
-            print("\n📋 Liste des commandes synchronisées:")
-            for cmd in synced[:20]:
-                print(f"  - /{cmd.name}")
-            if len(synced) > 20:
-                print(f"  ... et {len(synced) - 20} autres commandes")
-        
-    except Exception as e:
-        print(f"❌ Erreur lors de la synchronisation : {e}")
-    
-    cleanup_temp_voice.start()
-    check_ticket_inactivity.start()  # NOUVEAU
-    print("🔄 Task d'inactivité des tickets démarré")
-    
+        return []
 @bot.event
 async def on_member_join(member):
     """Gestion des nouveaux membres"""
-    await update_counter_channel_names(member.guild)
-    data = get_guild_data(member.guild.id)
+    data = get_guild_data(member.guild.id, mark_dirty=False)
     config = data['config']
     
+    # Anti-raid : en mode raid, pas d'autorôle, de bienvenue ni de renommage des compteurs
+    if config['antiraid']['status'] and register_join(member, config):
+        return
+    await update_counter_channel_names(member.guild)
+    
     # Autorôle
     if config['autorole']:
         try:
@@ -472,80 +1664,499 @@ async def on_member_join(member):
 @bot.event
 async def on_member_remove(member):
     """Mise à jour des compteurs à chaque départ."""
-    await update_counter_channel_names(member.guild)
-@bot.event
-async def on_message(message):
-    if message.author.bot:
+    if is_raid_active(member.guild.id):
         return
-        
-    guild_id = message.guild.id
-    data = get_guild_data(guild_id)
-    config = data['config']
-    
-    
-    # Auto-modération
-    if config['automod']:
-        # Anti-lien
-        if config['antilink']['status'] and any(domain in message.content.lower() for domain in ['http://', 'https://'] if not any(whitelist in message.content.lower() for whitelist in config['whitelist_domains'])):
-            action = config['antilink']['action']
-            await handle_automod_action(message, action, "Lien non autorisé")
-            return
-        
-        # Mots interdits
-        if any(badword in message.content.lower() for badword in config['badwords']):
-            await handle_automod_action(message, config['badword_action'], "Mot interdit")
+    await update_counter_channel_names(member.guild)
+# AUTO-MODÉRATION : ANTI-RAID
+ANTIRAID_DEFAULTS = {
+    'max_joins': 10,  # Arrivées tolérées par période (capacité du seau)
+    'per_seconds': 10,
+    'account_age_days': 7,  # Compte plus jeune = arrivée suspecte
+    'quiet_seconds': 120  # Sortie du mode raid après ce délai sans arrivée suspecte
+}
+ANTIRAID_BATCH_SIZE = 200  # Limite de guild.bulk_ban
+antiraid_state = {}  # {guild_id: {'tokens', 'updated', 'raid_since', 'last_join', 'recent', 'actioned'}}
+antiraid_queue = asyncio.Queue()  # (guild_id, member, action) traités par un seul worker
+antiraid_worker_task = None
+def antiraid_settings(config):
+    return {**ANTIRAID_DEFAULTS, **config['antiraid']}
+def is_raid_active(guild_id):
+    state = antiraid_state.get(guild_id)
+    return bool(state and state['raid_since'])
+def _join_cost(member, settings):
+    """Coût d'une arrivée dans le seau : les comptes récents ou sans avatar comptent plus"""
+    cost = 1
+    if (discord.utils.utcnow() - member.created_at).days < settings['account_age_days']:
+        cost += 1
+    if member.avatar is None:
+        cost += 1
+    return cost
+def register_join(member, config):
+    """Passer l'arrivée dans le seau à jetons de la guilde ; True si la guilde est (ou passe) en mode raid"""
+    settings = antiraid_settings(config)
+    now = time.monotonic()
+    capacity = settings['max_joins']
+    state = antiraid_state.setdefault(member.guild.id, {
+        'tokens': float(capacity), 'updated': now, 'raid_since': None, 'last_join': now,
+        'recent': deque(maxlen=ANTIRAID_BATCH_SIZE), 'actioned': 0
+    })
+    state['tokens'] = min(capacity, state['tokens'] + (now - state['updated']) * capacity / settings['per_seconds'])
+    state['updated'] = now
+    cost = _join_cost(member, settings)
+    state['recent'].append((now, member))
+    if state['raid_since']:
+        state['last_join'] = now
+        _queue_raid_action(member, settings, state)
+        return True
+    if state['tokens'] >= cost:
+        state['tokens'] -= cost
+        return False
+    # Débit anormal : mode raid, les arrivées de la dernière période sont traitées aussi
+    state['raid_since'] = datetime.now()
+    state['last_join'] = now
+    state['actioned'] = 0
+    print(f"[ANTIRAID] Mode raid activé sur {member.guild.name}")
+    for joined_at, recent_member in state['recent']:
+        if now - joined_at <= settings['per_seconds']:
+            _queue_raid_action(recent_member, settings, state)
+    asyncio.create_task(send_antiraid_log(member.guild, "🚨 Raid détecté", f"Plus de {capacity} arrivées en {settings['per_seconds']}s.\n**Action:** {settings['action']}\nBienvenue, autorôle et compteurs suspendus."))
+    return True
+def _queue_raid_action(member, settings, state):
+    state['actioned'] += 1
+    antiraid_queue.put_nowait((member.guild.id, member, settings['action']))
+async def send_antiraid_log(guild, title, description):
+    data = get_guild_data(guild.id, mark_dirty=False)
+    channel = guild.get_channel(data['config']['logs_channel']) if data['config']['logs_channel'] else None
+    if channel:
+        try:
+            await channel.send(embed=discord.Embed(title=title, description=description, color=0xff0000, timestamp=datetime.now()))
+        except:
+            pass
+async def _apply_raid_batch(guild, action, members):
+    """Une requête bulk_ban par lot quand l'API le permet, sinon une action par membre"""
+    reason = "Anti-raid"
+    if action == 'ban' and hasattr(guild, 'bulk_ban'):
+        try:
+            await guild.bulk_ban(members, reason=reason, delete_message_seconds=3600)
             return
-    
-    # Sticky messages
+        except discord.HTTPException as e:
+            print(f"[ANTIRAID] bulk_ban échoué ({e}), bannissements individuels")
+    for member in members:
+        try:
+            if action == 'ban':
+                await guild.ban(member, reason=reason, delete_message_seconds=3600)
+            elif action == 'kick':
+                await member.kick(reason=reason)
+            else:
+                await add_warning(member, guild, reason)
+        except discord.HTTPException:
+            pass
+async def antiraid_worker():
+    """Worker unique : regroupe les sanctions en attente par guilde et par action"""
+    while True:
+        batch = [await antiraid_queue.get()]
+        while len(batch) < ANTIRAID_BATCH_SIZE and not antiraid_queue.empty():
+            batch.append(antiraid_queue.get_nowait())
+        groups = {}
+        for guild_id, member, action in batch:
+            groups.setdefault((guild_id, action), {})[member.id] = member
+        for (guild_id, action), members in groups.items():
+            guild = bot.get_guild(guild_id)
+            if guild:
+                try:
+                    await _apply_raid_batch(guild, action, list(members.values()))
+                except Exception as e:
+                    print(f"[ANTIRAID] Erreur sur {guild_id}: {e}")
+        await asyncio.sleep(1)  # Laisser les arrivées suivantes s'accumuler dans le prochain lot
+@tasks.loop(seconds=15)
+async def antiraid_monitor():
+    """Sortir du mode raid après une période calme, puis rafraîchir les compteurs une seule fois"""
+    now = time.monotonic()
+    for guild_id, state in list(antiraid_state.items()):  # register_join peut ajouter une guilde pendant les await
+        if not state['raid_since']:
+            continue
+        guild = bot.get_guild(guild_id)
+        config = get_guild_data(guild_id, mark_dirty=False)['config']
+        if now - state['last_join'] < antiraid_settings(config)['quiet_seconds']:
+            continue
+        duration = datetime.now() - state['raid_since']
+        state['raid_since'] = None
+        state['recent'].clear()
+        print(f"[ANTIRAID] Fin du mode raid sur {guild_id} ({state['actioned']} membres traités)")
+        if guild:
+            await update_counter_channel_names(guild)
+            await send_antiraid_log(guild, "✅ Fin du raid", f"**Durée:** {int(duration.total_seconds())}s\n**Membres traités:** {state['actioned']}")
+# AUTO-MODÉRATION : MOTS INTERDITS
+badword_matchers = {}  # {guild_id: (regex ou None, {mot normalisé: mot d'origine}, fold)}
+BADWORD_LEET_MAP = str.maketrans({'0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b', '@': 'a', '$': 's'})
+def normalize_badword_text(text, fold):
+    """Minuscules ; en mode fold : accents retirés, casefold et leetspeak ramené aux lettres"""
+    if not fold:
+        return text.lower()
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return text.casefold().translate(BADWORD_LEET_MAP)
+def _badword_trie_pattern(node):
+    """Convertir un trie {caractère: sous-noeud, '': fin de mot} en regex à préfixes factorisés"""
+    branches = [re.escape(ch) + _badword_trie_pattern(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ''
+    if len(branches) == 1 and '' not in node:
+        return branches[0]
+    pattern = '(?:' + '|'.join(branches) + ')'
+    return pattern + '?' if '' in node else pattern
+def compile_badword_matcher(config):
+    """Compiler la liste de mots interdits d'une guilde en une seule regex"""
+    options = config.get('badword_options', {})
+    fold = options.get('fold', False)
+    lookup = {}
+    trie = {}
+    for word in config['badwords']:
+        normalized = normalize_badword_text(word, fold).strip()
+        if not normalized or normalized in lookup:
+            continue
+        lookup[normalized] = word
+        node = trie
+        for ch in normalized:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+    if not lookup:
+        return None, lookup, fold
+    pattern = _badword_trie_pattern(trie)
+    if options.get('whole_word', False):
+        pattern = rf'(?<!\w){pattern}(?!\w)'
+    return re.compile(pattern), lookup, fold
+def invalidate_badword_matcher(guild_id):
+    badword_matchers.pop(guild_id, None)
+def match_badword(guild_id, config, content):
+    """Retourner le mot interdit trouvé dans le message, ou None"""
+    matcher = badword_matchers.get(guild_id)
+    if matcher is None:
+        matcher = badword_matchers[guild_id] = compile_badword_matcher(config)
+    regex, lookup, fold = matcher
+    if regex is None:
+        return None
+    found = regex.search(normalize_badword_text(content, fold))
+    return lookup.get(found.group(0), found.group(0)) if found else None
+# AUTO-MODÉRATION : ANTI-SPAM
+ANTISPAM_DEFAULTS = {
+    'window_seconds': 8,  # Fenêtre glissante
+    'max_messages': 6,
+    'max_duplicates': 3,  # Messages identiques dans la fenêtre
+    'max_mentions': 8,
+    'max_attachments': 6
+}
+ANTISPAM_RING_SIZE = 32  # Événements gardés par membre (borne aussi les seuils)
+ANTISPAM_IDLE_SECONDS = 300  # Un membre silencieux depuis 5 min est oublié
+ANTISPAM_MAX_TRACKED = 5000  # Membres suivis au maximum par serveur
+antispam_trackers = {}  # {guild_id: OrderedDict {user_id: SpamWindow}} du moins au plus récent
+antispam_cooldowns = CooldownStore(bucket_seconds=10)  # {(guild_id, user_id): fin de la sanction en cours}
+class SpamWindow:
+    """Compteurs glissants d'un membre : anneau borné d'événements + totaux tenus à jour"""
+    __slots__ = ('events', 'duplicates', 'mentions', 'attachments', 'last_seen')
+    def __init__(self):
+        self.events = deque()  # (instant, empreinte du contenu, mentions, pièces jointes)
+        self.duplicates = Counter()
+        self.mentions = 0
+        self.attachments = 0
+        self.last_seen = 0.0
+    def _drop_oldest(self):
+        _, digest, mentions, attachments = self.events.popleft()
+        if digest is not None:
+            self.duplicates[digest] -= 1
+            if not self.duplicates[digest]:
+                del self.duplicates[digest]
+        self.mentions -= mentions
+        self.attachments -= attachments
+    def push(self, now, window, digest, mentions, attachments):
+        while self.events and (now - self.events[0][0] > window or len(self.events) >= ANTISPAM_RING_SIZE):
+            self._drop_oldest()
+        self.events.append((now, digest, mentions, attachments))
+        if digest is not None:
+            self.duplicates[digest] += 1
+        self.mentions += mentions
+        self.attachments += attachments
+        self.last_seen = now
+def antispam_settings(config):
+    return {**ANTISPAM_DEFAULTS, **config['antispam']}
+def check_spam(message, config):
+    """Enregistrer le message dans la fenêtre du membre ; retourner le motif si un seuil est dépassé"""
+    settings = antispam_settings(config)
+    now = time.monotonic()
+    users = antispam_trackers.setdefault(message.guild.id, OrderedDict())
+    # Éviction des membres inactifs (les plus anciens sont en tête)
+    while users:
+        oldest_id, oldest = next(iter(users.items()))
+        if len(users) < ANTISPAM_MAX_TRACKED and now - oldest.last_seen < ANTISPAM_IDLE_SECONDS:
+            break
+        del users[oldest_id]
+    window = users.pop(message.author.id, None) or SpamWindow()
+    users[message.author.id] = window
+    content = message.content.strip().lower()
+    digest = hash(content) if content else None
+    mentions = len(message.raw_mentions) + len(message.raw_role_mentions) + (1 if message.mention_everyone else 0)
+    window.push(now, settings['window_seconds'], digest, mentions, len(message.attachments))
+    if len(window.events) > settings['max_messages']:
+        reason = "messages trop rapides"
+    elif digest is not None and window.duplicates[digest] > settings['max_duplicates']:
+        reason = "messages identiques"
+    elif window.mentions > settings['max_mentions']:
+        reason = "mentions en masse"
+    elif window.attachments > settings['max_attachments']:
+        reason = "pièces jointes en masse"
+    else:
+        return None
+    # Repartir de zéro pour ne pas sanctionner chaque message suivant
+    del users[message.author.id]
+    return reason
+# AUTO-MODÉRATION : LIENS
+antilink_whitelists = {}  # {guild_id: trie des domaines autorisés, labels inversés}
+# Hôte avec schéma optionnel ; les domaines nus ne comptent que si leur TLD est connu.
+# Après un schéma, l'userinfo est sautée jusqu'au dernier '@' (https://youtube.com@evil.com -> evil.com) ;
+# sans schéma, un hôte précédé de '@' est une adresse mail et n'est pas retenu
+LINK_PATTERN = re.compile(
+    r'(?i)(?:(?<![\w.-])(?P<scheme>[a-z][a-z0-9+.-]*)://(?:[^\s/?#<>]*@)?|(?<![\w@.-]))'
+    r'(?P<host>(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+(?P<tld>[a-z]{2,63}|\d{1,3}))'
+    r'(?::\d{1,5})?(?P<path>/[^\s<>]*)?'
+)
+KNOWN_TLDS = frozenset((
+    'com', 'net', 'org', 'io', 'gg', 'co', 'me', 'tv', 'fr', 'be', 'ch', 'ca', 'uk', 'de', 'eu', 'es', 'it', 'nl',
+    'ru', 'us', 'info', 'biz', 'xyz', 'app', 'dev', 'link', 'ly', 'to', 'gl', 'site', 'online', 'store', 'shop',
+    'club', 'live', 'top', 'fun', 'pw', 'cc', 'ws', 'su', 'tk', 'ml', 'ga', 'cf', 'gq', 'pro', 'gift', 'gifts'
+))
+DISCORD_INVITE_HOSTS = ('discord.com', 'discordapp.com')
+def _domain_labels(domain):
+    """'https://www.YouTube.com/x' -> ['com', 'youtube', 'www']"""
+    domain = re.sub(r'^[a-z][a-z0-9+.-]*://', '', domain.strip().lower())
+    domain = domain.split('/', 1)[0].split(':', 1)[0].strip('.')
+    return domain.split('.')[::-1] if domain else []
+def build_domain_trie(domains):
+    trie = {}
+    for domain in domains:
+        node = trie
+        for label in _domain_labels(domain):
+            node = node.setdefault(label, {})
+        node[''] = True
+    return trie
+def is_domain_whitelisted(trie, host):
+    """Autorisé si un domaine de la liste est un suffixe de l'hôte (sous-domaines inclus)"""
+    node = trie
+    for label in host.split('.')[::-1]:
+        node = node.get(label)
+        if node is None:
+            return False
+        if '' in node:
+            return True
+    return False
+def extract_link_hosts(content):
+    """Hôtes des liens du message (URLs, domaines nus, invitations Discord normalisées en discord.gg)"""
+    hosts = []
+    for match in LINK_PATTERN.finditer(content):
+        host = match.group('host').lower()
+        if not match.group('scheme') and match.group('tld').lower() not in KNOWN_TLDS:
+            continue
+        if host.startswith('www.'):
+            host = host[4:]
+        if host in DISCORD_INVITE_HOSTS and (match.group('path') or '').lower().startswith('/invite/'):
+            host = 'discord.gg'
+        hosts.append(host)
+    return hosts
+def invalidate_antilink_whitelist(guild_id):
+    antilink_whitelists.pop(guild_id, None)
+def find_forbidden_link(guild_id, config, content):
+    """Retourner le premier hôte hors liste blanche, ou None"""
+    if '.' not in content:
+        return None
+    trie = antilink_whitelists.get(guild_id)
+    if trie is None:
+        trie = antilink_whitelists[guild_id] = build_domain_trie(config['whitelist_domains'])
+    for host in extract_link_hosts(content):
+        if not is_domain_whitelisted(trie, host):
+            return host
+    return None
+# PIPELINE DES MESSAGES
+MESSAGE_STAGE_SLOW_MS = 250  # Au-delà, l'étape est signalée dans la console
+MESSAGE_STAGE_BUDGET_MS = 1000  # Au-delà, une étape attendue passe en tâche de fond et la suite continue
+message_pipeline_stats = {}  # {étape: {'count', 'total', 'max'}} en secondes
+message_pipeline_tasks = set()  # Références des étapes lancées en tâche de fond
+def spawn_pipeline_task(coro):
+    """Lancer une coroutine du pipeline sans l'attendre, en gardant une référence jusqu'à sa fin"""
+    task = asyncio.create_task(coro)
+    message_pipeline_tasks.add(task)
+    task.add_done_callback(message_pipeline_tasks.discard)
+    return task
+async def _delete_quietly(message):
+    try:
+        await message.delete()
+    except:
+        pass
+async def stage_author_filter(message, context):
+    """Messages des autres bots : ignorés ; les nôtres ne passent qu'aux étapes 'bots'"""
+    return message.author.bot and message.author.id != bot.user.id
+async def stage_ticket_capture(message, context):
+    """Tous les messages des tickets (membres, staff, bots) alimentent le journal de capture"""
+    if message.channel.id in ticket_registry:
+        capture_ticket_message(message)
+    return False
+async def stage_automod(message, context):
+    """Décision immédiate (le message bloqué arrête le pipeline) ; suppression et sanction
+    partent en tâche de fond pour qu'une API lente ne retienne pas le message"""
+    config = context['config']
+    if not config['automod']:
+        return False
+    guild_id = message.guild.id
+    # Anti-lien
+    forbidden_host = find_forbidden_link(guild_id, config, message.content) if config['antilink']['status'] else None
+    if forbidden_host:
+        spawn_pipeline_task(handle_automod_action(message, config['antilink']['action'], "Lien non autorisé", detail=forbidden_host))
+        return True
+    # Mots interdits
+    badword = match_badword(guild_id, config, message.content)
+    if badword:
+        spawn_pipeline_task(handle_automod_action(message, config['badword_action'], "Mot interdit", detail=badword))
+        return True
+    # Anti-spam
+    if config['antispam']['status']:
+        spam_key = (guild_id, message.author.id)
+        if antispam_cooldowns.active(spam_key):
+            # Sanction toute récente : supprimer la suite de la rafale sans sanctionner à nouveau
+            spawn_pipeline_task(_delete_quietly(message))
+            return True
+        spam_reason = check_spam(message, config)
+        if spam_reason:
+            antispam_cooldowns.set(spam_key, antispam_settings(config)['window_seconds'])
+            spawn_pipeline_task(handle_automod_action(message, config['antispam']['action'], "Spam détecté", detail=spam_reason))
+            return True
+    return False
+async def stage_sticky(message, context):
+    guild_id = message.guild.id
     if guild_id in sticky_messages and message.channel.id in sticky_messages[guild_id]:
         await handle_sticky_message(message)
-    
-    # NOUVEAU : Détecter l'activité dans les tickets
-    if message.channel.name.startswith('ticket-'):
-        # Ne compter que les messages des utilisateurs (pas du bot ou staff)
-        ticket_roles = config.get('ticket_roles', [])
-        user_roles = [role.id for role in message.author.roles]
-        is_staff = any(role_id in user_roles for role_id in ticket_roles)
-        
-        # Si c'est un utilisateur normal (pas staff, pas bot)
-        if not is_staff and not message.author.bot:
-            # Récupérer l'ID du créateur depuis le tracker
-            if guild_id in ticket_activity_tracker:
-                if message.channel.id in ticket_activity_tracker[guild_id]:
-                    creator_id = ticket_activity_tracker[guild_id][message.channel.id]['creator_id']
-                    # Si c'est le créateur qui parle, reset l'activité
-                    if message.author.id == creator_id:
-                        print(f"[INACTIVITY] Activité détectée dans {message.channel.name} par le créateur")
-                        update_ticket_activity(guild_id, message.channel.id, creator_id)
-                        
-                        # Supprimer le message d'avertissement s'il existe
-                        warning_msg_id = ticket_activity_tracker[guild_id][message.channel.id].get('warning_message_id')
-                        if warning_msg_id:
-                            try:
-                                warning_msg = await message.channel.fetch_message(warning_msg_id)
-                                await warning_msg.delete()
-                                print(f"[INACTIVITY] Message d'avertissement supprimé")
-                            except:
-                                pass
-                        
-                        # Reset le flag warning
-                        ticket_activity_tracker[guild_id][message.channel.id]['warning_sent'] = False
-                        ticket_activity_tracker[guild_id][message.channel.id]['warning_message_id'] = None
-    
+    return False
+async def stage_ticket_activity(message, context):
+    """Le créateur d'un ticket qui écrit remet son compteur d'inactivité à zéro"""
+    guild_id = message.guild.id
+    if message.channel.id not in ticket_registry:
+        return False
+    tracked = ticket_activity_tracker.get(guild_id, {}).get(message.channel.id)
+    if not tracked or message.author.id != tracked['creator_id']:
+        return False
+    # Ne compter que les messages des utilisateurs (pas du staff)
+    ticket_roles = context['config'].get('ticket_roles', [])
+    if any(role.id in ticket_roles for role in getattr(message.author, 'roles', [])):
+        return False
+    print(f"[INACTIVITY] Activité détectée dans {message.channel.name} par le créateur")
+    warning_msg_id = tracked.get('warning_message_id')
+    update_ticket_activity(guild_id, message.channel.id, tracked['creator_id'])
+    # Supprimer le message d'avertissement s'il existe
+    if warning_msg_id:
+        try:
+            await message.channel.get_partial_message(warning_msg_id).delete()
+            print(f"[INACTIVITY] Message d'avertissement supprimé")
+        except:
+            pass
+    return False
+async def stage_translate(message, context):
+    """Ajouter le bouton de traduction sous les embeds envoyés par le bot"""
+    # Embed sans bouton uniquement
+    if not message.embeds or message.components:
+        return False
+    texts = []
+    for embed in message.embeds:
+        if embed.title:
+            texts.append(embed.title)
+        if embed.description:
+            texts.append(embed.description)
+        for field in embed.fields:
+            texts.append(field.name)
+            texts.append(field.value)
+    full_text = "\n".join(texts).strip()
+    if not full_text:
+        return False
+    # ⏳ Petite pause pour laisser Discord "stabiliser" le message
+    await asyncio.sleep(0.3)
+    try:
+        await message.edit(view=TranslateView(full_text))
+    except discord.HTTPException:
+        # Message supprimé, permissions insuffisantes ou rate limit → on ignore silencieusement
+        pass
+    return False
+async def stage_commands(message, context):
     await bot.process_commands(message)
-async def handle_automod_action(message, action, reason):
-    """Gère les actions d'auto-modération"""
+    return False
+# (nom, fonction, options) dans l'ordre d'exécution ; une étape qui retourne True arrête la suite.
+# users / bots : l'étape voit les messages des membres / nos propres messages ; guild : ignorée en MP ;
+# background : lancée sans attendre (étapes réseau qui ne décident pas de la suite)
+MESSAGE_STAGES = [
+    ('ticket_capture', stage_ticket_capture, {'users': True, 'bots': True, 'guild': True, 'background': False}),
+    ('author_filter', stage_author_filter, {'users': True, 'bots': True, 'guild': False, 'background': False}),
+    ('automod', stage_automod, {'users': True, 'bots': False, 'guild': True, 'background': False}),
+    ('sticky', stage_sticky, {'users': True, 'bots': False, 'guild': True, 'background': True}),
+    ('ticket_activity', stage_ticket_activity, {'users': True, 'bots': False, 'guild': True, 'background': False}),
+    ('translate', stage_translate, {'users': False, 'bots': True, 'guild': False, 'background': True}),
+    ('commands', stage_commands, {'users': True, 'bots': False, 'guild': False, 'background': False}),
+]
+def _record_stage_timing(name, elapsed):
+    stats = message_pipeline_stats.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+    stats['count'] += 1
+    stats['total'] += elapsed
+    stats['max'] = max(stats['max'], elapsed)
+    if elapsed * 1000 >= MESSAGE_STAGE_SLOW_MS:
+        print(f"[PIPELINE] Étape {name} lente : {elapsed * 1000:.0f} ms")
+async def _run_stage(name, stage, message, context):
+    start = time.perf_counter()
+    try:
+        return await stage(message, context)
+    except Exception as e:
+        print(f"[PIPELINE] Erreur dans l'étape {name}: {e}")
+        return False
+    finally:
+        _record_stage_timing(name, time.perf_counter() - start)
+async def _run_stage_bounded(name, stage, message, context):
+    """Attendre l'étape au plus MESSAGE_STAGE_BUDGET_MS : au-delà elle se termine en tâche de fond
+    (sans être annulée, pour ne pas laisser une action à moitié appliquée) et ne peut plus
+    arrêter la suite du pipeline : les étapes qui bloquent (automod) décident donc sans attendre le réseau"""
+    task = asyncio.create_task(_run_stage(name, stage, message, context))
+    done, _ = await asyncio.wait({task}, timeout=MESSAGE_STAGE_BUDGET_MS / 1000)
+    if task in done:
+        return task.result()
+    message_pipeline_tasks.add(task)
+    task.add_done_callback(message_pipeline_tasks.discard)
+    print(f"[PIPELINE] Étape {name} hors budget ({MESSAGE_STAGE_BUDGET_MS} ms) : poursuivie en tâche de fond")
+    return False
+@bot.event
+async def on_message(message: discord.Message):
+    """Point d'entrée unique : exécute les étapes de MESSAGE_STAGES dans l'ordre"""
+    if not bot.user:
+        return
+    context = {'config': None}
+    if message.guild:
+        context['config'] = get_guild_data(message.guild.id, mark_dirty=False)['config']
+    own_message = message.author.id == bot.user.id
+    for name, stage, options in MESSAGE_STAGES:
+        if not options['bots' if own_message else 'users']:
+            continue
+        if options['guild'] and message.guild is None:
+            continue
+        if options['background']:
+            spawn_pipeline_task(_run_stage(name, stage, message, context))
+            continue
+        if await _run_stage_bounded(name, stage, message, context):
+            return
+async def handle_automod_action(message, action, reason, detail=None):
+    """Gère les actions d'auto-modération (detail : précision gardée pour les logs, jamais affichée dans le salon)"""
+    logged_reason = f"{reason} ({detail})" if detail else reason
     try:
         await message.delete()
         
         if action == 'warn':
-            await add_warning(message.author, message.guild, reason)
+            await add_warning(message.author, message.guild, logged_reason)
             await message.channel.send(f"⚠️ {message.author.mention}, {reason.lower()}!", delete_after=5)
         elif action == 'kick':
-            await message.author.kick(reason=reason)
+            await message.author.kick(reason=logged_reason)
             await message.channel.send(f"👢 {message.author} a été exclu pour : {reason}", delete_after=5)
         elif action == 'ban':
-            await message.author.ban(reason=reason)
+            await message.author.ban(reason=logged_reason)
             await message.channel.send(f"🔨 {message.author} a été banni pour : {reason}", delete_after=5)
     except:
         pass
@@ -553,6 +2164,7 @@ async def add_warning(member, guild, reason):
     """Ajouter un avertissement"""
     guild_id = guild.id
     user_id = member.id
+    get_guild_data(guild_id, mark_dirty=False)
     
     if guild_id not in warnings:
         warnings[guild_id] = {}
@@ -565,6 +2177,8 @@ async def add_warning(member, guild, reason):
         'moderator': 'Auto-Modération'
     }
     warnings[guild_id][user_id].append(warning)
+    journal_record('warnings', guild_id, 'warning_add', user=user_id, warning=warning)
+    mark_guild_dirty(guild_id, 'warnings')
 async def handle_sticky_message(message):
     """Gère les messages sticky"""
     guild_id = message.guild.id
@@ -587,28 +2201,19 @@ async def handle_sticky_message(message):
                 embed.set_author(name=sticky_data['bot_name'])
                 new_message = await message.channel.send(embed=embed)
                 sticky_messages[guild_id][channel_id]['message_id'] = new_message.id
+                mark_guild_dirty(guild_id, 'sticky')
             except:
                 pass
 @tasks.loop(minutes=1)
 async def cleanup_temp_voice():
-    """Nettoie les salons vocaux temporaires vides"""
-    to_remove = set()
+    """Nettoie les salons vocaux temporaires vides (via la file de la guilde, comme on_voice_state_update)"""
     for channel_id in list(temp_voice_channels):  # Convertir en liste pour éviter les erreurs
-        try:
-            channel = bot.get_channel(channel_id)
-            if channel and len(channel.members) == 0:
-                await channel.delete(reason="Salon vocal temporaire vide")
-                to_remove.add(channel_id)
-        except Exception as e:
-            print(f"Erreur lors du nettoyage du salon vocal {channel_id}: {e}")
-            to_remove.add(channel_id)
-    
-    # Retirer les channels supprimés ou en erreur
-    for channel_id in to_remove:
-        temp_voice_channels.discard(channel_id)
+        channel = bot.get_channel(channel_id)
+        if channel and len(channel.members) == 0:
+            voctemp_queue.submit(channel.guild.id, lambda channel=channel: delete_temp_voice_room(channel))
 async def log_action(guild, action, target, moderator, reason):
     """Enregistre une action dans les logs"""
-    data = get_guild_data(guild.id)
+    data = get_guild_data(guild.id, mark_dirty=False)
     if data['config']['logs_channel']:
         try:
             channel = guild.get_channel(data['config']['logs_channel'])
@@ -624,201 +2229,211 @@ async def log_action(guild, action, target, moderator, reason):
                 await channel.send(embed=embed)
         except:
             pass
-@tasks.loop(hours=1)
-async def check_ticket_inactivity():
-    """Vérifier l'inactivité des tickets toutes les heures"""
-    print("\n[INACTIVITY] ========== Vérification des tickets inactifs ==========")
+# Échéances d'inactivité : une entrée par ticket suivi, réveillée à son prochain avertissement / fermeture
+INACTIVITY_RETRY_SECONDS = 3600  # Nouvel essai si l'avertissement n'a pas pu être envoyé
+def ticket_inactivity_deadline(guild_id, channel_id):
+    """Prochaine échéance du ticket (timestamp) : avertissement, ou fermeture si l'avertissement est parti"""
+    config = get_guild_data(guild_id, mark_dirty=False)['config']['inactivity_config']
+    tracked = ticket_activity_tracker.get(guild_id, {}).get(channel_id)
+    if not config['enabled'] or not tracked:
+        return None
+    hours = config['final_close_hours'] if tracked['warning_sent'] else config['delay_hours']
+    return (tracked['last_activity'] + timedelta(hours=hours)).timestamp()
+def schedule_ticket_inactivity(guild_id, channel_id):
+    """(Re)programmer l'échéance du ticket ; l'annuler si le système est désactivé ou le ticket plus suivi"""
+    deadline = ticket_inactivity_deadline(guild_id, channel_id)
+    if deadline is None:
+        inactivity_scheduler.cancel((guild_id, channel_id))
+    else:
+        inactivity_scheduler.schedule((guild_id, channel_id), deadline)
+def reschedule_guild_inactivity(guild_id):
+    """Après un changement de configuration : recalculer toutes les échéances du serveur"""
+    for channel_id in list(ticket_activity_tracker.get(guild_id, {})):
+        schedule_ticket_inactivity(guild_id, channel_id)
+def sync_ticket_inactivity(guild):
+    """Au démarrage : reprendre les échéances du tracker persisté (horloges conservées),
+    oublier les salons disparus et suivre les tickets ouverts encore inconnus du tracker"""
+    tracked = ticket_activity_tracker.get(guild.id, {})
+    for channel_id in list(tracked):
+        if guild.get_channel(channel_id) is None:
+            remove_ticket_from_tracker(guild.id, channel_id)
+        else:
+            schedule_ticket_inactivity(guild.id, channel_id)
+    for ticket in get_guild_tickets(guild.id):
+        if ticket['channel_id'] not in tracked and ticket['creator_id']:
+            update_ticket_activity(guild.id, ticket['channel_id'], ticket['creator_id'])
+            print(f"[INACTIVITY] Ticket {ticket['channel_id']} ajouté au suivi")
+async def auto_close_inactive_ticket(guild, channel, ticket, creator_id):
+    """Fermeture automatique : transcript, logs + DM, puis suppression du salon"""
+    print(f"[INACTIVITY] ⚠️ Fermeture automatique de {channel.name} (48h dépassées)")
     
-    for guild in bot.guilds:
-        guild_id = guild.id
-        data = get_guild_data(guild_id)
-        config = data['config']['inactivity_config']
+    # Créer le transcript
+    try:
+        transcript = await create_ticket_transcript(channel)
+    except Exception as e:
+        transcript = transcript_from_text(f"Erreur: {e}", f"transcript-{channel.name}")
+    
+    # Extraire les infos
+    ticket_number = ticket['number']
+    ticket_category = ticket['category']
+    creator_user = guild.get_member(creator_id)
+    
+    ticket_info_dict = {
+        'number': ticket_number,
+        'category': ticket_category,
+        'creator': creator_user.mention if creator_user else "Inconnu"
+    }
+    
+    # Message de fermeture dans le ticket
+    try:
+        close_embed = discord.Embed(
+            title="🔒 Ticket Fermé Automatiquement",
+            description="Ce ticket a été fermé automatiquement après 48h d'inactivité sans réponse.",
+            color=0xff0000,
+            timestamp=datetime.now()
+        )
+        await channel.send(embed=close_embed)
+    except:
+        pass
+    
+    await asyncio.sleep(3)
+    
+    # Envoyer les logs puis le DM
+    dm_embed = discord.Embed(
+        title="📄 Transcript de votre ticket",
+        description="**Raison:** Fermé automatiquement après 48h d'inactivité",
+        color=0xff0000,
+        timestamp=datetime.now()
+    )
+    dm_embed.add_field(name="🎫 Ticket", value=channel.name, inline=True)
+    dm_embed.add_field(name="📊 Numéro", value=f"#{ticket_number}", inline=True)
+    dm_embed.add_field(name="🏷️ Catégorie", value=ticket_category, inline=True)
+    dm_embed.set_footer(text=f"Serveur: {guild.name}")
+    await deliver_ticket_transcript(
+        guild,
+        channel.name,
+        ticket_info_dict,
+        transcript,
+        bot.user,  # Fermé par le bot
+        creator_user,
+        dm_embed,
+        log_tag="[INACTIVITY]"
+    )
+    
+    # Retirer du tracker
+    remove_ticket_from_tracker(guild.id, channel.id)
+    
+    # Supprimer le salon
+    try:
+        await channel.delete(reason="Fermeture automatique après 48h d'inactivité")
+        print(f"[INACTIVITY] ✅ {channel.name} supprimé")
+    except Exception as e:
+        print(f"[INACTIVITY] ❌ Erreur suppression: {e}")
+async def warn_inactive_ticket(guild, channel, tracked, hours_inactive):
+    """Avertissement d'inactivité avec les boutons garder / fermer ; retourne True si envoyé"""
+    print(f"[INACTIVITY] 📢 Envoi avertissement pour {channel.name}")
+    data = get_guild_data(guild.id, mark_dirty=False)
+    config = data['config']['inactivity_config']
+    
+    # Récupérer le créateur
+    creator_user = guild.get_member(tracked['creator_id'])
+    if not creator_user:
+        print(f"[INACTIVITY] ⚠️ Créateur introuvable pour {channel.name}")
+        return False
+    
+    # Créer l'embed personnalisé
+    embed_config = config['embed']
+    try:
+        color_value = int(embed_config['color'].replace('#', ''), 16)
+    except:
+        color_value = 0xff9900
+    
+    description = embed_config['description'].replace('{hours}', str(int(hours_inactive))).replace('{mention}', creator_user.mention)
+    
+    embed = discord.Embed(
+        title=embed_config['title'],
+        description=description,
+        color=color_value,
+        timestamp=datetime.now()
+    )
+    
+    if embed_config.get('image_url'):
+        embed.set_image(url=embed_config['image_url'])
+    
+    embed.set_footer(text=f"Ticket inactif depuis {int(hours_inactive)}h")
+    
+    # Créer la view avec les boutons
+    view = InactivityView(guild.id, channel.id, tracked['creator_id'])
+    
+    # Envoyer le message
+    try:
+        warning_message = await channel.send(content=creator_user.mention, embed=embed, view=view)
         
-        # Si le système est désactivé, passer
-        if not config['enabled']:
-            continue
+        # Mettre à jour le tracker
+        tracked['warning_sent'] = True
+        tracked['warning_message_id'] = warning_message.id
+        journal_record('ticket_activity', guild.id, 'ticket_activity', channel=channel.id, entry=tracked)
+        mark_guild_dirty(guild.id, 'ticket_activity')
         
-        print(f"[INACTIVITY] Vérification pour {guild.name}")
+        print(f"[INACTIVITY] ✅ Avertissement envoyé dans {channel.name}")
         
-        # Parcourir tous les salons texte
-        for channel in guild.text_channels:
-            # Vérifier si c'est un ticket
-            if not channel.name.startswith('ticket-'):
-                continue
-            
-            channel_id = channel.id
-            
-            # Vérifier si le ticket est dans le tracker
-            if guild_id not in ticket_activity_tracker:
-                continue
-            if channel_id not in ticket_activity_tracker[guild_id]:
-                # Ticket pas encore tracké, l'ajouter
-                # Essayer d'extraire le créateur depuis le topic
-                creator_id = None
-                if channel.topic and "ID:" in channel.topic:
-                    try:
-                        user_id_str = channel.topic.split("ID:")[1].split(")")[0].strip()
-                        creator_id = int(user_id_str)
-                        update_ticket_activity(guild_id, channel_id, creator_id)
-                        print(f"[INACTIVITY] Ticket {channel.name} ajouté au suivi")
-                    except:
-                        pass
-                continue
-            
-            # Obtenir les infos du ticket
-            ticket_info = ticket_activity_tracker[guild_id][channel_id]
-            creator_id = ticket_info['creator_id']
-            warning_sent = ticket_info['warning_sent']
-            extensions = ticket_info.get('extensions', 0)
-            
-            # Calculer l'inactivité
-            hours_inactive = get_ticket_inactivity_hours(guild_id, channel_id)
-            delay_hours = config['delay_hours']
-            final_close_hours = config['final_close_hours']
-            
-            print(f"[INACTIVITY] {channel.name}: {hours_inactive}h d'inactivité (warning_sent={warning_sent})")
-            
-            # CAS 1: Fermeture automatique après 48h (warning déjà envoyé et pas de réponse)
-            if warning_sent and hours_inactive >= final_close_hours:
-                print(f"[INACTIVITY] ⚠️ Fermeture automatique de {channel.name} (48h dépassées)")
-                
-                # Créer le transcript
-                try:
-                    transcript_text = await create_ticket_transcript(channel)
-                except Exception as e:
-                    transcript_text = f"Erreur: {e}"
-                
-                # Extraire les infos
-                channel_parts = channel.name.split('-')
-                ticket_number = channel_parts[-1] if len(channel_parts) >= 4 else "N/A"
-                ticket_category = channel_parts[1].title() if len(channel_parts) >= 4 else "N/A"
-                creator_user = guild.get_member(creator_id)
-                
-                ticket_info_dict = {
-                    'number': ticket_number,
-                    'category': ticket_category,
-                    'creator': creator_user.mention if creator_user else "Inconnu"
-                }
-                
-                # Message de fermeture dans le ticket
-                try:
-                    close_embed = discord.Embed(
-                        title="🔒 Ticket Fermé Automatiquement",
-                        description="Ce ticket a été fermé automatiquement après 48h d'inactivité sans réponse.",
-                        color=0xff0000,
-                        timestamp=datetime.now()
-                    )
-                    await channel.send(embed=close_embed)
-                except:
-                    pass
-                
-                await asyncio.sleep(3)
-                
-                # Envoyer les logs
-                await send_ticket_log(
-                    guild,
-                    channel.name,
-                    ticket_info_dict,
-                    transcript_text,
-                    bot.user  # Fermé par le bot
-                )
-                
-                # Envoyer en DM
-                if creator_user:
-                    try:
-                        dm_embed = discord.Embed(
-                            title="📄 Transcript de votre ticket",
-                            description="**Raison:** Fermé automatiquement après 48h d'inactivité",
-                            color=0xff0000,
-                            timestamp=datetime.now()
-                        )
-                        dm_embed.add_field(name="🎫 Ticket", value=channel.name, inline=True)
-                        dm_embed.add_field(name="📊 Numéro", value=f"#{ticket_number}", inline=True)
-                        dm_embed.add_field(name="🏷️ Catégorie", value=ticket_category, inline=True)
-                        dm_embed.set_footer(text=f"Serveur: {guild.name}")
-                        
-                        filename = f"transcript-{channel.name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
-                        file_for_dm = discord.File(io.StringIO(transcript_text), filename=filename)
-                        await creator_user.send(embed=dm_embed, file=file_for_dm)
-                        print(f"[INACTIVITY] ✅ DM envoyé à {creator_user.name}")
-                    except:
-                        pass
-                
-                # Retirer du tracker
-                remove_ticket_from_tracker(guild_id, channel_id)
-                
-                # Supprimer le salon
-                try:
-                    await channel.delete(reason="Fermeture automatique après 48h d'inactivité")
-                    print(f"[INACTIVITY] ✅ {channel.name} supprimé")
-                except Exception as e:
-                    print(f"[INACTIVITY] ❌ Erreur suppression: {e}")
-                
-                continue
+        # Notifier le staff si activé
+        if config['notify_staff'] and data['config']['ticket_roles']:
+            staff_mentions = []
+            for role_id in data['config']['ticket_roles']:
+                role = guild.get_role(role_id)
+                if role:
+                    staff_mentions.append(role.mention)
             
-            # CAS 2: Envoi du message d'avertissement après 24h
-            if not warning_sent and hours_inactive >= delay_hours:
-                print(f"[INACTIVITY] 📢 Envoi avertissement pour {channel.name}")
-                
-                # Récupérer le créateur
-                creator_user = guild.get_member(creator_id)
-                if not creator_user:
-                    print(f"[INACTIVITY] ⚠️ Créateur introuvable pour {channel.name}")
-                    continue
-                
-                # Créer l'embed personnalisé
-                embed_config = config['embed']
-                try:
-                    color_value = int(embed_config['color'].replace('#', ''), 16)
-                except:
-                    color_value = 0xff9900
-                
-                description = embed_config['description'].replace('{hours}', str(int(hours_inactive))).replace('{mention}', creator_user.mention)
-                
-                embed = discord.Embed(
-                    title=embed_config['title'],
-                    description=description,
-                    color=color_value,
-                    timestamp=datetime.now()
+            if staff_mentions:
+                staff_notif = discord.Embed(
+                    title="⚠️ Ticket Inactif - Notification Staff",
+                    description=f"Le ticket {channel.mention} est inactif depuis {int(hours_inactive)}h.",
+                    color=0xffa500
                 )
-                
-                if embed_config.get('image_url'):
-                    embed.set_image(url=embed_config['image_url'])
-                
-                embed.set_footer(text=f"Ticket inactif depuis {int(hours_inactive)}h")
-                
-                # Créer la view avec les boutons
-                view = InactivityView(guild_id, channel_id, creator_id)
-                
-                # Envoyer le message
-                try:
-                    warning_message = await channel.send(content=creator_user.mention, embed=embed, view=view)
-                    
-                    # Mettre à jour le tracker
-                    ticket_activity_tracker[guild_id][channel_id]['warning_sent'] = True
-                    ticket_activity_tracker[guild_id][channel_id]['warning_message_id'] = warning_message.id
-                    
-                    print(f"[INACTIVITY] ✅ Avertissement envoyé dans {channel.name}")
-                    
-                    # Notifier le staff si activé
-                    if config['notify_staff'] and data['config']['ticket_roles']:
-                        staff_mentions = []
-                        for role_id in data['config']['ticket_roles']:
-                            role = guild.get_role(role_id)
-                            if role:
-                                staff_mentions.append(role.mention)
-                        
-                        if staff_mentions:
-                            staff_notif = discord.Embed(
-                                title="⚠️ Ticket Inactif - Notification Staff",
-                                description=f"Le ticket {channel.mention} est inactif depuis {int(hours_inactive)}h.",
-                                color=0xffa500
-                            )
-                            await channel.send(content=" ".join(staff_mentions), embed=staff_notif, delete_after=60)
-                    
-                except Exception as e:
-                    print(f"[INACTIVITY] ❌ Erreur envoi avertissement: {e}")
+                await channel.send(content=" ".join(staff_mentions), embed=staff_notif, delete_after=60)
+        return True
+    except Exception as e:
+        print(f"[INACTIVITY] ❌ Erreur envoi avertissement: {e}")
+        return tracked['warning_sent']
+async def process_ticket_inactivity(key):
+    """Échéance atteinte pour un ticket : fermeture (avertissement resté sans réponse) ou avertissement"""
+    guild_id, channel_id = key
+    guild = bot.get_guild(guild_id)
+    ticket = get_ticket(channel_id)
+    channel = guild.get_channel(channel_id) if guild else None
+    tracked = ticket_activity_tracker.get(guild_id, {}).get(channel_id)
+    deadline = ticket_inactivity_deadline(guild_id, channel_id)
+    if channel is None or ticket is None or tracked is None or deadline is None:
+        return
+    if deadline > time.time():
+        # Activité entre-temps (ou vérification forcée) : pas encore dû
+        inactivity_scheduler.schedule(key, deadline)
+        return
+    
+    hours_inactive = get_ticket_inactivity_hours(guild_id, channel_id)
+    print(f"[INACTIVITY] {channel.name}: {hours_inactive}h d'inactivité (warning_sent={tracked['warning_sent']})")
+    
+    # CAS 1: Fermeture automatique après 48h (warning déjà envoyé et pas de réponse)
+    if tracked['warning_sent']:
+        await auto_close_inactive_ticket(guild, channel, ticket, tracked['creator_id'])
+        return
     
+    # CAS 2: Envoi du message d'avertissement après 24h
+    if await warn_inactive_ticket(guild, channel, tracked, hours_inactive):
+        schedule_ticket_inactivity(guild_id, channel_id)
+    else:
+        inactivity_scheduler.schedule(key, time.time() + INACTIVITY_RETRY_SECONDS)
+inactivity_scheduler = DeadlineScheduler('INACTIVITY', process_ticket_inactivity)
+async def check_ticket_inactivity(guild=None):
+    """Vérifier immédiatement les tickets (d'un serveur ou de tous) sans attendre leurs échéances"""
+    print("\n[INACTIVITY] ========== Vérification des tickets inactifs ==========")
+    guilds = [guild] if guild else bot.guilds
+    keys = []
+    for current in guilds:
+        sync_ticket_inactivity(current)
+        keys.extend((current.id, channel_id) for channel_id in ticket_activity_tracker.get(current.id, {}))
+    await asyncio.gather(*(inactivity_scheduler.run_now(key) for key in keys))
     print("[INACTIVITY] ========== Fin de la vérification ==========\n")
 # COMMANDES GIVEAWAYS
 @bot.tree.command(name="gcreate", description="Créer un giveaway avec panneau interactif")
@@ -826,33 +2441,194 @@ async def gcreate(interaction: discord.Interaction):
     if not await check_permissions(interaction):
         return
     await interaction.response.send_modal(GiveawayModal())
+# MOTEUR DES GIVEAWAYS
+def parse_duration_minutes(value):
+    """Durée "30m", "2h", "1d" (sans unité : minutes) ; ValueError si invalide"""
+    value = value.strip().lower()
+    units = {'m': 1, 'h': 60, 'd': 60 * 24}
+    if value and value[-1] in units:
+        minutes = int(value[:-1]) * units[value[-1]]
+    else:
+        minutes = int(value)
+    if minutes <= 0:
+        raise ValueError(value)
+    return minutes
+def draw_giveaway_winners(giveaway, count):
+    """Tirer jusqu'à count gagnants distincts, jamais déjà tirés. Le générateur est dérivé de la
+    graine du giveaway et du numéro de tirage : avec la liste des participants, tout tirage se rejoue"""
+    seed = giveaway.setdefault('seed', random.getrandbits(64))
+    draws = giveaway.setdefault('draws', [])
+    already = {winner for draw in draws for winner in draw}
+    pool = sorted(set(giveaway['participants']) - already)
+    rng = random.Random(f"{seed}:{len(draws)}")
+    winners = rng.sample(pool, min(count, len(pool)))
+    draws.append(winners)
+    return winners
+def schedule_giveaway(message_id):
+    giveaway = giveaways.get(message_id)
+    if giveaway and giveaway['active']:
+        giveaway_scheduler.schedule(message_id, giveaway['end_time'].timestamp())
+    else:
+        giveaway_scheduler.cancel(message_id)
+def giveaway_winners_text(winners):
+    return ", ".join(f"<@{winner}>" for winner in winners) if winners else "Aucun participant"
+async def edit_giveaway_message(message_id, giveaway):
+    """Mettre à jour l'embed d'origine (prix, gagnants, graine du tirage)"""
+    channel = bot.get_channel(giveaway['channel_id'])
+    if channel is None:
+        return None
+    try:
+        message = await channel.fetch_message(message_id)
+    except discord.HTTPException:
+        return channel
+    embed = message.embeds[0] if message.embeds else discord.Embed(color=0xa30174)
+    winners = [winner for draw in giveaway.get('draws', []) for winner in draw]
+    embed.title = "🎉 GIVEAWAY TERMINÉ 🎉"
+    embed.description = (
+        f"**Prix:** {giveaway['prize']}\n**Gagnants:** {giveaway_winners_text(winners)}\n"
+        f"**Terminé:** <t:{int(datetime.now().timestamp())}:R>"
+    )
+    embed.set_footer(text=f"{len(set(giveaway['participants']))} participant(s) • Graine du tirage: {giveaway.get('seed')}")
+    try:
+        await message.edit(embed=embed)
+    except discord.HTTPException:
+        pass
+    return channel
+async def end_giveaway(message_id):
+    """Terminer un giveaway : tirer winner_count gagnants, éditer le message et annoncer le résultat"""
+    giveaway = giveaways.get(message_id)
+    if not giveaway or not giveaway['active']:
+        return None
+    # Échu pendant que le bot était hors ligne : rattraper les réactions manquées avant le tirage
+    await ensure_giveaway_resync(message_id)
+    if not giveaway['active']:
+        return None  # Terminé entre-temps (/gend pendant la resynchronisation)
+    giveaway['active'] = False
+    giveaway_scheduler.cancel(message_id)
+    winners = draw_giveaway_winners(giveaway, giveaway.get('winner_count', 1))
+    journal_record('giveaways', message_id, 'put', value=giveaway)
+    mark_state_dirty('giveaways', message_id)
+    print(f"[GIVEAWAY] {giveaway['prize']} terminé : {len(winners)} gagnant(s)")
+    channel = await edit_giveaway_message(message_id, giveaway)
+    if channel is not None:
+        try:
+            if winners:
+                await channel.send(f"🎉 Félicitations {giveaway_winners_text(winners)} ! Vous gagnez **{giveaway['prize']}** !")
+            else:
+                await channel.send(f"😢 Giveaway **{giveaway['prize']}** terminé sans participant.")
+        except discord.HTTPException:
+            pass
+    return winners
+giveaway_scheduler = DeadlineScheduler('GIVEAWAY', end_giveaway)
+giveaway_resyncs = {}  # {message_id: {'joined', 'left'}} réactions reçues pendant une resynchronisation
+async def resync_giveaway_participants(message_id):
+    """Reconstruire les participants depuis les réactions 🎉 (rattrape celles manquées hors ligne).
+    Les réactions reçues pendant le parcours sont rejouées par-dessus le résultat ; retourne
+    (arrivés, partis) ou None si le message est introuvable"""
+    giveaway = giveaways.get(message_id)
+    channel = bot.get_channel(giveaway['channel_id']) if giveaway and giveaway['active'] else None
+    if channel is None or message_id in giveaway_resyncs:
+        return None
+    try:
+        message = await channel.fetch_message(message_id)
+    except discord.HTTPException:
+        return None
+    reaction = discord.utils.get(message.reactions, emoji="🎉")
+    live = giveaway_resyncs[message_id] = {'joined': set(), 'left': set()}
+    participants = set()
+    try:
+        if reaction is not None:
+            async for user in reaction.users(limit=None):
+                if not user.bot:
+                    participants.add(user.id)
+    except discord.HTTPException as e:
+        print(f"[GIVEAWAY] ❌ Resynchronisation de {message_id} interrompue: {e}")
+        return None
+    finally:
+        del giveaway_resyncs[message_id]
+    if not giveaway['active']:
+        return None  # Tiré pendant le parcours : ne pas réécrire les participants d'un giveaway clos
+    participants = (participants - live['left']) | live['joined']
+    joined = len(participants - giveaway['participants'])
+    left = len(giveaway['participants'] - participants)
+    if joined or left:
+        giveaway['participants'] = participants
+        journal_record('giveaways', message_id, 'put', value=giveaway)
+        mark_state_dirty('giveaways', message_id)
+    print(f"[GIVEAWAY] {giveaway['prize']} resynchronisé : +{joined} / -{left} participant(s)")
+    return joined, left
+giveaway_resync_pending = set()  # Giveaways actifs au démarrage, pas encore resynchronisés
+giveaway_resync_tasks = {}  # {message_id: tâche de resynchronisation de démarrage}
+async def ensure_giveaway_resync(message_id):
+    """Attendre la resynchronisation de démarrage d'un giveaway (la lancer si besoin) ; immédiat sinon"""
+    if message_id not in giveaway_resync_pending:
+        return
+    task = giveaway_resync_tasks.get(message_id)
+    if task is None:
+        task = giveaway_resync_tasks[message_id] = asyncio.create_task(resync_giveaway_participants(message_id))
+        def done(_):
+            giveaway_resync_pending.discard(message_id)
+            giveaway_resync_tasks.pop(message_id, None)
+        task.add_done_callback(done)
+    await asyncio.shield(task)
+async def resync_active_giveaways():
+    """Au démarrage : resynchroniser les giveaways actifs, les plus proches de leur fin d'abord"""
+    pending = [key for key in giveaway_resync_pending if key in giveaways]
+    for message_id in sorted(pending, key=lambda key: giveaways[key]['end_time']):
+        await ensure_giveaway_resync(message_id)
+def schedule_active_giveaways():
+    """Au démarrage : reprogrammer les giveaways en cours (ceux déjà échus se terminent aussitôt)"""
+    for message_id in list(giveaways):
+        schedule_giveaway(message_id)
 @bot.tree.command(name="greroll", description="Relancer un giveaway")
-@app_commands.describe(message_id="ID du message du giveaway")
-async def greroll(interaction: discord.Interaction, message_id: str):
+@app_commands.describe(message_id="ID du message du giveaway", winners="Nombre de nouveaux gagnants (défaut: 1)")
+async def greroll(interaction: discord.Interaction, message_id: str, winners: app_commands.Range[int, 1, 20] = 1):
     if not await check_permissions(interaction):
         return
     try:
         msg_id = int(message_id)
-        if msg_id in giveaways and giveaways[msg_id]['participants']:
-            winner = random.choice(giveaways[msg_id]['participants'])
-            embed = discord.Embed(title="🎉 Giveaway Relancé!", description=f"**Prix:** {giveaways[msg_id]['prize']}\n**Nouveau Gagnant:** <@{winner}>", color=0xa30174)
-            await interaction.response.send_message(embed=embed)
-        else:
-            await interaction.response.send_message("❌ Giveaway introuvable ou aucun participant!", ephemeral=True)
-    except: 
+    except ValueError:
         await interaction.response.send_message("❌ ID invalide!", ephemeral=True)
+        return
+    if msg_id not in giveaways or not giveaways[msg_id]['participants']:
+        await interaction.response.send_message("❌ Giveaway introuvable ou aucun participant!", ephemeral=True)
+        return
+    g = giveaways[msg_id]
+    new_winners = draw_giveaway_winners(g, winners)
+    if not new_winners:
+        await interaction.response.send_message("❌ Tous les participants ont déjà été tirés!", ephemeral=True)
+        return
+    journal_record('giveaways', msg_id, 'put', value=g)
+    mark_state_dirty('giveaways', msg_id)
+    embed = discord.Embed(title="🎉 Giveaway Relancé!", description=f"**Prix:** {g['prize']}\n**Nouveau(x) Gagnant(s):** {giveaway_winners_text(new_winners)}", color=0xa30174)
+    embed.set_footer(text=f"Tirage #{len(g['draws'])} • Graine: {g['seed']}")
+    await interaction.response.send_message(embed=embed)
+    if not g['active']:
+        await edit_giveaway_message(msg_id, g)
 @bot.tree.command(name="glist", description="Lister les giveaways actifs")
-async def glist(interaction: discord.Interaction):
+@app_commands.describe(resync="Recompter les participants depuis les réactions 🎉")
+async def glist(interaction: discord.Interaction, resync: bool = False):
     if not await check_permissions(interaction):
         return
+    if resync:
+        await interaction.response.defer(ephemeral=True)
+        for message_id, g in list(giveaways.items()):
+            if g['active'] and getattr(bot.get_channel(g['channel_id']), 'guild', None) == interaction.guild:
+                await resync_giveaway_participants(message_id)
     active = [g for g in giveaways.values() if g['active']]
     if not active:
-        await interaction.response.send_message("❌ Aucun giveaway actif!", ephemeral=True)
+        if interaction.response.is_done():
+            await interaction.followup.send("❌ Aucun giveaway actif!", ephemeral=True)
+        else:
+            await interaction.response.send_message("❌ Aucun giveaway actif!", ephemeral=True)
         return
     embed = discord.Embed(title="📊 Giveaways Actifs", color=0xa30174)
     for g in active[:10]:
-        embed.add_field(name=f"🎁 {g['prize']}", value=f"Participants: {len(g['participants'])}\nFin: <t:{int(g['end_time'].timestamp())}:R>", inline=True)
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+        embed.add_field(name=f"🎁 {g['prize']}", value=f"Participants: {len(g['participants'])}\nGagnants: {g.get('winner_count', 1)}\nFin: <t:{int(g['end_time'].timestamp())}:R>", inline=True)
+    if interaction.response.is_done():
+        await interaction.followup.send(embed=embed, ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 @bot.tree.command(name="gend", description="Terminer un giveaway prématurément")
 @app_commands.describe(message_id="ID du message du giveaway")
 async def gend(interaction: discord.Interaction, message_id: str):
@@ -860,19 +2636,15 @@ async def gend(interaction: discord.Interaction, message_id: str):
         return
     try:
         msg_id = int(message_id)
-        if msg_id in giveaways and giveaways[msg_id]['active']:
-            g = giveaways[msg_id]
-            g['active'] = False
-            if g['participants']:
-                winner = random.choice(g['participants'])
-                embed = discord.Embed(title="🎉 Giveaway Terminé!", description=f"**Prix:** {g['prize']}\n**Gagnant:** <@{winner}>", color=0xa30174)
-                await interaction.response.send_message(embed=embed)
-            else:
-                await interaction.response.send_message("❌ Aucun participant!")
-        else:
-            await interaction.response.send_message("❌ Giveaway introuvable!", ephemeral=True)
-    except: 
+    except ValueError:
         await interaction.response.send_message("❌ ID invalide!", ephemeral=True)
+        return
+    if msg_id not in giveaways or not giveaways[msg_id]['active']:
+        await interaction.response.send_message("❌ Giveaway introuvable!", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+    winners = await end_giveaway(msg_id)
+    await interaction.followup.send(f"✅ Giveaway terminé : {giveaway_winners_text(winners)}", ephemeral=True)
 @bot.tree.command(name="gdelete", description="Supprimer un giveaway")
 @app_commands.describe(message_id="ID du message du giveaway")
 async def gdelete(interaction: discord.Interaction, message_id: str):
@@ -882,6 +2654,9 @@ async def gdelete(interaction: discord.Interaction, message_id: str):
         msg_id = int(message_id)
         if msg_id in giveaways:
             del giveaways[msg_id]
+            giveaway_scheduler.cancel(msg_id)
+            journal_record('giveaways', msg_id, 'drop')
+            mark_state_dirty('giveaways', msg_id)
             await interaction.response.send_message("✅ Giveaway supprimé!", ephemeral=True)
         else:
             await interaction.response.send_message("❌ Introuvable!", ephemeral=True)
@@ -974,6 +2749,7 @@ async def warn(interaction: discord.Interaction, member: discord.Member, reason:
         return
     
     guild_id, user_id = interaction.guild.id, member.id
+    touch_guild_state(guild_id, 'warnings')
     if guild_id not in warnings: 
         warnings[guild_id] = {}
     if user_id not in warnings[guild_id]: 
@@ -981,6 +2757,7 @@ async def warn(interaction: discord.Interaction, member: discord.Member, reason:
     
     warning = {'reason': reason, 'date': datetime.now().isoformat(), 'moderator': str(interaction.user)}
     warnings[guild_id][user_id].append(warning)
+    journal_record('warnings', guild_id, 'warning_add', user=user_id, warning=warning)
     
     embed = discord.Embed(title="⚠️ Avertissement", description=f"**Membre:** {member.mention}\n**Raison:** {reason}\n**Modérateur:** {interaction.user.mention}\n**Total warnings:** {len(warnings[guild_id][user_id])}", color=0xffaa00)
     await interaction.response.send_message(embed=embed)
@@ -993,8 +2770,10 @@ async def clearwarnings(interaction: discord.Interaction, member: discord.Member
         return
     
     guild_id, user_id = interaction.guild.id, member.id
+    touch_guild_state(guild_id, 'warnings')
     if guild_id in warnings and user_id in warnings[guild_id]:
         warnings[guild_id][user_id] = []
+        journal_record('warnings', guild_id, 'warnings_clear', user=user_id)
         await interaction.response.send_message(f"✅ Avertissements de {member.mention} effacés!")
     else:
         await interaction.response.send_message("❌ Aucun avertissement trouvé!", ephemeral=True)
@@ -1089,7 +2868,7 @@ async def massban(interaction: discord.Interaction, reason: str = "Bannissement
 async def automod(interaction: discord.Interaction, status: bool):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['automod'] = status
     
     embed = discord.Embed(title="🛡️ Auto-Modération", description=f"**Status:** {'✅ Activé' if status else '❌ Désactivé'}\n**Par:** {interaction.user.mention}", color=0xa30174 if status else 0xff0000)
@@ -1099,37 +2878,64 @@ async def automod(interaction: discord.Interaction, status: bool):
 async def antilink_config(interaction: discord.Interaction, status: str, action: str):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['antilink'] = {'status': status.lower() == 'on', 'action': action}
     
     embed = discord.Embed(title="🔗 Anti-Lien Configuré", description=f"**Status:** {'✅ Activé' if status.lower() == 'on' else '❌ Désactivé'}\n**Action:** {action}\n**Par:** {interaction.user.mention}", color=0xa30174)
     await interaction.response.send_message(embed=embed)
 @bot.tree.command(name="antispam_config", description="Configurer l'anti-spam")
-@app_commands.describe(status="on/off", action="warn/kick/ban")
-async def antispam_config(interaction: discord.Interaction, status: str, action: str):
+@app_commands.describe(
+    status="on/off", action="warn/kick/ban",
+    window_seconds="Fenêtre de détection en secondes", max_messages="Messages max dans la fenêtre",
+    max_duplicates="Messages identiques max", max_mentions="Mentions max", max_attachments="Pièces jointes max"
+)
+async def antispam_config(interaction: discord.Interaction, status: str, action: str,
+                          window_seconds: app_commands.Range[int, 1, 120] = None,
+                          max_messages: app_commands.Range[int, 1, ANTISPAM_RING_SIZE - 1] = None,
+                          max_duplicates: app_commands.Range[int, 1, ANTISPAM_RING_SIZE - 1] = None,
+                          max_mentions: app_commands.Range[int, 1, 500] = None,
+                          max_attachments: app_commands.Range[int, 1, 500] = None):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
-    data['config']['antispam'] = {'status': status.lower() == 'on', 'action': action}
-    
-    embed = discord.Embed(title="🚫 Anti-Spam Configuré", description=f"**Status:** {'✅ Activé' if status.lower() == 'on' else '❌ Désactivé'}\n**Action:** {action}\n**Par:** {interaction.user.mention}", color=0xa30174)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
+    antispam = data['config']['antispam']
+    antispam.update({'status': status.lower() == 'on', 'action': action})
+    thresholds = {'window_seconds': window_seconds, 'max_messages': max_messages, 'max_duplicates': max_duplicates,
+                  'max_mentions': max_mentions, 'max_attachments': max_attachments}
+    antispam.update({name: value for name, value in thresholds.items() if value is not None})
+    settings = antispam_settings(data['config'])
+    
+    embed = discord.Embed(title="🚫 Anti-Spam Configuré", description=f"**Status:** {'✅ Activé' if status.lower() == 'on' else '❌ Désactivé'}\n**Action:** {action}\n**Seuils:** {settings['max_messages']} messages / {settings['max_duplicates']} doublons / {settings['max_mentions']} mentions / {settings['max_attachments']} fichiers en {settings['window_seconds']}s\n**Par:** {interaction.user.mention}", color=0xa30174)
     await interaction.response.send_message(embed=embed)
 @bot.tree.command(name="antiraid_config", description="Configurer l'anti-raid")
-@app_commands.describe(status="on/off", action="warn/kick/ban")
-async def antiraid_config(interaction: discord.Interaction, status: str, action: str):
+@app_commands.describe(
+    status="on/off", action="warn/kick/ban",
+    max_joins="Arrivées tolérées par période", per_seconds="Durée de la période en secondes",
+    account_age_days="Âge minimum d'un compte non suspect (jours)", quiet_seconds="Calme requis avant la fin du mode raid (secondes)"
+)
+async def antiraid_config(interaction: discord.Interaction, status: str, action: str,
+                          max_joins: app_commands.Range[int, 2, 1000] = None,
+                          per_seconds: app_commands.Range[int, 1, 3600] = None,
+                          account_age_days: app_commands.Range[int, 0, 365] = None,
+                          quiet_seconds: app_commands.Range[int, 10, 3600] = None):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
-    data['config']['antiraid'] = {'status': status.lower() == 'on', 'action': action}
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
+    antiraid = data['config']['antiraid']
+    antiraid.update({'status': status.lower() == 'on', 'action': action})
+    thresholds = {'max_joins': max_joins, 'per_seconds': per_seconds, 'account_age_days': account_age_days, 'quiet_seconds': quiet_seconds}
+    antiraid.update({name: value for name, value in thresholds.items() if value is not None})
+    
+    settings = antiraid_settings(data['config'])
     
-    embed = discord.Embed(title="🛡️ Anti-Raid Configuré", description=f"**Status:** {'✅ Activé' if status.lower() == 'on' else '❌ Désactivé'}\n**Action:** {action}\n**Par:** {interaction.user.mention}", color=0xa30174)
+    embed = discord.Embed(title="🛡️ Anti-Raid Configuré", description=f"**Status:** {'✅ Activé' if status.lower() == 'on' else '❌ Désactivé'}\n**Action:** {action}\n**Seuil:** {settings['max_joins']} arrivées / {settings['per_seconds']}s (comptes de moins de {settings['account_age_days']}j comptent double)\n**Par:** {interaction.user.mention}", color=0xa30174)
     await interaction.response.send_message(embed=embed)
 @bot.tree.command(name="antilink", description="Activer/désactiver l'anti-lien")
 @app_commands.describe(status="True/False")
 async def antilink(interaction: discord.Interaction, status: bool):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['antilink']['status'] = status
     
     embed = discord.Embed(title="🔗 Anti-Lien", description=f"**Status:** {'✅ Activé' if status else '❌ Désactivé'}\n**Par:** {interaction.user.mention}", color=0xa30174 if status else 0xff0000)
@@ -1139,7 +2945,7 @@ async def antilink(interaction: discord.Interaction, status: bool):
 async def antilinkaction(interaction: discord.Interaction, action: str):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['antilink']['action'] = action
     
     embed = discord.Embed(title="🔗 Action Anti-Lien", description=f"**Action:** {action}\n**Par:** {interaction.user.mention}", color=0xa30174)
@@ -1149,9 +2955,10 @@ async def antilinkaction(interaction: discord.Interaction, action: str):
 async def whitelist_add(interaction: discord.Interaction, domain: str):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     if domain not in data['config']['whitelist_domains']:
         data['config']['whitelist_domains'].append(domain)
+        invalidate_antilink_whitelist(interaction.guild.id)
         await interaction.response.send_message(f"✅ Domaine `{domain}` ajouté à la liste blanche!")
     else:
         await interaction.response.send_message(f"❌ Domaine `{domain}` déjà dans la liste!", ephemeral=True)
@@ -1160,9 +2967,10 @@ async def whitelist_add(interaction: discord.Interaction, domain: str):
 async def whitelist_remove(interaction: discord.Interaction, domain: str):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     if domain in data['config']['whitelist_domains']:
         data['config']['whitelist_domains'].remove(domain)
+        invalidate_antilink_whitelist(interaction.guild.id)
         await interaction.response.send_message(f"✅ Domaine `{domain}` retiré de la liste blanche!")
     else:
         await interaction.response.send_message(f"❌ Domaine `{domain}` introuvable!", ephemeral=True)
@@ -1177,23 +2985,30 @@ async def whitelist_list(interaction: discord.Interaction):
     embed.description = "\n".join([f"• {domain}" for domain in domains]) or "Aucun domaine"
     await interaction.response.send_message(embed=embed, ephemeral=True)
 @bot.tree.command(name="badwordaction", description="Configurer l'action pour les mots interdits")
-@app_commands.describe(action="warn/kick/ban")
-async def badwordaction(interaction: discord.Interaction, action: str):
+@app_commands.describe(action="warn/kick/ban", whole_word="Mot entier uniquement (True/False)", fold="Ignorer accents et leetspeak (True/False)")
+async def badwordaction(interaction: discord.Interaction, action: str, whole_word: bool = None, fold: bool = None):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['badword_action'] = action
-    
-    embed = discord.Embed(title="🚫 Action Mots Interdits", description=f"**Action:** {action}\n**Par:** {interaction.user.mention}", color=0xa30174)
+    options = data['config']['badword_options']
+    if whole_word is not None:
+        options['whole_word'] = whole_word
+    if fold is not None:
+        options['fold'] = fold
+    invalidate_badword_matcher(interaction.guild.id)
+    
+    embed = discord.Embed(title="🚫 Action Mots Interdits", description=f"**Action:** {action}\n**Mot entier:** {'✅' if options['whole_word'] else '❌'}\n**Accents/leetspeak:** {'✅' if options['fold'] else '❌'}\n**Par:** {interaction.user.mention}", color=0xa30174)
     await interaction.response.send_message(embed=embed)
 @bot.tree.command(name="addword", description="Ajouter un mot interdit")
 @app_commands.describe(word="Mot à interdire")
 async def addword(interaction: discord.Interaction, word: str):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     if word.lower() not in data['config']['badwords']:
         data['config']['badwords'].append(word.lower())
+        invalidate_badword_matcher(interaction.guild.id)
         await interaction.response.send_message(f"✅ Mot `{word}` ajouté aux mots interdits!")
     else:
         await interaction.response.send_message(f"❌ Mot `{word}` déjà interdit!", ephemeral=True)
@@ -1202,9 +3017,10 @@ async def addword(interaction: discord.Interaction, word: str):
 async def removeword(interaction: discord.Interaction, word: str):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     if word.lower() in data['config']['badwords']:
         data['config']['badwords'].remove(word.lower())
+        invalidate_badword_matcher(interaction.guild.id)
         await interaction.response.send_message(f"✅ Mot `{word}` retiré des mots interdits!")
     else:
         await interaction.response.send_message(f"❌ Mot `{word}` introuvable!", ephemeral=True)
@@ -1214,7 +3030,7 @@ async def removeword(interaction: discord.Interaction, word: str):
 async def autorole(interaction: discord.Interaction, role: discord.Role):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['autorole'] = role.id
     
     embed = discord.Embed(title="🎭 Autorôle Configuré", description=f"**Rôle:** {role.mention}\n**Par:** {interaction.user.mention}", color=0xa30174)
@@ -1223,7 +3039,7 @@ async def autorole(interaction: discord.Interaction, role: discord.Role):
 async def autorole_remove(interaction: discord.Interaction):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['autorole'] = None
     
     embed = discord.Embed(title="🎭 Autorôle Supprimé", description=f"**Par:** {interaction.user.mention}", color=0xff0000)
@@ -1272,6 +3088,7 @@ async def userinfo(interaction: discord.Interaction, member: discord.Member = No
     
     # Warnings
     guild_id, user_id = interaction.guild.id, member.id
+    get_guild_data(guild_id, mark_dirty=False)
     warning_count = len(warnings.get(guild_id, {}).get(user_id, []))
     embed.add_field(name="⚠️ Avertissements", value=warning_count, inline=True)
     
@@ -1300,6 +3117,7 @@ async def warnings_cmd(interaction: discord.Interaction, member: discord.Member
         member = interaction.user
     
     guild_id, user_id = interaction.guild.id, member.id
+    get_guild_data(guild_id, mark_dirty=False)
     user_warnings = warnings.get(guild_id, {}).get(user_id, [])
     
     embed = discord.Embed(title=f"⚠️ Avertissements - {member}", color=0xffaa00)
@@ -1373,7 +3191,7 @@ async def config(interaction: discord.Interaction):
 async def setlogs(interaction: discord.Interaction, channel: discord.TextChannel):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['logs_channel'] = channel.id
     
     embed = discord.Embed(title="📋 Salon de Logs Configuré", description=f"**Salon:** {channel.mention}\n**Par:** {interaction.user.mention}", color=0xa30174)
@@ -1382,7 +3200,7 @@ async def setlogs(interaction: discord.Interaction, channel: discord.TextChannel
 async def setlogs_remove(interaction: discord.Interaction):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['logs_channel'] = None
     
     embed = discord.Embed(title="📋 Salon de Logs Supprimé", description=f"**Par:** {interaction.user.mention}", color=0xff0000)
@@ -1393,7 +3211,7 @@ async def setrole(interaction: discord.Interaction, role: discord.Role):
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("❌ Seuls les administrateurs peuvent configurer les rôles autorisés!", ephemeral=True)
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     if role.id not in data['config']['allowed_roles']:
         data['config']['allowed_roles'].append(role.id)
         await interaction.response.send_message(f"✅ Rôle {role.mention} ajouté aux autorisations!")
@@ -1405,7 +3223,7 @@ async def unsetroles(interaction: discord.Interaction, role: discord.Role):
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("❌ Seuls les administrateurs peuvent configurer les rôles autorisés!", ephemeral=True)
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     if role.id in data['config']['allowed_roles']:
         data['config']['allowed_roles'].remove(role.id)
         await interaction.response.send_message(f"✅ Rôle {role.mention} retiré des autorisations!")
@@ -1418,8 +3236,9 @@ async def inactivity_enable(interaction: discord.Interaction, status: bool):
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['inactivity_config']['enabled'] = status
+    reschedule_guild_inactivity(interaction.guild.id)
     
     embed = discord.Embed(
         title="⏰ Système d'Inactivité des Tickets",
@@ -1446,8 +3265,9 @@ async def inactivity_delay(interaction: discord.Interaction, hours: int):
         await interaction.response.send_message("❌ Le délai doit être entre 1 et 168 heures (1 semaine)!", ephemeral=True)
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['inactivity_config']['delay_hours'] = hours
+    reschedule_guild_inactivity(interaction.guild.id)
     
     embed = discord.Embed(
         title="⏰ Délai d'Inactivité Configuré",
@@ -1469,7 +3289,7 @@ async def inactivity_notify_staff(interaction: discord.Interaction, status: bool
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['inactivity_config']['notify_staff'] = status
     
     embed = discord.Embed(
@@ -1552,9 +3372,9 @@ async def inactivity_check(interaction: discord.Interaction):
     
     await interaction.response.defer(ephemeral=True)
     
-    # Lancer manuellement la vérification
+    # Lancer manuellement la vérification (ce serveur uniquement)
     print("[INACTIVITY] Vérification forcée par admin")
-    await check_ticket_inactivity()
+    await check_ticket_inactivity(interaction.guild)
     
     await interaction.followup.send("✅ Vérification d'inactivité effectuée !\nConsultez les logs pour voir les résultats.", ephemeral=True)
 # SYSTÈME DE VOUCHS
@@ -1566,7 +3386,7 @@ async def vouch(interaction: discord.Interaction):
 async def modifembed(interaction: discord.Interaction, titre: str, couleur: str, footer: str, thumbnail: bool):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['vouch_config'] = {
         'title': titre,
         'color': couleur,
@@ -1590,7 +3410,7 @@ async def modifembed(interaction: discord.Interaction, titre: str, couleur: str,
 async def resetcount(interaction: discord.Interaction):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['vouch_count'] = 0
     
     embed = discord.Embed(title="🔄 Compteur Reset", description=f"**Compteur de vouchs remis à 0**\n**Par:** {interaction.user.mention}", color=0xa30174)
@@ -1636,6 +3456,12 @@ async def stats(interaction: discord.Interaction):
     embed.add_field(name="🎁 Giveaways", value=f"Actifs: {len([g for g in giveaways.values() if g['active']])}", inline=True)
     embed.add_field(name="💬 Vouchs", value=data['vouch_count'], inline=True)
     embed.add_field(name="🔑 Clés", value=f"Promo: {len(data['keys'])}\nFree: {len(data['free_keys'])}", inline=True)
+    pipeline_lines = [
+        f"`{name}` {stats['total'] / stats['count'] * 1000:.1f} ms moy. / {stats['max'] * 1000:.0f} ms max"
+        for name, stats in message_pipeline_stats.items() if stats['count']
+    ]
+    if pipeline_lines:
+        embed.add_field(name="⏱️ Traitement des messages", value="\n".join(pipeline_lines), inline=False)
     
     await interaction.response.send_message(embed=embed)
 # SALONS VOCAUX
@@ -1690,67 +3516,90 @@ def build_voctemp_embed(channel: discord.VoiceChannel, owner: discord.Member, ro
         inline=False
     )
     return embed
-async def apply_voctemp_mode(channel: discord.VoiceChannel, room_data: dict):
+VOCTEMP_MODE_PERMISSIONS = {
+    'open': {'view_channel': True, 'connect': True},
+    'closed': {'view_channel': True, 'connect': False},
+    'private': {'view_channel': False, 'connect': False}
+}
+VOCTEMP_OWNER_PERMISSIONS = {'manage_channels': True, 'move_members': True, 'connect': True, 'view_channel': True}
+VOCTEMP_POOL_MAX = 10  # Paires voc + panel pré-créées au maximum par guilde
+VOCTEMP_PANEL_PERMISSIONS = {'view_channel': True, 'read_message_history': True, 'send_messages': True}
+def _voctemp_target(guild: discord.Guild, user_id: int):
+    """Membre en cache, sinon simple objet : l'API n'a besoin que de l'ID"""
+    return guild.get_member(user_id) or discord.Object(id=user_id)
+def build_voctemp_overwrites(channel: discord.VoiceChannel, room_data: dict, previous_owner_id: int = None) -> dict:
+    """Overwrites complets du salon vocal : mode + toggles pour @everyone, listes, propriétaire.
+    Les autres overwrites (rôles et membres hérités de la catégorie, bot) sont conservés ; seuls
+    ceux que le panel gère sont recalculés, plus l'ancien propriétaire lors d'un transfert"""
     guild = channel.guild
-    everyone = guild.default_role
-    mode = room_data['mode']
-    if mode == 'open':
-        await channel.set_permissions(everyone, view_channel=True, connect=True)
-    elif mode == 'closed':
-        await channel.set_permissions(everyone, view_channel=True, connect=False)
-    else:
-        await channel.set_permissions(everyone, view_channel=False, connect=False)
-    for user_id in room_data['blacklist']:
-        member = guild.get_member(user_id)
-        if member:
-            await channel.set_permissions(member, connect=False)
-    for user_id in room_data['whitelist']:
-        member = guild.get_member(user_id)
-        if member:
-            await channel.set_permissions(member, view_channel=True, connect=True)
-async def apply_voctemp_toggles(channel: discord.VoiceChannel, room_data: dict):
-    everyone = channel.guild.default_role
     toggles = room_data['toggles']
-    await channel.set_permissions(
-        everyone,
+    managed = {guild.default_role.id, room_data['owner_id'], *room_data['whitelist'], *room_data['blacklist']}
+    if previous_owner_id:
+        managed.add(previous_owner_id)
+    overwrites = {target: overwrite for target, overwrite in channel.overwrites.items() if target.id not in managed}
+    overwrites[guild.default_role] = discord.PermissionOverwrite(
+        **VOCTEMP_MODE_PERMISSIONS.get(room_data['mode'], VOCTEMP_MODE_PERMISSIONS['private']),
         speak=toggles['micro'],
         stream=toggles['video'],
         use_soundboard=toggles['soundboard'],
         use_voice_activation=toggles['status']
     )
-async def sync_voctemp_panel_access(guild: discord.Guild, room_data: dict, previous_owner_id: int = None):
-    """Rendre le salon panel privé et visible uniquement par le propriétaire actuel."""
-    text_channel = guild.get_channel(room_data['text_channel_id'])
-    if not text_channel:
-        return
-    everyone = guild.default_role
-    await text_channel.set_permissions(
-        everyone,
-        view_channel=False,
-        read_message_history=False,
-        send_messages=False
-    )
-    owner_member = guild.get_member(room_data['owner_id'])
-    if owner_member:
-        await text_channel.set_permissions(
-            owner_member,
-            view_channel=True,
-            read_message_history=True,
-            send_messages=True
-        )
-    if previous_owner_id and previous_owner_id != room_data['owner_id']:
-        previous_owner = guild.get_member(previous_owner_id)
-        if previous_owner:
-            await text_channel.set_permissions(previous_owner, overwrite=None)
-    bot_member = guild.me
-    if bot_member:
-        await text_channel.set_permissions(
-            bot_member,
-            view_channel=True,
-            read_message_history=True,
-            send_messages=True,
-            manage_messages=True
-        )
+    for user_id in room_data['blacklist']:
+        overwrites[_voctemp_target(guild, user_id)] = discord.PermissionOverwrite(connect=False)
+    for user_id in room_data['whitelist']:
+        overwrites[_voctemp_target(guild, user_id)] = discord.PermissionOverwrite(view_channel=True, connect=True)
+    overwrites[_voctemp_target(guild, room_data['owner_id'])] = discord.PermissionOverwrite(**VOCTEMP_OWNER_PERMISSIONS)
+    return overwrites
+def build_voctemp_panel_overwrites(guild: discord.Guild, room_data: dict) -> dict:
+    """Salon panel privé : visible uniquement par le propriétaire actuel et le bot"""
+    overwrites = {
+        guild.default_role: discord.PermissionOverwrite(view_channel=False, read_message_history=False, send_messages=False),
+        _voctemp_target(guild, room_data['owner_id']): discord.PermissionOverwrite(**VOCTEMP_PANEL_PERMISSIONS)
+    }
+    if guild.me:
+        overwrites[guild.me] = discord.PermissionOverwrite(**VOCTEMP_PANEL_PERMISSIONS, manage_messages=True)
+    return overwrites
+def build_voctemp_creation_overwrites(category, owner: discord.Member) -> dict:
+    """Overwrites du salon vocal à sa création : ceux de la catégorie + droits du propriétaire"""
+    overwrites = dict(category.overwrites) if category else {}
+    overwrites[owner] = discord.PermissionOverwrite(**VOCTEMP_OWNER_PERMISSIONS)
+    return overwrites
+VOCTEMP_LATENCY_SAMPLES = 50
+voctemp_latencies = {}  # {guild_id: deque des délais arrivée → déplacement (secondes)}
+def record_voctemp_latency(guild_id: int, elapsed: float):
+    samples = voctemp_latencies.setdefault(guild_id, deque(maxlen=VOCTEMP_LATENCY_SAMPLES))
+    samples.append(elapsed)
+    if elapsed > 2:
+        print(f"[VOCTEMP] ⚠️ Voc temporaire servie en {elapsed:.2f}s (guilde {guild_id})")
+def voctemp_latency_summary(guild_id: int) -> str:
+    samples = sorted(voctemp_latencies.get(guild_id, ()))
+    if not samples:
+        return "Aucune mesure"
+    median = samples[len(samples) // 2]
+    worst = samples[-1]
+    return f"médiane {median * 1000:.0f} ms • max {worst * 1000:.0f} ms ({len(samples)} dernières créations)"
+async def apply_channel_overwrites(channel: discord.abc.GuildChannel, overwrites: dict, reason: str = None) -> bool:
+    """Appliquer des overwrites en un seul appel, rien si ceux du salon sont déjà identiques"""
+    current = {target.id: overwrite.pair() for target, overwrite in channel.overwrites.items()}
+    target = {target.id: overwrite.pair() for target, overwrite in overwrites.items()}
+    if current == target:
+        return False
+    await channel.edit(overwrites=overwrites, reason=reason)
+    return True
+async def apply_voctemp_permissions(channel: discord.VoiceChannel, room_data: dict, previous_owner_id: int = None) -> bool:
+    overwrites = build_voctemp_overwrites(channel, room_data, previous_owner_id)
+    return await apply_channel_overwrites(channel, overwrites, reason="Panel voc temporaire")
+async def sync_voctemp_panel_access(guild: discord.Guild, room_data: dict, previous_owner_id: int = None) -> bool:
+    """Rendre le salon panel privé et visible uniquement par le propriétaire actuel
+    (les overwrites ajoutés à la main, hors ancien propriétaire, sont conservés)."""
+    text_channel = guild.get_channel(room_data['text_channel_id'])
+    if not text_channel:
+        return False
+    panel_overwrites = build_voctemp_panel_overwrites(guild, room_data)
+    managed = {target.id for target in panel_overwrites} | {previous_owner_id}
+    overwrites = {target: overwrite for target, overwrite in text_channel.overwrites.items() if target.id not in managed}
+    overwrites.update(panel_overwrites)
+    return await apply_channel_overwrites(text_channel, overwrites, reason="Panel voc temporaire")
 class VocTempUserModal(discord.ui.Modal):
     def __init__(self, action: str, voice_channel_id: int):
         super().__init__(title=f"Voc Temp • {action}")
@@ -1771,7 +3620,7 @@ class VocTempUserModal(discord.ui.Modal):
         except ValueError:
             await interaction.response.send_message("❌ ID invalide.", ephemeral=True)
             return
-        previous_owner_id = room_data['owner_id']
+        previous_owner_id = None
         if self.action == 'whitelist':
             room_data['whitelist'].add(target_id)
             room_data['blacklist'].discard(target_id)
@@ -1785,19 +3634,15 @@ class VocTempUserModal(discord.ui.Modal):
             if not target_member:
                 await interaction.response.send_message("❌ Ce membre n'est pas sur le serveur.", ephemeral=True)
                 return
+            previous_owner_id = room_data['owner_id']
             room_data['owner_id'] = target_id
             message = f"👑 Propriété transférée à <@{target_id}>."
+        mark_state_dirty('voice_temp_rooms', self.voice_channel_id)
         channel = interaction.guild.get_channel(self.voice_channel_id)
         if channel:
-            await apply_voctemp_mode(channel, room_data)
-            await apply_voctemp_toggles(channel, room_data)
-            if self.action == 'owner':
-                await channel.set_permissions(target_member, manage_channels=True, move_members=True, connect=True, view_channel=True)
-                previous_owner = interaction.guild.get_member(previous_owner_id)
-                if previous_owner:
-                    await channel.set_permissions(previous_owner, manage_channels=False, move_members=False)
+            await apply_voctemp_permissions(channel, room_data, previous_owner_id)
         if self.action == 'owner':
-            await sync_voctemp_panel_access(interaction.guild, room_data, previous_owner_id=previous_owner_id)
+            await sync_voctemp_panel_access(interaction.guild, room_data, previous_owner_id)
             if interaction.message:
                 new_owner = interaction.guild.get_member(room_data['owner_id'])
                 voice_channel = interaction.guild.get_channel(self.voice_channel_id)
@@ -1806,21 +3651,35 @@ class VocTempUserModal(discord.ui.Modal):
         await interaction.response.send_message(message, ephemeral=True)
 class VocTempSetupModal(discord.ui.Modal, title="Configuration /voctemp"):
     source_voice_id = discord.ui.TextInput(label="ID du salon vocal déclencheur", placeholder="123456789012345678", required=True)
+    pool_size = discord.ui.TextInput(label=f"Salons pré-créés (0-{VOCTEMP_POOL_MAX})", placeholder="0 = création à la demande", required=False, max_length=2)
+    def __init__(self, config: dict = None):
+        super().__init__()
+        if config:
+            if config.get('source_channel_id'):
+                self.source_voice_id.default = str(config['source_channel_id'])
+            self.pool_size.default = str(config.get('pool_size', 0))
     async def on_submit(self, interaction: discord.Interaction):
         if not await check_permissions(interaction):
             return
         try:
             channel_id = int(str(self.source_voice_id).strip())
+            pool_size = int(str(self.pool_size).strip() or 0)
         except ValueError:
-            await interaction.response.send_message("❌ L'ID indiqué est invalide.", ephemeral=True)
+            await interaction.response.send_message("❌ L'ID ou le nombre de salons indiqué est invalide.", ephemeral=True)
+            return
+        if not 0 <= pool_size <= VOCTEMP_POOL_MAX:
+            await interaction.response.send_message(f"❌ Le nombre de salons pré-créés doit être entre 0 et {VOCTEMP_POOL_MAX}.", ephemeral=True)
             return
         channel = interaction.guild.get_channel(channel_id)
         if not isinstance(channel, discord.VoiceChannel):
             await interaction.response.send_message("❌ Ce salon n'est pas un salon vocal valide.", ephemeral=True)
             return
-        data = get_guild_data(interaction.guild.id)
+        data = get_guild_data(interaction.guild.id, mark_dirty=True)
         data['config']['voctemp']['source_channel_id'] = channel_id
-        await interaction.response.send_message(f"✅ Setup terminé. Salon déclencheur: {channel.mention}", ephemeral=True)
+        data['config']['voctemp']['pool_size'] = pool_size
+        ensure_voctemp_pool(interaction.guild)
+        pool_text = f"\nSalons pré-créés: **{pool_size}**" if pool_size else ""
+        await interaction.response.send_message(f"✅ Setup terminé. Salon déclencheur: {channel.mention}{pool_text}", ephemeral=True)
 class VocTempSetupView(discord.ui.View):
     def __init__(self):
         super().__init__(timeout=180)
@@ -1828,7 +3687,7 @@ class VocTempSetupView(discord.ui.View):
     async def configure(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not await check_permissions(interaction):
             return
-        await interaction.response.send_modal(VocTempSetupModal())
+        await interaction.response.send_modal(VocTempSetupModal(get_guild_data(interaction.guild.id, mark_dirty=False)['config']['voctemp']))
 class VocTempPanelView(discord.ui.View):
     def __init__(self, voice_channel_id: int):
         super().__init__(timeout=None)
@@ -1841,6 +3700,8 @@ class VocTempPanelView(discord.ui.View):
         if interaction.user.id != room_data['owner_id']:
             await interaction.response.send_message("❌ Seul le propriétaire peut utiliser ce panel.", ephemeral=True)
             return False
+        # Les boutons modifient room_data juste après ce contrôle
+        mark_state_dirty('voice_temp_rooms', self.voice_channel_id)
         return True
     async def _refresh(self, interaction: discord.Interaction):
         channel = interaction.guild.get_channel(self.voice_channel_id)
@@ -1856,7 +3717,7 @@ class VocTempPanelView(discord.ui.View):
         channel = interaction.guild.get_channel(self.voice_channel_id)
         room_data = voice_temp_rooms[self.voice_channel_id]
         room_data['mode'] = 'open'
-        await apply_voctemp_mode(channel, room_data)
+        await apply_voctemp_permissions(channel, room_data)
         await interaction.response.send_message("✅ Mode ouvert activé.", ephemeral=True)
         await self._refresh(interaction)
     @discord.ui.button(label="Fermé", style=discord.ButtonStyle.secondary, emoji="🔒", row=0)
@@ -1866,7 +3727,7 @@ class VocTempPanelView(discord.ui.View):
         channel = interaction.guild.get_channel(self.voice_channel_id)
         room_data = voice_temp_rooms[self.voice_channel_id]
         room_data['mode'] = 'closed'
-        await apply_voctemp_mode(channel, room_data)
+        await apply_voctemp_permissions(channel, room_data)
         await interaction.response.send_message("✅ Mode fermé activé.", ephemeral=True)
         await self._refresh(interaction)
     @discord.ui.button(label="Privé", style=discord.ButtonStyle.secondary, emoji="📣", row=0)
@@ -1876,7 +3737,7 @@ class VocTempPanelView(discord.ui.View):
         channel = interaction.guild.get_channel(self.voice_channel_id)
         room_data = voice_temp_rooms[self.voice_channel_id]
         room_data['mode'] = 'private'
-        await apply_voctemp_mode(channel, room_data)
+        await apply_voctemp_permissions(channel, room_data)
         await interaction.response.send_message("✅ Mode privé activé.", ephemeral=True)
         await self._refresh(interaction)
     @discord.ui.button(label="Liste blanche", style=discord.ButtonStyle.primary, emoji="📝", row=1)
@@ -1907,7 +3768,7 @@ class VocTempPanelView(discord.ui.View):
         channel = interaction.guild.get_channel(self.voice_channel_id)
         room_data = voice_temp_rooms[self.voice_channel_id]
         room_data['toggles']['micro'] = not room_data['toggles']['micro']
-        await apply_voctemp_toggles(channel, room_data)
+        await apply_voctemp_permissions(channel, room_data)
         await interaction.response.send_message("✅ Permission micro mise à jour.", ephemeral=True)
         await self._refresh(interaction)
     @discord.ui.button(label="Vidéo", style=discord.ButtonStyle.secondary, emoji="📹", row=2)
@@ -1917,7 +3778,7 @@ class VocTempPanelView(discord.ui.View):
         channel = interaction.guild.get_channel(self.voice_channel_id)
         room_data = voice_temp_rooms[self.voice_channel_id]
         room_data['toggles']['video'] = not room_data['toggles']['video']
-        await apply_voctemp_toggles(channel, room_data)
+        await apply_voctemp_permissions(channel, room_data)
         await interaction.response.send_message("✅ Permission vidéo mise à jour.", ephemeral=True)
         await self._refresh(interaction)
     @discord.ui.button(label="Soundboards", style=discord.ButtonStyle.secondary, emoji="🎛️", row=2)
@@ -1927,7 +3788,7 @@ class VocTempPanelView(discord.ui.View):
         channel = interaction.guild.get_channel(self.voice_channel_id)
         room_data = voice_temp_rooms[self.voice_channel_id]
         room_data['toggles']['soundboard'] = not room_data['toggles']['soundboard']
-        await apply_voctemp_toggles(channel, room_data)
+        await apply_voctemp_permissions(channel, room_data)
         await interaction.response.send_message("✅ Permission soundboard mise à jour.", ephemeral=True)
         await self._refresh(interaction)
     @discord.ui.button(label="Statut", style=discord.ButtonStyle.secondary, emoji="📌", row=3)
@@ -1937,7 +3798,7 @@ class VocTempPanelView(discord.ui.View):
         channel = interaction.guild.get_channel(self.voice_channel_id)
         room_data = voice_temp_rooms[self.voice_channel_id]
         room_data['toggles']['status'] = not room_data['toggles']['status']
-        await apply_voctemp_toggles(channel, room_data)
+        await apply_voctemp_permissions(channel, room_data)
         await interaction.response.send_message("✅ Permission statut mise à jour.", ephemeral=True)
         await self._refresh(interaction)
     @discord.ui.button(label="Transférer la propriété", style=discord.ButtonStyle.primary, emoji="👑", row=4)
@@ -1945,6 +3806,143 @@ class VocTempPanelView(discord.ui.View):
         if not await self._owner_guard(interaction):
             return
         await interaction.response.send_modal(VocTempUserModal('owner', self.voice_channel_id))
+# POOL DE VOCS TEMPORAIRES
+VOCTEMP_CREATE_BUDGET = 10  # Créations de salons par fenêtre et par guilde (réassort du pool)
+VOCTEMP_CREATE_WINDOW = 60
+voctemp_create_log = {}  # {guild_id: deque des time.monotonic() des créations récentes}
+voctemp_pool_tasks = {}  # {guild_id: tâche de réassort}
+voctemp_pool_warmed = set()  # Guildes dont le pool a déjà été réassorti au démarrage
+def note_voctemp_creates(guild_id: int, count: int = 1):
+    """Compter les créations de salons (à la demande comme pour le pool) dans le budget de la guilde"""
+    log = voctemp_create_log.setdefault(guild_id, deque())
+    now = time.monotonic()
+    log.extend([now] * count)
+async def wait_voctemp_budget(guild_id: int, needed: int):
+    """Attendre que la fenêtre glissante laisse la place pour `needed` créations"""
+    log = voctemp_create_log.setdefault(guild_id, deque())
+    while True:
+        now = time.monotonic()
+        while log and now - log[0] >= VOCTEMP_CREATE_WINDOW:
+            log.popleft()
+        if len(log) + needed <= VOCTEMP_CREATE_BUDGET:
+            return
+        await asyncio.sleep(log[0] + VOCTEMP_CREATE_WINDOW - now)
+def build_voctemp_pool_overwrites(guild: discord.Guild, panel: bool) -> dict:
+    """Salon en réserve : invisible pour tous sauf le bot"""
+    overwrites = {guild.default_role: discord.PermissionOverwrite(view_channel=False, connect=False)}
+    if guild.me:
+        bot_permissions = dict(VOCTEMP_PANEL_PERMISSIONS, manage_messages=True) if panel else dict(VOCTEMP_OWNER_PERMISSIONS)
+        overwrites[guild.me] = discord.PermissionOverwrite(**bot_permissions)
+    return overwrites
+def take_voctemp_pool_pair(guild: discord.Guild):
+    """Retirer du pool une paire (voc, panel) encore existante, None si le pool est vide"""
+    data = get_guild_data(guild.id, mark_dirty=False)
+    pool = data['voctemp_pool']
+    while pool:
+        voice_id, text_id = pool.pop(0)
+        mark_guild_dirty(guild.id, 'guild')
+        voice, text = guild.get_channel(voice_id), guild.get_channel(text_id)
+        if isinstance(voice, discord.VoiceChannel) and text:
+            return voice, text
+    return None
+def discard_voctemp_pool_channel(channel):
+    """Un salon du pool supprimé à la main : retirer sa paire"""
+    data = guild_data.get(channel.guild.id)
+    if not data or not data.get('voctemp_pool'):
+        return
+    remaining = [pair for pair in data['voctemp_pool'] if channel.id not in pair]
+    if len(remaining) != len(data['voctemp_pool']):
+        data['voctemp_pool'] = remaining
+        mark_guild_dirty(channel.guild.id, 'guild')
+        ensure_voctemp_pool(channel.guild)
+async def _create_voctemp_pool_pair(guild: discord.Guild, category):
+    results = await asyncio.gather(
+        guild.create_voice_channel(name="🔊 Voc libre", category=category, overwrites=build_voctemp_pool_overwrites(guild, False), reason="Pool voc temporaire"),
+        guild.create_text_channel(name="panel-libre", category=category, overwrites=build_voctemp_pool_overwrites(guild, True), reason="Pool voc temporaire"),
+        return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for created in results:
+        if errors and not isinstance(created, BaseException):
+            try:
+                await created.delete(reason="Pool voc temporaire")
+            except discord.HTTPException:
+                pass
+    if errors:
+        raise errors[0]
+    return results
+async def refill_voctemp_pool(guild: discord.Guild):
+    """Ramener le pool à la taille configurée, au rythme du budget de créations"""
+    try:
+        while True:
+            data = get_guild_data(guild.id, mark_dirty=False)
+            config = data['config']['voctemp']
+            source = guild.get_channel(config.get('source_channel_id') or 0)
+            pool = data['voctemp_pool']
+            pool[:] = [pair for pair in pool if guild.get_channel(pair[0]) and guild.get_channel(pair[1])]
+            size = config.get('pool_size', 0) if source else 0
+            if len(pool) > size:
+                # Détacher le surplus avant toute attente : une attribution peut piocher dans le pool entre-temps
+                surplus = pool[size:]
+                del pool[size:]
+                mark_guild_dirty(guild.id, 'guild')
+                for pair in surplus:
+                    for channel_id in pair:
+                        channel = guild.get_channel(channel_id)
+                        if channel:
+                            try:
+                                await channel.delete(reason="Réduction du pool voc temporaire")
+                            except discord.HTTPException:
+                                pass
+            if len(pool) >= size:
+                return
+            await wait_voctemp_budget(guild.id, 2)
+            note_voctemp_creates(guild.id, 2)
+            try:
+                voice, text = await _create_voctemp_pool_pair(guild, source.category)
+            except discord.HTTPException as e:
+                print(f"[VOCTEMP] ❌ Réassort du pool impossible ({guild.name}): {e}")
+                return
+            data['voctemp_pool'].append([voice.id, text.id])
+            mark_guild_dirty(guild.id, 'guild')
+    finally:
+        voctemp_pool_tasks.pop(guild.id, None)
+def ensure_voctemp_pool(guild: discord.Guild):
+    """Lancer le réassort en tâche de fond s'il n'est pas déjà en cours"""
+    if guild.id not in voctemp_pool_tasks:
+        voctemp_pool_tasks[guild.id] = asyncio.create_task(refill_voctemp_pool(guild))
+async def claim_voctemp_pool_pair(member: discord.Member, category, room_data: dict):
+    """Attribuer une paire pré-créée : nom, catégorie et overwrites changés en un appel par salon"""
+    pair = take_voctemp_pool_pair(member.guild)
+    ensure_voctemp_pool(member.guild)
+    if pair is None:
+        return None
+    voice, text = pair
+    results = await asyncio.gather(
+        voice.edit(
+            name=f"🔊 {member.display_name}",
+            category=category,
+            overwrites=build_voctemp_creation_overwrites(category, member),
+            reason="Attribution voc temporaire"
+        ),
+        text.edit(
+            name=f"panel-{member.display_name[:12].lower().replace(' ', '-')}",
+            category=category,
+            overwrites=build_voctemp_panel_overwrites(member.guild, room_data),
+            reason="Attribution voc temporaire"
+        ),
+        return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        print(f"[VOCTEMP] ⚠️ Paire du pool inutilisable, création classique: {errors[0]}")
+        for channel in pair:
+            try:
+                await channel.delete(reason="Pool voc temporaire")
+            except discord.HTTPException:
+                pass
+        return None
+    return pair
 @bot.tree.command(name="voctemp", description="Configurer le système de salons vocaux temporaires")
 async def voctemp(interaction: discord.Interaction):
     if not await check_permissions(interaction):
@@ -1962,67 +3960,126 @@ async def voctemp(interaction: discord.Interaction):
         color=0x5865f2
     )
     embed.add_field(name="Salon actuel", value=current_text, inline=False)
+    pool_size = data['config']['voctemp'].get('pool_size', 0)
+    if pool_size:
+        embed.add_field(name="♻️ Salons pré-créés", value=f"{len(data['voctemp_pool'])}/{pool_size} prêts", inline=False)
+    embed.add_field(name="⏱️ Arrivée → déplacement", value=voctemp_latency_summary(interaction.guild.id), inline=False)
     await interaction.response.send_message(embed=embed, view=VocTempSetupView(), ephemeral=True)
-@bot.event
-async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
-    if member.bot:
-        return
-    data = get_guild_data(member.guild.id)
-    source_id = data['config']['voctemp'].get('source_channel_id')
-    if source_id and after.channel and after.channel.id == source_id:
-        category = after.channel.category
-        temp_channel = await member.guild.create_voice_channel(
+voctemp_queue = KeyedWorkQueue('VOCTEMP')
+voctemp_arriving = set()  # Vocs enregistrées dont le propriétaire n'a pas encore été déplacé
+async def create_temp_voice_room(member: discord.Member, source: discord.VoiceChannel):
+    """Partie critique, exécutée dans la file de la guilde : attribuer ou créer la voc du membre
+    et l'enregistrer. Retourne (voc, panel, room_data) ; panel et room_data valent None si le membre
+    possède déjà une voc, et tout vaut None s'il n'y a rien à faire. Le déplacement et l'envoi
+    du panel se font hors de la file"""
+    if not member.voice or not member.voice.channel or member.voice.channel.id != source.id:
+        return None, None, None  # Déjà déplacé ou reparti entre-temps
+    data = get_guild_data(member.guild.id, mark_dirty=False)
+    for channel_id, existing in voice_temp_rooms.items():
+        if existing['guild_id'] == member.guild.id and existing['owner_id'] == member.id:
+            channel = member.guild.get_channel(channel_id)
+            if channel:
+                # Second passage par le salon déclencheur : renvoyer dans sa voc plutôt qu'en créer une autre
+                return channel, None, None
+    category = source.category
+    room_data = {
+        'guild_id': member.guild.id,
+        'owner_id': member.id,
+        'text_channel_id': None,
+        'mode': 'open',
+        'whitelist': set(),
+        'blacklist': set(),
+        'toggles': {
+            'micro': True,
+            'video': True,
+            'soundboard': True,
+            'status': True
+        }
+    }
+    # Une paire pré-créée si le pool en a une, sinon les deux salons sont créés en parallèle,
+    # directement avec leurs overwrites définitifs
+    pair = await claim_voctemp_pool_pair(member, category, room_data) if data['config']['voctemp'].get('pool_size') else None
+    if pair is None:
+        note_voctemp_creates(member.guild.id, 2)
+    results = pair or await asyncio.gather(
+        member.guild.create_voice_channel(
             name=f"🔊 {member.display_name}",
             category=category,
+            overwrites=build_voctemp_creation_overwrites(category, member),
             reason="Création voc temporaire"
-        )
-        panel_overwrites = {
-            member.guild.default_role: discord.PermissionOverwrite(view_channel=False, read_message_history=False, send_messages=False),
-            member: discord.PermissionOverwrite(view_channel=True, read_message_history=True, send_messages=True)
-        }
-        if member.guild.me:
-            panel_overwrites[member.guild.me] = discord.PermissionOverwrite(view_channel=True, read_message_history=True, send_messages=True, manage_messages=True)
-        text_channel = await member.guild.create_text_channel(
+        ),
+        member.guild.create_text_channel(
             name=f"panel-{member.display_name[:12].lower().replace(' ', '-')}",
             category=category,
-            overwrites=panel_overwrites,
+            overwrites=build_voctemp_panel_overwrites(member.guild, room_data),
             reason="Panel voc temporaire"
-        )
-        room_data = {
-            'guild_id': member.guild.id,
-            'owner_id': member.id,
-            'text_channel_id': text_channel.id,
-            'mode': 'open',
-            'whitelist': set(),
-            'blacklist': set(),
-            'toggles': {
-                'micro': True,
-                'video': True,
-                'soundboard': True,
-                'status': True
-            }
-        }
-        voice_temp_rooms[temp_channel.id] = room_data
-        temp_voice_channels.add(temp_channel.id)
-        await temp_channel.set_permissions(member, manage_channels=True, move_members=True, connect=True, view_channel=True)
-        await sync_voctemp_panel_access(member.guild, room_data)
+        ),
+        return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        # Ne pas laisser de salon orphelin si l'une des deux créations a échoué
+        for created in results:
+            if not isinstance(created, BaseException):
+                try:
+                    await created.delete(reason="Création voc temporaire échouée")
+                except discord.HTTPException:
+                    pass
+        print(f"[VOCTEMP] ❌ Création impossible pour {member}: {errors[0]}")
+        return None, None, None
+    temp_channel, text_channel = results
+    room_data['text_channel_id'] = text_channel.id
+    voice_temp_rooms[temp_channel.id] = room_data
+    temp_voice_channels.add(temp_channel.id)
+    voctemp_arriving.add(temp_channel.id)
+    journal_record('voice_temp_rooms', temp_channel.id, 'put', value=room_data)
+    mark_state_dirty('voice_temp_rooms', temp_channel.id)
+    return temp_channel, text_channel, room_data
+async def join_temp_voice_room(member: discord.Member, source: discord.VoiceChannel, started: float):
+    """Arrivée dans le salon déclencheur : seule la création passe par la file de la guilde,
+    les déplacements et panels de plusieurs arrivées simultanées partent en parallèle"""
+    temp_channel, text_channel, room_data = await voctemp_queue.run(member.guild.id, lambda: create_temp_voice_room(member, source)) or (None, None, None)
+    if temp_channel is None:
+        return
+    try:
         await member.move_to(temp_channel)
+    finally:
+        voctemp_arriving.discard(temp_channel.id)
+    # Latence mesurée depuis l'événement : inclut l'attente dans la file
+    record_voctemp_latency(member.guild.id, time.monotonic() - started)
+    if text_channel is not None:
         embed = build_voctemp_embed(temp_channel, member, room_data)
         await text_channel.send(content=member.mention, embed=embed, view=VocTempPanelView(temp_channel.id))
-    for channel in [before.channel]:
-        if channel and channel.id in voice_temp_rooms and len(channel.members) == 0:
-            room_data = voice_temp_rooms.pop(channel.id)
-            temp_voice_channels.discard(channel.id)
-            text_channel = member.guild.get_channel(room_data['text_channel_id'])
-            try:
-                await channel.delete(reason="Suppression voc temporaire vide")
-            except:
-                pass
-            if text_channel:
-                try:
-                    await text_channel.delete(reason="Suppression panel voc temporaire")
-                except:
-                    pass
+async def delete_temp_voice_room(channel):
+    """Supprimer une voc temporaire vide et son panel ; exécuté dans la file de sa guilde"""
+    if channel.id not in temp_voice_channels or channel.id in voctemp_arriving or len(channel.members) > 0:
+        return  # Rejointe, en attente de son propriétaire ou déjà supprimée entre-temps
+    room_data = voice_temp_rooms.pop(channel.id, None)
+    temp_voice_channels.discard(channel.id)
+    if room_data is not None:
+        journal_record('voice_temp_rooms', channel.id, 'drop')
+        mark_state_dirty('voice_temp_rooms', channel.id)
+    try:
+        await channel.delete(reason="Suppression voc temporaire vide")
+    except discord.HTTPException as e:
+        print(f"[VOCTEMP] Erreur lors du nettoyage du salon vocal {channel.id}: {e}")
+    text_channel = channel.guild.get_channel(room_data['text_channel_id']) if room_data else None
+    if text_channel:
+        try:
+            await text_channel.delete(reason="Suppression panel voc temporaire")
+        except discord.HTTPException:
+            pass
+@bot.event
+async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    if member.bot:
+        return
+    data = get_guild_data(member.guild.id, mark_dirty=False)
+    source_id = data['config']['voctemp'].get('source_channel_id')
+    # Création et suppression passent par la file de la guilde : jamais deux en même temps
+    if source_id and after.channel and after.channel.id == source_id:
+        await join_temp_voice_room(member, after.channel, time.monotonic())
+    if before.channel and before.channel.id in voice_temp_rooms and len(before.channel.members) == 0:
+        await voctemp_queue.run(member.guild.id, lambda: delete_temp_voice_room(before.channel))
     await update_counter_channel_names(member.guild)
 class SeeMemberSetupModal(discord.ui.Modal):
     def __init__(self, mode: str):
@@ -2048,7 +4105,7 @@ class SeeMemberSetupModal(discord.ui.Modal):
             await interaction.response.send_message("❌ Ce salon n'est pas un salon vocal valide.", ephemeral=True)
             return
         await channel.set_permissions(interaction.guild.default_role, view_channel=True, connect=False)
-        data = get_guild_data(interaction.guild.id)
+        data = get_guild_data(interaction.guild.id, mark_dirty=True)
         if self.mode == 'members':
             data['config']['seemember_channel_id'] = channel.id
             await channel.edit(name=f"👥 Membres: {interaction.guild.member_count}")
@@ -2100,14 +4157,133 @@ async def seemembervoc(interaction: discord.Interaction):
 async def welcome_set(interaction: discord.Interaction, channel: discord.TextChannel, message: str):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['welcome_channel'] = channel.id
     data['config']['welcome_message'] = message
     
     embed = discord.Embed(title="👋 Bienvenue Configuré", description=f"**Salon:** {channel.mention}\n**Message:** {message}\n**Par:** {interaction.user.mention}", color=0xa30174)
     await interaction.response.send_message(embed=embed)
 # SONDAGES
-@bot.tree.command(name="poll", description="Créer un sondage avec réactions automatiques")
+POLL_EMOJIS = ['1️⃣', '2️⃣', '3️⃣', '4️⃣']
+POLL_EDIT_INTERVAL = 5  # Secondes minimum entre deux éditions du message d'un sondage
+poll_refresh_tasks = {}  # {message_id: tâche d'édition différée}
+poll_last_edit = {}  # {message_id: time.monotonic() de la dernière édition}
+def set_poll_vote(poll, user_id, option):
+    """Un vote par membre : option None retire le vote ; les totaux sont tenus à jour"""
+    previous = poll['votes'].pop(user_id, None)
+    if previous is not None:
+        poll['counts'][previous] -= 1
+    if option is not None:
+        poll['votes'][user_id] = option
+        poll['counts'][option] += 1
+    return previous
+def build_poll_embed(poll):
+    total = sum(poll['counts'])
+    embed = discord.Embed(title="📊 SONDAGE" if poll['active'] else "📊 SONDAGE TERMINÉ", description=poll['question'], color=0xa30174)
+    best = max(poll['counts']) if total else None
+    for index, option in enumerate(poll['options']):
+        count = poll['counts'][index]
+        percent = count * 100 / total if total else 0
+        bar = "█" * round(percent / 10) + "░" * (10 - round(percent / 10))
+        crown = " 🏆" if not poll['active'] and count == best else ""
+        embed.add_field(name=f"{POLL_EMOJIS[index]} {option}{crown}", value=f"{bar} {count} vote(s) • {percent:.0f}%", inline=False)
+    if poll['active'] and poll['end_time']:
+        embed.add_field(name="⏰ Fin", value=f"<t:{int(poll['end_time'].timestamp())}:R>", inline=False)
+    embed.set_footer(text=f"{total} votant(s)" + ("" if poll['active'] else " • Sondage clos"))
+    return embed
+class PollButton(discord.ui.DynamicItem[discord.ui.Button], template=r'poll:vote:(?P<option>[0-3])'):
+    """Bouton de vote sans état : le sondage est retrouvé par l'id du message cliqué"""
+    def __init__(self, option, label=None):
+        super().__init__(
+            discord.ui.Button(
+                style=discord.ButtonStyle.secondary,
+                emoji=POLL_EMOJIS[option],
+                label=label,
+                custom_id=f"poll:vote:{option}"
+            )
+        )
+        self.option = option
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(int(match['option']), item.label)
+    async def callback(self, interaction: discord.Interaction):
+        poll = polls.get(interaction.message.id)
+        if not poll or not poll['active'] or self.option >= len(poll['options']):
+            await interaction.response.send_message("❌ Ce sondage est terminé.", ephemeral=True)
+            return
+        # Recliquer sur son option retire le vote
+        option = None if poll['votes'].get(interaction.user.id) == self.option else self.option
+        set_poll_vote(poll, interaction.user.id, option)
+        journal_record('polls', interaction.message.id, 'poll_vote', user=interaction.user.id, option=option)
+        mark_state_dirty('polls', interaction.message.id)
+        schedule_poll_refresh(interaction.message.id)
+        if option is None:
+            await interaction.response.send_message("🗑️ Vote retiré.", ephemeral=True)
+        else:
+            await interaction.response.send_message(f"✅ Vote enregistré : {POLL_EMOJIS[option]} {poll['options'][option]}", ephemeral=True)
+bot.add_dynamic_items(PollButton)
+def build_poll_view(poll):
+    view = discord.ui.View(timeout=None)
+    for index, option in enumerate(poll['options']):
+        view.add_item(PollButton(index, option[:80]))
+    return view
+async def edit_poll_message(message_id, **kwargs):
+    poll = polls.get(message_id)
+    channel = bot.get_channel(poll['channel_id']) if poll else None
+    if channel is None:
+        return
+    poll_last_edit[message_id] = time.monotonic()
+    try:
+        await channel.get_partial_message(message_id).edit(embed=build_poll_embed(poll), **kwargs)
+    except discord.HTTPException as e:
+        print(f"[POLL] ❌ Édition du sondage {message_id} impossible: {e}")
+def schedule_poll_refresh(message_id):
+    """Regrouper les votes : au plus une édition du message toutes les POLL_EDIT_INTERVAL secondes"""
+    if message_id in poll_refresh_tasks:
+        return
+    async def refresh():
+        try:
+            delay = poll_last_edit.get(message_id, 0) + POLL_EDIT_INTERVAL - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        finally:
+            poll_refresh_tasks.pop(message_id, None)
+        if message_id in polls and polls[message_id]['active']:
+            await edit_poll_message(message_id)
+    poll_refresh_tasks[message_id] = asyncio.create_task(refresh())
+async def close_poll(message_id):
+    """Clore le sondage : résultats finaux sur le message, boutons retirés, annonce du résultat"""
+    poll = polls.get(message_id)
+    if not poll or not poll['active']:
+        return
+    poll['active'] = False
+    poll_scheduler.cancel(message_id)
+    task = poll_refresh_tasks.pop(message_id, None)
+    if task:
+        task.cancel()
+    journal_record('polls', message_id, 'put', value=poll)
+    mark_state_dirty('polls', message_id)
+    await edit_poll_message(message_id, view=None)
+    channel = bot.get_channel(poll['channel_id'])
+    total = sum(poll['counts'])
+    if channel is None:
+        return
+    if total:
+        best = max(poll['counts'])
+        winners = [f"{POLL_EMOJIS[i]} **{option}**" for i, option in enumerate(poll['options']) if poll['counts'][i] == best]
+        text = f"📊 Sondage terminé : **{poll['question']}**\nRésultat : {' / '.join(winners)} ({best}/{total} votes)"
+    else:
+        text = f"📊 Sondage terminé : **{poll['question']}**\nAucun vote."
+    try:
+        await channel.send(text, reference=channel.get_partial_message(message_id), mention_author=False)
+    except discord.HTTPException:
+        pass
+poll_scheduler = DeadlineScheduler('POLL', close_poll)
+def schedule_active_polls():
+    for message_id, poll in polls.items():
+        if poll['active'] and poll['end_time']:
+            poll_scheduler.schedule(message_id, poll['end_time'].timestamp())
+@bot.tree.command(name="poll", description="Créer un sondage avec boutons de vote")
 @app_commands.describe(
     question="Question du sondage", 
     option1="Option 1", 
@@ -2123,20 +4299,33 @@ async def poll(interaction: discord.Interaction, question: str, option1: str, op
     if option4: 
         options.append(option4)
     
-    embed = discord.Embed(title="📊 SONDAGE", description=question, color=0xa30174)
-    
-    reactions = ['1️⃣', '2️⃣', '3️⃣', '4️⃣']
-    for i, option in enumerate(options):
-        embed.add_field(name=f"{reactions[i]} Option {i+1}", value=option, inline=False)
-    
+    end_time = None
     if duration:
-        embed.set_footer(text=f"Durée: {duration}")
+        try:
+            end_time = datetime.now() + timedelta(minutes=parse_duration_minutes(duration))
+        except ValueError:
+            await interaction.response.send_message("❌ Durée invalide! Format: 30m, 2h, 1d", ephemeral=True)
+            return
     
-    message = await interaction.response.send_message(embed=embed)
+    record = {
+        'guild_id': interaction.guild.id,
+        'channel_id': interaction.channel.id,
+        'question': question,
+        'options': options,
+        'votes': {},  # {user_id: index de l'option}
+        'counts': [0] * len(options),
+        'end_time': end_time,
+        'active': True
+    }
+    await interaction.response.send_message(embed=build_poll_embed(record), view=build_poll_view(record))
     msg = await interaction.original_response()
     
-    for i in range(len(options)):
-        await msg.add_reaction(reactions[i])
+    polls[msg.id] = record
+    journal_record('polls', msg.id, 'put', value=record)
+    mark_state_dirty('polls', msg.id)
+    poll_last_edit[msg.id] = time.monotonic()
+    if end_time:
+        poll_scheduler.schedule(msg.id, end_time.timestamp())
 # SYSTÈME DE TICKETS
 @bot.tree.command(name="viewpanelticket", description="Afficher le panneau avec menu déroulant pour ouvrir les tickets")
 async def viewpanelticket(interaction: discord.Interaction):
@@ -2163,7 +4352,7 @@ async def category(interaction: discord.Interaction, action: str, nom: str, nouv
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     categories = data['ticket_categories']
     
     if action == "add":
@@ -2206,7 +4395,7 @@ async def setroleticket(interaction: discord.Interaction, role: discord.Role, ac
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     
     if action == "add":
         if role.id not in data['config']['ticket_roles']:
@@ -2227,7 +4416,7 @@ async def setcategory(interaction: discord.Interaction, category: discord.Catego
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['ticket_category'] = category.id
     
     embed = discord.Embed(title="🎫 Catégorie Tickets Configurée", description=f"**Catégorie:** {category.name}\n**Par:** {interaction.user.mention}", color=0xa30174)
@@ -2237,7 +4426,7 @@ async def setcategory(interaction: discord.Interaction, category: discord.Catego
 async def setticketroute(interaction: discord.Interaction, ticket_key: str, category: discord.CategoryChannel):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     categories = refresh_ticket_categories(interaction.guild.id)
     if ticket_key not in categories:
         available = ', '.join(categories.keys())
@@ -2256,7 +4445,7 @@ async def setticketroute(interaction: discord.Interaction, ticket_key: str, cate
 async def resetticketroute(interaction: discord.Interaction, ticket_key: str):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     mapping = data['config'].setdefault('ticket_category_map', {})
     if ticket_key not in mapping:
         await interaction.response.send_message("❌ Aucun routage trouvé pour cette catégorie.", ephemeral=True)
@@ -2283,7 +4472,7 @@ async def ticketroutes(interaction: discord.Interaction):
 async def setticketping(interaction: discord.Interaction, action: str, role: discord.Role = None):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     ping_roles = data['config'].setdefault('ticket_ping_roles', [])
     if action == 'add':
         if not role:
@@ -2323,18 +4512,12 @@ async def viewticketping(interaction: discord.Interaction):
     await interaction.response.send_message(embed=embed, ephemeral=True)
 @bot.tree.command(name="closeticket", description="Fermer un ticket (enlève les permissions d'écriture)")
 async def closeticket(interaction: discord.Interaction):
-    if not interaction.channel.name.startswith('ticket-'):
+    ticket = get_ticket(interaction.channel.id)
+    if not ticket:
         await interaction.response.send_message("❌ Cette commande ne fonctionne que dans un ticket!", ephemeral=True)
         return
     
-    # Extraire le numéro de ticket du nom si possible
-    channel_parts = interaction.channel.name.split('-')
-    ticket_info = f"Ticket {interaction.channel.name}"
-    
-    if len(channel_parts) >= 4:
-        ticket_number = channel_parts[-1]  # Dernier élément = numéro
-        category_name = channel_parts[1]   # Deuxième élément = catégorie
-        ticket_info = f"Ticket #{ticket_number} ({category_name})"
+    ticket_info = f"Ticket #{ticket['number']} ({ticket['category']})"
     
     embed = discord.Embed(
         title="🔒 Ticket Fermé", 
@@ -2433,7 +4616,7 @@ async def resetticket(interaction: discord.Interaction):
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     
     # Reset embed
     data['config']['ticket_embed'] = {
@@ -2472,16 +4655,14 @@ async def ticketstats(interaction: discord.Interaction):
     guild = interaction.guild
     
     # Compter les tickets ouverts
-    open_tickets = len([ch for ch in guild.text_channels if ch.name.startswith('ticket-')])
+    open_tickets = len(tickets_by_guild.get(guild.id, ()))
     
     # Statistiques par catégorie
-    category_stats = {}
-    for channel in guild.text_channels:
-        if channel.name.startswith('ticket-'):
-            parts = channel.name.split('-')
-            if len(parts) >= 4:
-                category = parts[1]
-                category_stats[category] = category_stats.get(category, 0) + 1
+    category_stats = {
+        category: len(channel_ids)
+        for (guild_id, category), channel_ids in tickets_by_category.items()
+        if guild_id == guild.id and channel_ids
+    }
     
     embed = discord.Embed(
         title="📊 Statistiques des Tickets",
@@ -2517,7 +4698,7 @@ async def presetticket(interaction: discord.Interaction, preset: str):
         return
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     
     presets = {
         'default': {
@@ -2603,14 +4784,29 @@ async def presetticket(interaction: discord.Interaction, preset: str):
             overwrite.send_messages = False
             await interaction.channel.set_permissions(target, overwrite=overwrite)
 @bot.tree.command(name="setticketlogs", description="Définir le salon de logs pour les tickets")
-@app_commands.describe(channel="Salon où seront envoyés les logs des tickets")
-async def setticketlogs(interaction: discord.Interaction, channel: discord.TextChannel):
+@app_commands.describe(channel="Salon où seront envoyés les logs des tickets", format="Format du transcript : txt/jsonl/html", compression="Compression : none/gzip/zstd")
+async def setticketlogs(interaction: discord.Interaction, channel: discord.TextChannel, format: str = None, compression: str = None):
     if not interaction.user.guild_permissions.manage_channels:
         await interaction.response.send_message("❌ Permissions insuffisantes!", ephemeral=True)
         return
+    if format is not None and format not in TRANSCRIPT_FORMATS:
+        await interaction.response.send_message("❌ Format invalide! Utilisez: txt, jsonl, html", ephemeral=True)
+        return
+    if compression is not None and compression not in TRANSCRIPT_COMPRESSIONS:
+        await interaction.response.send_message("❌ Compression invalide! Utilisez: none, gzip, zstd", ephemeral=True)
+        return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['ticket_logs_channel'] = channel.id
+    settings = data['config']['ticket_transcript']
+    if format is not None:
+        settings['format'] = format
+    if compression is not None:
+        settings['compression'] = compression
+    fmt, effective_compression = transcript_settings(data['config'])
+    extension = TRANSCRIPT_FORMATS[fmt]['extension']
+    if TRANSCRIPT_COMPRESSIONS[effective_compression]:
+        extension += f".{TRANSCRIPT_COMPRESSIONS[effective_compression]}"
     
     embed = discord.Embed(
         title="📋 Salon de Logs Tickets Configuré",
@@ -2619,7 +4815,7 @@ async def setticketlogs(interaction: discord.Interaction, channel: discord.TextC
     )
     embed.add_field(
         name="ℹ️ Information",
-        value="Les transcripts des tickets supprimés seront envoyés dans ce salon sous forme de fichier .txt",
+        value=f"Les transcripts des tickets supprimés seront envoyés dans ce salon sous forme de fichier .{extension}",
         inline=False
     )
     
@@ -2629,7 +4825,7 @@ async def removeticketlogs(interaction: discord.Interaction):
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['ticket_logs_channel'] = None
     
     embed = discord.Embed(
@@ -2647,7 +4843,8 @@ async def removeticketlogs(interaction: discord.Interaction):
 @bot.tree.command(name="deleteticket", description="Supprimer complètement le salon ticket (avec transcript)")
 async def deleteticket(interaction: discord.Interaction):
     # Vérifier que c'est bien un ticket
-    if not interaction.channel.name.startswith('ticket-'):
+    ticket = get_ticket(interaction.channel.id)
+    if not ticket:
         await interaction.response.send_message("❌ Cette commande ne fonctionne que dans un ticket!", ephemeral=True)
         return
     
@@ -2662,54 +4859,16 @@ async def deleteticket(interaction: discord.Interaction):
     
     # ÉTAPE 1: Créer le transcript complet
     print("[LOGS] Création du transcript...")
-    transcript_text = await create_ticket_transcript(interaction.channel)
-    print(f"[LOGS] Transcript créé")
+    transcript = await create_ticket_transcript(interaction.channel)
+    print(f"[LOGS] Transcript créé ({len(transcript)} partie(s))")
     
     # ÉTAPE 2: Extraire les informations du ticket
     print("[LOGS] ÉTAPE 2: Extraction des informations...")
-    channel_parts = interaction.channel.name.split('-')
-    ticket_number = "N/A"
-    ticket_category = "N/A"
-    creator_user = None
-    
-    print(f"[LOGS] Channel name: {interaction.channel.name}")
-    print(f"[LOGS] Channel topic: {interaction.channel.topic}")
-    print(f"[LOGS] Parties du nom: {channel_parts}")
-    
-    # MÉTHODE 1: Extraire l'ID utilisateur depuis le topic (PLUS FIABLE)
-    if interaction.channel.topic:
-        try:
-            # Le topic contient "ID: 123456789"
-            if "ID:" in interaction.channel.topic:
-                user_id_str = interaction.channel.topic.split("ID:")[1].split(")")[0].strip()
-                user_id = int(user_id_str)
-                creator_user = interaction.guild.get_member(user_id)
-                if creator_user:
-                    print(f"[LOGS] ✅ Créateur trouvé via TOPIC: {creator_user.name} (ID: {creator_user.id})")
-        except Exception as e:
-            print(f"[LOGS] ⚠️ Erreur extraction ID depuis topic: {e}")
-    
-    # Format: ticket-category-username-number
-    if len(channel_parts) >= 4:
-        ticket_category = channel_parts[1].title()
-        ticket_number = channel_parts[-1]
-        username_part = channel_parts[2]
-        
-        print(f"[LOGS] ✅ Catégorie: {ticket_category}")
-        print(f"[LOGS] ✅ Numéro: {ticket_number}")
-        
-        # MÉTHODE 2: Chercher par nom nettoyé (FALLBACK si topic vide)
-        if not creator_user:
-            print(f"[LOGS] Recherche du créateur par nom...")
-            for member in interaction.guild.members:
-                try:
-                    clean_member = clean_username(member.display_name)
-                    if clean_member == username_part:
-                        creator_user = member
-                        print(f"[LOGS] ✅ Créateur trouvé via NOM: {member.name}")
-                        break
-                except:
-                    continue
+    ticket_number = ticket['number']
+    ticket_category = ticket['category']
+    creator_user = interaction.guild.get_member(ticket['creator_id']) if ticket['creator_id'] else None
+    print(f"[LOGS] ✅ Catégorie: {ticket_category}")
+    print(f"[LOGS] ✅ Numéro: {ticket_number}")
     
     if not creator_user:
         print(f"[LOGS] ⚠️ Créateur non trouvé")
@@ -2721,43 +4880,31 @@ async def deleteticket(interaction: discord.Interaction):
         'creator': creator_user.mention if creator_user else "Inconnu"
     }
     
-    # ÉTAPE 4: Envoyer les logs via la fonction dédiée
-    print("[LOGS] Envoi des logs...")
-    await send_ticket_log(
+    # ÉTAPE 4: Envoyer les logs (upload unique) puis le DM au créateur
+    print("[LOGS] Envoi des logs et du DM...")
+    dm_embed = discord.Embed(
+        title="📄 Transcript de votre ticket",
+        color=0xa30174,
+        timestamp=datetime.now()
+    )
+    dm_embed.add_field(name="🎫 Ticket", value=interaction.channel.name, inline=True)
+    dm_embed.add_field(name="📊 Numéro", value=f"#{ticket_number}", inline=True)
+    dm_embed.add_field(name="🏷️ Catégorie", value=ticket_category, inline=True)
+    dm_embed.add_field(name="🗑️ Supprimé par", value=f"{interaction.user.name}", inline=True)
+    dm_embed.set_footer(text=f"Serveur: {interaction.guild.name}")
+    if not creator_user:
+        print("[LOGS] ❌ Créateur non trouvé, impossible d'envoyer le DM")
+    await deliver_ticket_transcript(
         interaction.guild,
         interaction.channel.name,
         ticket_info,
-        transcript_text,
-        interaction.user
+        transcript,
+        interaction.user,
+        creator_user,
+        dm_embed
     )
     
-    # ÉTAPE 5: Envoyer en DM au créateur
-    print("[LOGS] Envoi en DM au créateur...")
-    if creator_user:
-        try:
-            dm_embed = discord.Embed(
-                title="📄 Transcript de votre ticket",
-                color=0xa30174,
-                timestamp=datetime.now()
-            )
-            dm_embed.add_field(name="🎫 Ticket", value=interaction.channel.name, inline=True)
-            dm_embed.add_field(name="📊 Numéro", value=f"#{ticket_number}", inline=True)
-            dm_embed.add_field(name="🏷️ Catégorie", value=ticket_category, inline=True)
-            dm_embed.add_field(name="🗑️ Supprimé par", value=f"{interaction.user.name}", inline=True)
-            dm_embed.set_footer(text=f"Serveur: {interaction.guild.name}")
-            
-            filename = f"transcript-{interaction.channel.name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
-            file_for_dm = discord.File(io.StringIO(transcript_text), filename=filename)
-            await creator_user.send(embed=dm_embed, file=file_for_dm)
-            print(f"[LOGS] ✅ DM envoyé à {creator_user.name}")
-        except discord.Forbidden:
-            print(f"[LOGS] ❌ DM fermés pour {creator_user.name}")
-        except Exception as e:
-            print(f"[LOGS] ❌ Erreur envoi DM: {e}")
-    else:
-        print("[LOGS] ❌ Créateur non trouvé, impossible d'envoyer le DM")
-    
-    # ÉTAPE 6: Supprimer le salon
+    # ÉTAPE 5: Supprimer le salon
     print("[LOGS] Suppression du salon...")
     try:
         await interaction.channel.delete(reason=f"Ticket supprimé par {interaction.user}")
@@ -2890,10 +5037,9 @@ async def create_ticket(interaction, user, category_key):
     channel_name = f"ticket-{clean_category}-{clean_user}-{ticket_number}"
     
     # Vérifier si l'utilisateur a déjà un ticket ouvert
-    for channel in guild.text_channels:
-        if channel.name.startswith(f"ticket-") and f"-{clean_user}-" in channel.name:
-            await interaction.response.send_message("❌ Vous avez déjà un ticket ouvert!", ephemeral=True)
-            return
+    if find_open_ticket(guild.id, user.id):
+        await interaction.response.send_message("❌ Vous avez déjà un ticket ouvert!", ephemeral=True)
+        return
     
     # Créer les permissions du salon ticket
     overwrites = {
@@ -2931,6 +5077,7 @@ async def create_ticket(interaction, user, category_key):
             category=ticket_category,
             topic=topic_text
         )
+    register_ticket(guild.id, channel.id, user.id, category_display_name, str(ticket_number))
     
     # Créer l'embed du nouveau ticket
     embed = discord.Embed(
@@ -2994,34 +5141,106 @@ async def custompanelkey(interaction: discord.Interaction):
         return
     
     await interaction.response.send_modal(CustomKeyPanelModal())
+# IMPORT / EXPORT DE CLÉS
+KEY_IMPORT_MAX_BYTES = 16 * 1024 * 1024
+KEY_IMPORT_CHUNK = 5000  # Clés ajoutées entre deux retours à la boucle asyncio
+KEY_REPORT_LIMIT = 20  # Au-delà, le rapport d'ajout ne liste plus les clés
+key_import_locks = {}  # {(guild_id, champ): asyncio.Lock} : un import à la fois par stock
+KEY_IMPORT_EXTENSIONS = ('.txt', '.csv')
+KEY_IMPORT_CONTENT_TYPES = ('text/', 'application/csv', 'application/vnd.ms-excel')  # Types annoncés pour un .csv
+def is_key_import_file(file):
+    """Seuls les fichiers texte .txt / .csv sont importés (pas d'image ou binaire joint par erreur)"""
+    if not file.filename.lower().endswith(KEY_IMPORT_EXTENSIONS):
+        return False
+    content_type = (file.content_type or '').split(';')[0].strip().lower()
+    return not content_type or content_type.startswith(KEY_IMPORT_CONTENT_TYPES)
+def parse_key_file(filename, payload):
+    """Clés d'un fichier importé : première colonne pour un .csv, sinon tous les mots de chaque ligne"""
+    lines = payload.decode('utf-8-sig').splitlines()  # UnicodeDecodeError : pas un fichier texte
+    if filename.lower().endswith('.csv'):
+        keys = [row[0].strip() for row in csv.reader(lines) if row and row[0].strip()]
+        if keys and keys[0].lower() in ('key', 'keys', 'cle', 'clé', 'clés'):
+            keys.pop(0)  # En-tête
+        return keys
+    return [key for line in lines for key in line.split()]
+async def add_keys_to_pool(guild_id, field, keys):
+    """Ajouter des clés par lots (journalisés) sans bloquer la boucle ; retourne (ajoutées, doublons)"""
+    pool = get_guild_data(guild_id)[field]
+    added_keys = []
+    existing_keys = []
+    async with key_import_locks.setdefault((guild_id, field), asyncio.Lock()):
+        for start in range(0, len(keys), KEY_IMPORT_CHUNK):
+            chunk = keys[start:start + KEY_IMPORT_CHUNK]
+            added = pool.add_many(chunk)
+            if added:
+                journal_record('key_stock', guild_id, 'key_add', field=field, keys=added)
+            added_keys.extend(added)
+            if len(added) != len(chunk):
+                added_set = set(added)
+                existing_keys.extend(key for key in chunk if key not in added_set)
+            if start + KEY_IMPORT_CHUNK < len(keys):
+                await asyncio.sleep(0)
+    return added_keys, existing_keys
+def format_key_report(keys, label):
+    if len(keys) <= KEY_REPORT_LIMIT:
+        return f"{len(keys)} {label}: {', '.join(f'`{k}`' for k in keys)}"
+    return f"{len(keys)} {label}"
+async def read_key_sources(interaction, keys, file):
+    """Clés du texte et/ou du fichier joint ; None (après réponse d'erreur) si rien d'exploitable"""
+    key_list = keys.split() if keys else []
+    if file is not None:
+        if not is_key_import_file(file):
+            await interaction.response.send_message("❌ Format non pris en charge : joignez un fichier texte .txt ou .csv!", ephemeral=True)
+            return None
+        if file.size > KEY_IMPORT_MAX_BYTES:
+            await interaction.response.send_message(f"❌ Fichier trop volumineux (max {KEY_IMPORT_MAX_BYTES // (1024 * 1024)} Mo)!", ephemeral=True)
+            return None
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        payload = await file.read()
+        try:
+            key_list += await asyncio.to_thread(parse_key_file, file.filename, payload)
+        except UnicodeDecodeError:
+            await reply_key_command(interaction, "❌ Le fichier n'est pas un texte UTF-8 lisible!")
+            return None
+    if not key_list:
+        await reply_key_command(interaction, "❌ Aucune clé fournie (texte ou fichier .txt/.csv)!")
+        return None
+    return key_list
+async def reply_key_command(interaction, content=None, **kwargs):
+    if interaction.response.is_done():
+        await interaction.followup.send(content, ephemeral=True, **kwargs)
+    else:
+        await interaction.response.send_message(content, ephemeral=True, **kwargs)
+def _encode_key_export(lines, filename):
+    if not filename.endswith('.csv'):
+        return ("\n".join(lines) + "\n").encode('utf-8')
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(lines)  # Guillemets si une clé contient , ou "
+    return buffer.getvalue().encode('utf-8')
+async def send_key_export(interaction, lines, filename, summary):
+    """Exporter une liste en fichier joint : une entrée par ligne, ou une ligne CSV par tuple pour un .csv"""
+    payload = await asyncio.to_thread(_encode_key_export, lines, filename)
+    await reply_key_command(interaction, summary, file=discord.File(io.BytesIO(payload), filename=filename))
 @bot.tree.command(name="addkey", description="Ajouter une ou plusieurs clés au stock (séparées par des espaces)")
-@app_commands.describe(keys="Clés à ajouter (séparées par des espaces)")
-async def addkey(interaction: discord.Interaction, keys: str):
+@app_commands.describe(keys="Clés à ajouter (séparées par des espaces)", file="Fichier .txt/.csv de clés (une par ligne)")
+async def addkey(interaction: discord.Interaction, keys: str = None, file: discord.Attachment = None):
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
-    key_list = keys.split()
-    
-    added_keys = []
-    existing_keys = []
-    
-    for key in key_list:
-        if key not in data['keys']:
-            data['keys'].append(key)
-            added_keys.append(key)
-        else:
-            existing_keys.append(key)
+    key_list = await read_key_sources(interaction, keys, file)
+    if key_list is None:
+        return
+    added_keys, existing_keys = await add_keys_to_pool(interaction.guild.id, 'keys', key_list)
     
     response_parts = []
     if added_keys:
-        response_parts.append(f"✅ {len(added_keys)} clé(s) ajoutée(s): {', '.join(f'`{k}`' for k in added_keys)}")
+        response_parts.append(f"✅ {format_key_report(added_keys, 'clé(s) ajoutée(s)')}")
     if existing_keys:
-        response_parts.append(f"❌ {len(existing_keys)} clé(s) déjà existante(s): {', '.join(f'`{k}`' for k in existing_keys)}")
+        response_parts.append(f"❌ {format_key_report(existing_keys, 'clé(s) déjà existante(s)')}")
     
-    response_parts.append(f"📊 Stock total: {len(data['keys'])} clés")
+    response_parts.append(f"📊 Stock total: {len(get_guild_data(interaction.guild.id)['keys'])} clés")
     
-    await interaction.response.send_message("\n".join(response_parts), ephemeral=True)
+    await reply_key_command(interaction, "\n".join(response_parts))
 @bot.tree.command(name="removekey", description="Supprimer une clé du stock")
 @app_commands.describe(key="Clé à supprimer")
 async def removekey(interaction: discord.Interaction, key: str):
@@ -3029,17 +5248,21 @@ async def removekey(interaction: discord.Interaction, key: str):
         return
     
     data = get_guild_data(interaction.guild.id)
-    if key in data['keys']:
-        data['keys'].remove(key)
+    if data['keys'].remove(key):
+        journal_record('key_stock', interaction.guild.id, 'key_remove', field='keys', key=key)
         await interaction.response.send_message(f"✅ Clé `{key}` supprimée! Stock: {len(data['keys'])}", ephemeral=True)
     else:
         await interaction.response.send_message(f"❌ Clé `{key}` introuvable!", ephemeral=True)
 @bot.tree.command(name="stockkey", description="Voir le nombre de clés disponibles")
-async def stockkey(interaction: discord.Interaction):
+@app_commands.describe(export="Recevoir le stock complet en fichier .txt")
+async def stockkey(interaction: discord.Interaction, export: bool = False):
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=False)
+    if export:
+        await send_key_export(interaction, list(data['keys']), f"keys-{interaction.guild.id}.txt", f"📤 {len(data['keys'])} clé(s) en stock")
+        return
     
     embed = discord.Embed(title="📊 Stock Clés Promoteur", description=f"**Clés disponibles:** {len(data['keys'])}", color=0x0099ff)
     await interaction.response.send_message(embed=embed, ephemeral=True)
@@ -3049,7 +5272,7 @@ async def setrolekey(interaction: discord.Interaction, role: discord.Role):
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     if role.id not in data['config']['key_roles']:
         data['config']['key_roles'].append(role.id)
         await interaction.response.send_message(f"✅ Rôle {role.mention} autorisé pour les clés!")
@@ -3061,7 +5284,7 @@ async def setcooldownkey(interaction: discord.Interaction, minutes: int):
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     data['config']['key_cooldown'] = minutes
     
     embed = discord.Embed(title="⏰ Cooldown Clés Configuré", description=f"**Cooldown:** {minutes} minutes\n**Par:** {interaction.user.mention}", color=0xa30174)
@@ -3188,8 +5411,8 @@ class HelpSelect(discord.ui.Select):
                 color=0xff69b4
             ).add_field(name="Commandes", value="""
 `/gcreate` - Créer un giveaway avec panneau interactif (+ image)
-`/greroll <message_id>` - Relancer un giveaway
-`/glist` - Lister les giveaways actifs
+`/greroll <message_id> [winners]` - Relancer un giveaway (exclut les gagnants déjà tirés)
+`/glist [resync]` - Lister les giveaways actifs (resync : recompter les réactions)
 `/gend <message_id>` - Terminer un giveaway prématurément
 `/gdelete <message_id>` - Supprimer un giveaway
             """, inline=False),
@@ -3296,7 +5519,7 @@ class HelpSelect(discord.ui.Select):
                 description="**1 commande disponible**",
                 color=0xffd700
             ).add_field(name="Commandes", value="""
-`/poll <question> <option1> <option2> [option3] [option4] [duration]` - Créer un sondage avec réactions automatiques
+`/poll <question> <option1> <option2> [option3] [option4] [duration]` - Créer un sondage à boutons (clôture automatique)
             """, inline=False),
             
             "tickets": discord.Embed(
@@ -3316,7 +5539,7 @@ class HelpSelect(discord.ui.Select):
 `/presetticket <preset>` - Charger un preset d'embed (default/modern/elegant/gaming)
 `/ticketstats` - Voir les statistiques des tickets
             """, inline=False).add_field(name="📋 Logs & Transcripts", value="""
-`/setticketlogs <channel>` - Définir le salon de logs tickets (transcripts .txt)
+`/setticketlogs <channel> [format] [compression]` - Salon de logs tickets (txt/jsonl/html, gzip/zstd)
 `/removeticketlogs` - Supprimer le salon de logs tickets
             """, inline=False).add_field(name="🎫 Actions dans les Tickets", value="""
 `/closeticket` - Fermer un ticket (dans le salon ticket)
@@ -3337,9 +5560,9 @@ class HelpSelect(discord.ui.Select):
 `/viewpanelkeypromot` - Afficher le panel pour récupérer des clés (permanent)
 `/custompanelkey` - Personnaliser l'embed du panel key (+ images, bouton custom)
             """, inline=False).add_field(name="⚙️ Gestion & Configuration", value="""
-`/addkey <keys>` - Ajouter clés (séparées par espaces : KEY1 KEY2 KEY3)
+`/addkey [keys] [file]` - Ajouter clés (KEY1 KEY2 KEY3 ou fichier .txt/.csv)
 `/removekey <key>` - Supprimer une clé du stock
-`/stockkey` - Voir le nombre de clés disponibles
+`/stockkey [export]` - Voir (ou exporter) les clés disponibles
 `/setrolekey <role>` - Définir les rôles autorisés à récupérer des clés
 `/setcooldownkey <minutes>` - Définir le cooldown entre les récupérations
 `/configkey` - Voir la configuration actuelle du panel key
@@ -3358,9 +5581,9 @@ class HelpSelect(discord.ui.Select):
 `/viewpanelfreekey` - Afficher le panel pour récupérer des clés gratuites (permanent)
 `/custompanelfreekey` - Personnaliser l'embed du panel (+ images, bouton custom)
             """, inline=False).add_field(name="⚙️ Gestion & Configuration", value="""
-`/addfreekey <keys>` - Ajouter free keys (séparées par espaces : FREE1 FREE2 FREE3)
+`/addfreekey [keys] [file]` - Ajouter free keys (FREE1 FREE2 FREE3 ou fichier .txt/.csv)
 `/removefreekey <key>` - Supprimer une free key du stock
-`/stockfreekey` - Voir le stock de free keys
+`/stockfreekey [export]` - Voir (ou exporter) le stock de free keys
 `/resetfreekey` - Reset la liste des utilisateurs (permet de récupérer à nouveau)
 `/configfreekey` - Voir la configuration actuelle du panel free key
 `/resetfreekeyconfig` - Remettre la configuration par défaut
@@ -3451,7 +5674,7 @@ async def resetfreekeyconfig(interaction: discord.Interaction):
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=True)
     
     # Reset embed
     data['config']['freekey_embed'] = {
@@ -3481,33 +5704,25 @@ async def custompanelfreekey(interaction: discord.Interaction):
     
     await interaction.response.send_modal(CustomFreeKeyPanelModal())
 @bot.tree.command(name="addfreekey", description="Ajouter une ou plusieurs free keys au stock (séparées par des espaces)")
-@app_commands.describe(keys="Free keys à ajouter (séparées par des espaces)")
-async def addfreekey(interaction: discord.Interaction, keys: str):
+@app_commands.describe(keys="Free keys à ajouter (séparées par des espaces)", file="Fichier .txt/.csv de clés (une par ligne)")
+async def addfreekey(interaction: discord.Interaction, keys: str = None, file: discord.Attachment = None):
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
-    key_list = keys.split()
-    
-    added_keys = []
-    existing_keys = []
-    
-    for key in key_list:
-        if key not in data['free_keys']:
-            data['free_keys'].append(key)
-            added_keys.append(key)
-        else:
-            existing_keys.append(key)
+    key_list = await read_key_sources(interaction, keys, file)
+    if key_list is None:
+        return
+    added_keys, existing_keys = await add_keys_to_pool(interaction.guild.id, 'free_keys', key_list)
     
     response_parts = []
     if added_keys:
-        response_parts.append(f"✅ {len(added_keys)} free key(s) ajoutée(s): {', '.join(f'`{k}`' for k in added_keys)}")
+        response_parts.append(f"✅ {format_key_report(added_keys, 'free key(s) ajoutée(s)')}")
     if existing_keys:
-        response_parts.append(f"❌ {len(existing_keys)} free key(s) déjà existante(s): {', '.join(f'`{k}`' for k in existing_keys)}")
+        response_parts.append(f"❌ {format_key_report(existing_keys, 'free key(s) déjà existante(s)')}")
     
-    response_parts.append(f"📊 Stock total: {len(data['free_keys'])} free keys")
+    response_parts.append(f"📊 Stock total: {len(get_guild_data(interaction.guild.id)['free_keys'])} free keys")
     
-    await interaction.response.send_message("\n".join(response_parts), ephemeral=True)
+    await reply_key_command(interaction, "\n".join(response_parts))
 @bot.tree.command(name="removefreekey", description="Supprimer une free key du stock")
 @app_commands.describe(key="Free key à supprimer")
 async def removefreekey(interaction: discord.Interaction, key: str):
@@ -3515,17 +5730,21 @@ async def removefreekey(interaction: discord.Interaction, key: str):
         return
     
     data = get_guild_data(interaction.guild.id)
-    if key in data['free_keys']:
-        data['free_keys'].remove(key)
+    if data['free_keys'].remove(key):
+        journal_record('key_stock', interaction.guild.id, 'key_remove', field='free_keys', key=key)
         await interaction.response.send_message(f"✅ Free key `{key}` supprimée! Stock: {len(data['free_keys'])}", ephemeral=True)
     else:
         await interaction.response.send_message(f"❌ Free key `{key}` introuvable!", ephemeral=True)
 @bot.tree.command(name="stockfreekey", description="Voir le stock de free keys")
-async def stockfreekey(interaction: discord.Interaction):
+@app_commands.describe(export="Recevoir le stock complet en fichier .txt")
+async def stockfreekey(interaction: discord.Interaction, export: bool = False):
     if not await check_permissions(interaction):
         return
     
-    data = get_guild_data(interaction.guild.id)
+    data = get_guild_data(interaction.guild.id, mark_dirty=False)
+    if export:
+        await send_key_export(interaction, list(data['free_keys']), f"free-keys-{interaction.guild.id}.txt", f"📤 {len(data['free_keys'])} free key(s) en stock")
+        return
     
     embed = discord.Embed(title="📊 Stock Free Keys", description=f"**Free keys disponibles:** {len(data['free_keys'])}", color=0xa30174)
     await interaction.response.send_message(embed=embed, ephemeral=True)
@@ -3535,8 +5754,10 @@ async def resetfreekey(interaction: discord.Interaction):
         return
     
     guild_id = interaction.guild.id
+    touch_guild_state(guild_id, 'free_key_users')
     if guild_id in free_key_users:
         free_key_users[guild_id] = set()
+        journal_record('free_key_users', guild_id, 'free_key_reset')
     
     embed = discord.Embed(title="🔄 Reset Free Keys", description="Tous les utilisateurs peuvent maintenant récupérer une nouvelle free key!", color=0xa30174)
     await interaction.response.send_message(embed=embed)
@@ -3548,6 +5769,7 @@ async def stick(interaction: discord.Interaction, message: str):
         return
     guild_id = interaction.guild.id
     channel_id = interaction.channel.id
+    touch_guild_state(guild_id, 'sticky')
     
     if guild_id not in sticky_messages:
         sticky_messages[guild_id] = {}
@@ -3583,6 +5805,7 @@ async def stickstop(interaction: discord.Interaction):
         return
     guild_id = interaction.guild.id
     channel_id = interaction.channel.id
+    touch_guild_state(guild_id, 'sticky')
     
     if guild_id in sticky_messages and channel_id in sticky_messages[guild_id]:
         sticky_messages[guild_id][channel_id]['active'] = False
@@ -3595,6 +5818,7 @@ async def stickdelete(interaction: discord.Interaction):
         return
     guild_id = interaction.guild.id
     channel_id = interaction.channel.id
+    touch_guild_state(guild_id, 'sticky')
     
     if guild_id in sticky_messages and channel_id in sticky_messages[guild_id]:
         try:
@@ -3615,6 +5839,7 @@ async def setnamestick(interaction: discord.Interaction, nom: str):
     if not await check_permissions(interaction):
         return
     guild_id = interaction.guild.id
+    touch_guild_state(guild_id, 'sticky')
     
     # Mettre à jour tous les sticky messages
     if guild_id in sticky_messages:
@@ -3633,20 +5858,11 @@ class GiveawayModal(discord.ui.Modal, title='Créer un Giveaway'):
     async def on_submit(self, interaction: discord.Interaction):
         try:
             # Parsing de la durée
-            duration_str = self.duration.value.lower()
-            duration_minutes = 0
-            
-            if duration_str.endswith('m'):
-                duration_minutes = int(duration_str[:-1])
-            elif duration_str.endswith('h'):
-                duration_minutes = int(duration_str[:-1]) * 60
-            elif duration_str.endswith('d'):
-                duration_minutes = int(duration_str[:-1]) * 60 * 24
-            else:
-                # Si pas d'unité, considérer comme des minutes
-                duration_minutes = int(duration_str)
+            duration_minutes = parse_duration_minutes(self.duration.value)
             
             winner_count = int(self.winners.value)
+            if winner_count < 1:
+                raise ValueError
             
             end_time = datetime.now() + timedelta(minutes=duration_minutes)
             
@@ -3672,10 +5888,15 @@ class GiveawayModal(discord.ui.Modal, title='Créer un Giveaway'):
                 'prize': self.prize.value,
                 'end_time': end_time,
                 'winner_count': winner_count,
-                'participants': [],
+                'participants': set(),
                 'active': True,
-                'channel_id': interaction.channel.id
+                'channel_id': interaction.channel.id,
+                'seed': random.getrandbits(64),  # Graine publiée à la fin : tirage rejouable
+                'draws': []  # Gagnants de chaque tirage (fin puis relances)
             }
+            journal_record('giveaways', msg.id, 'put', value=giveaways[msg.id])
+            mark_state_dirty('giveaways', msg.id)
+            schedule_giveaway(msg.id)
             
         except ValueError:
             await interaction.response.send_message("❌ Durée ou nombre de gagnants invalide! Format de durée: 30m, 2h, 1d", ephemeral=True)
@@ -3769,7 +5990,7 @@ class VouchModal(discord.ui.Modal, title='Laisser un Avis'):
     recommend = discord.ui.TextInput(label='Recommanderiez-vous? (oui/non)', placeholder='oui')
     image_url = discord.ui.TextInput(label='Image URL (optionnel)', required=False, max_length=500)
     async def on_submit(self, interaction: discord.Interaction):
-        data = get_guild_data(interaction.guild.id)
+        data = get_guild_data(interaction.guild.id, mark_dirty=True)
         config = data['config']['vouch_config']
         
         data['vouch_count'] += 1
@@ -3810,7 +6031,7 @@ class CustomKeyPanelModal(discord.ui.Modal):
     image_url = discord.ui.TextInput(label='Image URL (optionnel)', required=False, max_length=500)
     async def on_submit(self, interaction: discord.Interaction):
         # SAUVEGARDER la configuration de l'embed
-        data = get_guild_data(interaction.guild.id)
+        data = get_guild_data(interaction.guild.id, mark_dirty=True)
         data['config']['key_embed'] = {
             'title': self.title_field.value,
             'description': self.description.value,
@@ -3845,7 +6066,7 @@ class CustomFreeKeyPanelModal(discord.ui.Modal):
     image_url = discord.ui.TextInput(label='Image URL (optionnel)', required=False, max_length=500)
     async def on_submit(self, interaction: discord.Interaction):
         # SAUVEGARDER la configuration de l'embed
-        data = get_guild_data(interaction.guild.id)
+        data = get_guild_data(interaction.guild.id, mark_dirty=True)
         data['config']['freekey_embed'] = {
             'title': self.title_field.value,
             'description': self.description.value,
@@ -3897,7 +6118,7 @@ class InactivityMessageModal(discord.ui.Modal, title='Personnaliser Message Inac
         max_length=80
     )
     async def on_submit(self, interaction: discord.Interaction):
-        data = get_guild_data(interaction.guild.id)
+        data = get_guild_data(interaction.guild.id, mark_dirty=True)
         
         # Sauvegarder la config
         data['config']['inactivity_config']['embed'] = {
@@ -3937,7 +6158,7 @@ class CustomPanelModal(discord.ui.Modal, title='Personnaliser Panel Ticket'):
     thumbnail_url = discord.ui.TextInput(label='Thumbnail URL (optionnel)', required=False, max_length=500)
     async def on_submit(self, interaction: discord.Interaction):
         # SAUVEGARDER la configuration de l'embed
-        data = get_guild_data(interaction.guild.id)
+        data = get_guild_data(interaction.guild.id, mark_dirty=True)
         data['config']['ticket_embed'] = {
             'title': self.title_field.value,
             'description': self.description_field.value,
@@ -4004,20 +6225,17 @@ class TicketControlView(discord.ui.View):
         await asyncio.sleep(5)
         
         # Transcript
-        messages = []
-        async for message in interaction.channel.history(limit=None, oldest_first=True):
-            messages.append(f"[{message.created_at}] {message.author}: {message.content}")
+        transcript = await create_ticket_transcript(interaction.channel)
         
-        transcript = "\n".join(messages)
-        
-        try:
-            user_id = int(interaction.channel.name.split('-')[1])
-            user = bot.get_user(user_id)
-            if user:
-                file = discord.File(io.StringIO(transcript), filename=f"transcript-{interaction.channel.name}.txt")
-                await user.send(f"📄 Transcript du ticket {interaction.channel.name}:", file=file)
-        except:
-            pass
+        ticket = get_ticket(interaction.channel.id)
+        user = bot.get_user(ticket['creator_id']) if ticket and ticket['creator_id'] else None
+        ticket_info = {
+            'number': ticket['number'] if ticket else "N/A",
+            'category': ticket['category'] if ticket else "N/A",
+            'creator': user.mention if user else "Inconnu"
+        }
+        dm_embed = discord.Embed(title=f"📄 Transcript du ticket {interaction.channel.name}", color=0xa30174, timestamp=datetime.now())
+        await deliver_ticket_transcript(interaction.guild, interaction.channel.name, ticket_info, transcript, interaction.user, user, dm_embed)
         
         await interaction.channel.delete()
 class KeyPromotView(discord.ui.View):
@@ -4041,21 +6259,24 @@ class KeyPromotView(discord.ui.View):
                 return
         
         # Vérifier cooldown
-        cooldown_key = f"{guild_id}_{user_id}_key"
-        if cooldown_key in user_cooldowns:
-            remaining = user_cooldowns[cooldown_key] - datetime.now()
-            if remaining.total_seconds() > 0:
-                minutes = int(remaining.total_seconds() / 60)
-                await interaction.response.send_message(f"⏰ Cooldown actif! Attendez encore {minutes} minutes.", ephemeral=True)
-                return
+        cooldown_key = (guild_id, user_id, 'key')
+        remaining = user_cooldowns.remaining(cooldown_key)
+        if remaining > 0:
+            minutes = int(remaining / 60)
+            await interaction.response.send_message(f"⏰ Cooldown actif! Attendez encore {minutes} minutes.", ephemeral=True)
+            return
         
         # Donner clé
-        if not data['keys']:
+        key = data['keys'].claim()
+        if key is None:
             await interaction.response.send_message("❌ Plus de clés disponibles!", ephemeral=True)
             return
         
-        key = data['keys'].pop(0)
-        user_cooldowns[cooldown_key] = datetime.now() + timedelta(minutes=data['config']['key_cooldown'])
+        cooldown_seconds = data['config']['key_cooldown'] * 60
+        user_cooldowns.set(cooldown_key, cooldown_seconds)
+        journal_record('key_stock', guild_id, 'key_remove', field='keys', key=key)
+        journal_record('cooldowns', 0, 'cooldown_set', key=cooldown_key, until=datetime.now() + timedelta(seconds=cooldown_seconds))
+        mark_state_dirty('cooldowns', 0)
         
         try:
             await interaction.user.send(f"🔑 **Votre clé promoteur:** `{key}`")
@@ -4084,65 +6305,63 @@ class FreeKeyView(discord.ui.View):
             return
         
         # Donner free key
-        if not data['free_keys']:
+        key = data['free_keys'].claim()
+        if key is None:
             await interaction.response.send_message("❌ Plus de free keys disponibles!", ephemeral=True)
             return
         
-        key = data['free_keys'].pop(0)
         free_key_users[guild_id].add(user_id)
+        journal_record('key_stock', guild_id, 'key_remove', field='free_keys', key=key)
+        journal_record('free_key_users', guild_id, 'free_key_claim', user=user_id)
+        mark_guild_dirty(guild_id, 'free_key_users')
         
         try:
             await interaction.user.send(f"🆓 **Votre free key:** `{key}`")
             await interaction.response.send_message("✅ Free key envoyée en privé!", ephemeral=True)
         except:
             await interaction.response.send_message(f"🆓 **Votre free key:** `{key}`\n⚠️ Supprimez ce message après utilisation!", ephemeral=True)
-class InactivityView(discord.ui.View):
-    def __init__(self, guild_id, channel_id, creator_id):
-        super().__init__(timeout=None)  # Permanent
-        self.guild_id = guild_id
-        self.channel_id = channel_id
-        self.creator_id = creator_id
-        
-        # Récupérer les labels des boutons depuis la config
-        data = get_guild_data(guild_id)
-        config = data['config']['inactivity_config']
-        
-        # Créer les boutons avec custom_id UNIQUE
-        keep_button = discord.ui.Button(
-            style=discord.ButtonStyle.success,
-            label=config['embed']['button_keep'],
-            custom_id=f"inactivity_keep_{channel_id}_{int(datetime.now().timestamp())}"
-        )
-        keep_button.callback = self.keep_open
-        
-        close_button = discord.ui.Button(
-            style=discord.ButtonStyle.danger,
-            label=config['embed']['button_close'],
-            custom_id=f"inactivity_close_{channel_id}_{int(datetime.now().timestamp())}"
+class InactivityButton(discord.ui.DynamicItem[discord.ui.Button], template=r'inactivity[:_](?P<action>keep|close)[:_](?P<channel_id>\d+)(?:_\d+)?'):
+    """Bouton d'avertissement sans état : action et salon dans le custom_id, le reste dans le tracker.
+    Enregistré une fois pour toutes, il répond aussi après un redémarrage (anciens custom_id compris)"""
+    def __init__(self, action, channel_id, label=None):
+        super().__init__(
+            discord.ui.Button(
+                style=discord.ButtonStyle.success if action == 'keep' else discord.ButtonStyle.danger,
+                label=label or ("Garder ouvert" if action == 'keep' else "Fermer"),
+                custom_id=f"inactivity:{action}:{channel_id}"
+            )
         )
-        close_button.callback = self.close_ticket
-        
-        self.add_item(keep_button)
-        self.add_item(close_button)
+        self.action = action
+        self.channel_id = channel_id
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match['action'], int(match['channel_id']), item.label)
+    async def callback(self, interaction: discord.Interaction):
+        tracked = ticket_activity_tracker.get(interaction.guild.id, {}).get(self.channel_id)
+        ticket = get_ticket(self.channel_id)
+        creator_id = tracked['creator_id'] if tracked else (ticket['creator_id'] if ticket else None)
+        if self.action == 'keep':
+            await self.keep_open(interaction, creator_id)
+        else:
+            await self.close_ticket(interaction, creator_id)
     
-    async def keep_open(self, interaction: discord.Interaction):
+    async def keep_open(self, interaction: discord.Interaction, creator_id):
         """Garder le ticket ouvert"""
-        if interaction.user.id != self.creator_id:
+        if interaction.user.id != creator_id:
             await interaction.response.send_message(
                 "❌ Seul le créateur du ticket peut utiliser ce bouton.",
                 ephemeral=True
             )
             return
         
+        guild_id = interaction.guild.id
         print(f"[INACTIVITY] Ticket {self.channel_id} gardé ouvert par le créateur")
         
-        # Reset l'activité
-        update_ticket_activity(self.guild_id, self.channel_id, self.creator_id)
-        
-        # Incrémenter le compteur d'extensions
-        if self.guild_id in ticket_activity_tracker:
-            if self.channel_id in ticket_activity_tracker[self.guild_id]:
-                ticket_activity_tracker[self.guild_id][self.channel_id]['extensions'] = ticket_activity_tracker[self.guild_id][self.channel_id].get('extensions', 0) + 1
+        # Reset l'activité en conservant le compteur d'extensions
+        extensions = ticket_activity_tracker.get(guild_id, {}).get(self.channel_id, {}).get('extensions', 0)
+        update_ticket_activity(guild_id, self.channel_id, creator_id)
+        ticket_activity_tracker[guild_id][self.channel_id]['extensions'] = extensions + 1
+        journal_record('ticket_activity', guild_id, 'ticket_activity', channel=self.channel_id, entry=ticket_activity_tracker[guild_id][self.channel_id])
         
         # Supprimer le message d'avertissement
         try:
@@ -4158,17 +6377,16 @@ class InactivityView(discord.ui.View):
             ephemeral=True
         )
     
-    async def close_ticket(self, interaction: discord.Interaction):
+    async def close_ticket(self, interaction: discord.Interaction, creator_id):
         """Fermer le ticket - VERSION SIMPLIFIÉE ET ROBUSTE"""
         
         # Vérification créateur
-        if interaction.user.id != self.creator_id:
+        if interaction.user.id != creator_id:
             await interaction.response.send_message(
                 "❌ Seul le créateur du ticket peut fermer ce ticket.",
                 ephemeral=True
             )
             return
-        
         # Déférer la réponse pour avoir plus de temps
         await interaction.response.defer()
         
@@ -4187,54 +6405,47 @@ class InactivityView(discord.ui.View):
             guild = interaction.guild
             
             # 1. Retirer du tracker
-            remove_ticket_from_tracker(self.guild_id, self.channel_id)
+            remove_ticket_from_tracker(guild.id, self.channel_id)
             
             # 2. Créer le transcript
-            transcript_text = await create_ticket_transcript(channel)
+            transcript = await create_ticket_transcript(channel)
             
             # 3. Extraire infos
-            channel_parts = channel.name.split('-')
-            ticket_number = channel_parts[-1] if len(channel_parts) >= 4 else "N/A"
-            ticket_category = channel_parts[1].title() if len(channel_parts) >= 4 else "N/A"
+            ticket = get_ticket(channel.id)
+            ticket_number = ticket['number'] if ticket else "N/A"
+            ticket_category = ticket['category'] if ticket else "N/A"
             
             # 4. Trouver le créateur
-            creator_user = guild.get_member(self.creator_id)
+            creator_user = guild.get_member(creator_id)
             
             ticket_info = {
                 'number': ticket_number,
                 'category': ticket_category,
-                'creator': creator_user.mention if creator_user else f"<@{self.creator_id}>"
+                'creator': creator_user.mention if creator_user else f"<@{creator_id}>"
             }
             
-            # 5. Envoyer logs
-            await send_ticket_log(
+            # 5. Envoyer logs (upload unique) et DM
+            dm_embed = discord.Embed(
+                title="📄 Transcript de votre ticket",
+                description="**Raison:** Fermé suite à inactivité",
+                color=0xa30174,
+                timestamp=datetime.now()
+            )
+            dm_embed.add_field(name="🎫 Ticket", value=channel.name, inline=True)
+            dm_embed.add_field(name="📊 Numéro", value=f"#{ticket_number}", inline=True)
+            dm_embed.add_field(name="🏷️ Catégorie", value=ticket_category, inline=True)
+            await deliver_ticket_transcript(
                 guild,
                 channel.name,
                 ticket_info,
-                transcript_text,
-                interaction.user
+                transcript,
+                interaction.user,
+                creator_user,
+                dm_embed,
+                log_tag="[INACTIVITY]"
             )
             
-            # 6. Envoyer DM
-            if creator_user:
-                try:
-                    dm_embed = discord.Embed(
-                        title="📄 Transcript de votre ticket",
-                        description="**Raison:** Fermé suite à inactivité",
-                        color=0xa30174,
-                        timestamp=datetime.now()
-                    )
-                    dm_embed.add_field(name="🎫 Ticket", value=channel.name, inline=True)
-                    dm_embed.add_field(name="📊 Numéro", value=f"#{ticket_number}", inline=True)
-                    dm_embed.add_field(name="🏷️ Catégorie", value=ticket_category, inline=True)
-                    
-                    filename = f"transcript-{channel.name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
-                    file_dm = discord.File(io.StringIO(transcript_text), filename=filename)
-                    await creator_user.send(embed=dm_embed, file=file_dm)
-                except:
-                    pass
-            
-            # 7. Supprimer le salon
+            # 6. Supprimer le salon
             await channel.delete(reason=f"Ticket fermé par inactivité - {interaction.user}")
         
         except Exception as e:
@@ -4250,6 +6461,17 @@ class InactivityView(discord.ui.View):
                 )
             except:
                 pass
+class InactivityView(discord.ui.View):
+    def __init__(self, guild_id, channel_id, creator_id):
+        super().__init__(timeout=None)  # Permanent
+        
+        # Récupérer les labels des boutons depuis la config
+        data = get_guild_data(guild_id, mark_dirty=False)
+        config = data['config']['inactivity_config']
+        
+        self.add_item(InactivityButton('keep', channel_id, config['embed']['button_keep']))
+        self.add_item(InactivityButton('close', channel_id, config['embed']['button_close']))
+bot.add_dynamic_items(InactivityButton)
 # HELP VIEW PERMANENT
 class HelpView(discord.ui.View):
     def __init__(self):
@@ -4348,8 +6570,8 @@ class HelpSelect(discord.ui.Select):
                 color=0xff69b4
             ).add_field(name="Commandes", value="""
 `/gcreate` - Créer un giveaway avec panneau interactif (+ image)
-`/greroll <message_id>` - Relancer un giveaway
-`/glist` - Lister les giveaways actifs
+`/greroll <message_id> [winners]` - Relancer un giveaway (exclut les gagnants déjà tirés)
+`/glist [resync]` - Lister les giveaways actifs (resync : recompter les réactions)
 `/gend <message_id>` - Terminer un giveaway prématurément
 `/gdelete <message_id>` - Supprimer un giveaway
             """, inline=False),
@@ -4456,7 +6678,7 @@ class HelpSelect(discord.ui.Select):
                 description="**1 commande disponible**",
                 color=0xffd700
             ).add_field(name="Commandes", value="""
-`/poll <question> <option1> <option2> [option3] [option4] [duration]` - Créer un sondage avec réactions automatiques
+`/poll <question> <option1> <option2> [option3] [option4] [duration]` - Créer un sondage à boutons (clôture automatique)
             """, inline=False),
             
             "tickets": discord.Embed(
@@ -4497,9 +6719,9 @@ class HelpSelect(discord.ui.Select):
 `/viewpanelkeypromot` - Afficher le panel pour récupérer des clés (permanent)
 `/custompanelkey` - Personnaliser l'embed du panel key (+ images, bouton custom)
             """, inline=False).add_field(name="⚙️ Gestion & Configuration", value="""
-`/addkey <keys>` - Ajouter clés (séparées par espaces : KEY1 KEY2 KEY3)
+`/addkey [keys] [file]` - Ajouter clés (KEY1 KEY2 KEY3 ou fichier .txt/.csv)
 `/removekey <key>` - Supprimer une clé du stock
-`/stockkey` - Voir le nombre de clés disponibles
+`/stockkey [export]` - Voir (ou exporter) les clés disponibles
 `/setrolekey <role>` - Définir les rôles autorisés à récupérer des clés
 `/setcooldownkey <minutes>` - Définir le cooldown entre les récupérations
 `/configkey` - Voir la configuration actuelle du panel key
@@ -4518,9 +6740,9 @@ class HelpSelect(discord.ui.Select):
 `/viewpanelfreekey` - Afficher le panel pour récupérer des clés gratuites (permanent)
 `/custompanelfreekey` - Personnaliser l'embed du panel (+ images, bouton custom)
             """, inline=False).add_field(name="⚙️ Gestion & Configuration", value="""
-`/addfreekey <keys>` - Ajouter free keys (séparées par espaces : FREE1 FREE2 FREE3)
+`/addfreekey [keys] [file]` - Ajouter free keys (FREE1 FREE2 FREE3 ou fichier .txt/.csv)
 `/removefreekey <key>` - Supprimer une free key du stock
-`/stockfreekey` - Voir le stock de free keys
+`/stockfreekey [export]` - Voir (ou exporter) le stock de free keys
 `/resetfreekey` - Reset la liste des utilisateurs (permet de récupérer à nouveau)
 `/configfreekey` - Voir la configuration actuelle du panel free key
 `/resetfreekeyconfig` - Remettre la configuration par défaut
@@ -4555,16 +6777,26 @@ async def on_raw_reaction_add(payload):
         return
     
     if payload.message_id in giveaways and str(payload.emoji) == "🎉":
+        if payload.message_id in giveaway_resyncs:
+            giveaway_resyncs[payload.message_id]['joined'].add(payload.user_id)
+            giveaway_resyncs[payload.message_id]['left'].discard(payload.user_id)
         if payload.user_id not in giveaways[payload.message_id]['participants']:
-            giveaways[payload.message_id]['participants'].append(payload.user_id)
+            giveaways[payload.message_id]['participants'].add(payload.user_id)
+            journal_record('giveaways', payload.message_id, 'giveaway_join', user=payload.user_id)
+            mark_state_dirty('giveaways', payload.message_id)
 @bot.event
 async def on_raw_reaction_remove(payload):
     if payload.user_id == bot.user.id:
         return
     
     if payload.message_id in giveaways and str(payload.emoji) == "🎉":
+        if payload.message_id in giveaway_resyncs:
+            giveaway_resyncs[payload.message_id]['left'].add(payload.user_id)
+            giveaway_resyncs[payload.message_id]['joined'].discard(payload.user_id)
         if payload.user_id in giveaways[payload.message_id]['participants']:
-            giveaways[payload.message_id]['participants'].remove(payload.user_id)
+            giveaways[payload.message_id]['participants'].discard(payload.user_id)
+            journal_record('giveaways', payload.message_id, 'giveaway_leave', user=payload.user_id)
+            mark_state_dirty('giveaways', payload.message_id)
 class TranslateView(discord.ui.View):
     def __init__(self, text: str):
         super().__init__(timeout=None)
@@ -4594,44 +6826,6 @@ class TranslateView(discord.ui.View):
                 "❌ Translation impossible.",
                 ephemeral=True
             )
-@bot.event
-async def on_message(message: discord.Message):
-    await bot.process_commands(message)
-    # On ne traite QUE les messages du bot
-    if not bot.user or message.author.id != bot.user.id:
-        return
-    # Pas d'embed
-    if not message.embeds:
-        return
-    # Déjà un bouton
-    if message.components:
-        return
-    # Construire le texte à traduire
-    texts = []
-    for embed in message.embeds:
-        if embed.title:
-            texts.append(embed.title)
-        if embed.description:
-            texts.append(embed.description)
-        for field in embed.fields:
-            texts.append(field.name)
-            texts.append(field.value)
-    full_text = "\n".join(texts).strip()
-    if not full_text:
-        return
-    # ⏳ Petite pause pour laisser Discord "stabiliser" le message
-    await asyncio.sleep(0.3)
-    try:
-        await message.edit(view=TranslateView(full_text))
-    except discord.NotFound:
-        # Message supprimé ou non éditable → on ignore silencieusement
-        return
-    except discord.Forbidden:
-        # Permissions insuffisantes
-        return
-    except discord.HTTPException:
-        # Autre erreur HTTP (rate limit, etc.)
-        return
 @bot.command(name="dm")
 async def dm(ctx, user: discord.User, *, message: str):
     # Vérification permissions (admin / rôles autorisés)
@@ -4667,19 +6861,17 @@ async def dm(ctx, user: discord.User, *, message: str):
 @app_commands.describe(key="Clé reçue après l'achat")
 async def redeembot(interaction: discord.Interaction, key: str):
     data = get_guild_data(interaction.guild.id)
-    # Sécurité structure
-    if "used_keys" not in data:
-        data["used_keys"] = {}
     # Clé invalide
-    if key not in data["keys"]:
+    if not data["keys"].remove(key):
         await interaction.response.send_message(
             "❌ Clé invalide ou déjà utilisée.",
             ephemeral=True
         )
         return
-    # Consommer la clé
-    data["keys"].remove(key)
-    data["used_keys"][key] = interaction.user.id
+    # Clé consommée
+    redeemed_at = datetime.now()
+    data["used_keys"].record(key, interaction.user.id, redeemed_at)
+    journal_record('key_stock', interaction.guild.id, 'key_redeem', key=key, user=interaction.user.id, at=redeemed_at)
     # Envoi du DM
     try:
         embed = discord.Embed(
@@ -4701,31 +6893,80 @@ async def redeembot(interaction: discord.Interaction, key: str):
             "❌ Impossible de t’envoyer un DM.\nActive tes messages privés puis réessaie.",
             ephemeral=True
         )
+USED_KEYS_PER_PAGE = 20
+def parse_ledger_date(value, end_of_day=False):
+    """Date JJ/MM/AAAA ou AAAA-MM-JJ ; fin de journée pour une borne haute"""
+    for fmt in ('%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            day = datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            continue
+        return day + timedelta(days=1, microseconds=-1) if end_of_day else day
+    return None
+class UsedKeysView(discord.ui.View):
+    """Pagination des clés utilisées (la liste filtrée est calculée une fois)"""
+    def __init__(self, entries, title):
+        super().__init__(timeout=300)
+        self.entries = entries
+        self.title = title
+        self.page = 0
+        self.pages = max(1, -(-len(entries) // USED_KEYS_PER_PAGE))
+        self.update_buttons()
+    def update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.pages - 1
+    def build_embed(self):
+        start = self.page * USED_KEYS_PER_PAGE
+        lines = []
+        for key, user_id, redeemed_at in self.entries[start:start + USED_KEYS_PER_PAGE]:
+            when = f" • <t:{int(redeemed_at.timestamp())}:d>" if redeemed_at else ""
+            lines.append(f"`{key}` → <@{user_id}>{when}")
+        embed = discord.Embed(title=self.title, description="\n".join(lines), color=0xed4245)
+        embed.set_footer(text=f"Page {self.page + 1}/{self.pages} • {len(self.entries)} clé(s)")
+        return embed
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page -= 1
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
 @bot.tree.command(
     name="usedkeys",
     description="Voir les clés déjà utilisées"
 )
-async def usedkeys(interaction: discord.Interaction):
+@app_commands.describe(
+    user="Seulement les clés utilisées par ce membre",
+    since="Depuis le (JJ/MM/AAAA)",
+    until="Jusqu'au (JJ/MM/AAAA)",
+    export="Recevoir le résultat en fichier .csv (clé,utilisateur,date)"
+)
+async def usedkeys(interaction: discord.Interaction, user: discord.User = None, since: str = None, until: str = None, export: bool = False):
     if not await check_permissions(interaction):
         return
-    data = get_guild_data(interaction.guild.id)
-    used = data.get("used_keys", {})
+    since_date = parse_ledger_date(since) if since else None
+    until_date = parse_ledger_date(until, end_of_day=True) if until else None
+    if (since and since_date is None) or (until and until_date is None):
+        await interaction.response.send_message("❌ Date invalide! Format: JJ/MM/AAAA", ephemeral=True)
+        return
+    data = get_guild_data(interaction.guild.id, mark_dirty=False)
+    used = data["used_keys"].query(user.id if user else None, since_date, until_date)
     if not used:
         await interaction.response.send_message(
             "📭 Aucune clé utilisée.",
             ephemeral=True
         )
         return
-    desc = "\n".join(
-        f"`{k}` → <@{v}>"
-        for k, v in used.items()
-    )
-    embed = discord.Embed(
-        title="🔐 Clés utilisées",
-        description=desc,
-        color=0xed4245
-    )
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+    if export:
+        lines = [("key", "user_id", "redeemed_at")] + [(k, v, at.isoformat() if at else '') for k, v, at in used]
+        await send_key_export(interaction, lines, f"used-keys-{interaction.guild.id}.csv", f"📤 {len(used)} clé(s) utilisée(s)")
+        return
+    title = f"🔐 Clés utilisées par {user.name}" if user else "🔐 Clés utilisées"
+    view = UsedKeysView(used, title)
+    await interaction.response.send_message(embed=view.build_embed(), view=view, ephemeral=True)
 @bot.event
 async def on_command_error(ctx, error):
     """Éviter le spam CommandNotFound quand un utilisateur tape une slash commande en texte."""
@@ -4738,7 +6979,20 @@ async def on_command_error(ctx, error):
             )
         return
 @bot.event
+async def on_guild_channel_delete(channel):
+    """Un ticket supprimé (par le bot ou à la main) quitte le registre et le suivi d'activité ;
+    un salon du pool de vocs temporaires supprimé à la main est retiré du pool"""
+    if unregister_ticket(channel.id):
+        remove_ticket_from_tracker(channel.guild.id, channel.id)
+        discard_ticket_capture(channel.id)
+    discard_voctemp_pool_channel(channel)
+@bot.event
+async def on_raw_message_edit(payload):
+    if payload.channel_id in ticket_registry:
+        capture_ticket_edit(payload)
+@bot.event
 async def on_ready():
+    await start_background_services()
     # Sync globale (peut prendre du temps à apparaître)
     await bot.tree.sync()
     print("✅ Commandes slash synchronisées globalement")
@@ -4748,7 +7002,15 @@ async def on_ready():
         synced = await bot.tree.sync(guild=guild)
         print(f"✅ {guild.name}: {len(synced)} commandes synchronisées")
         await update_counter_channel_names(guild)
+        if guild.id not in ticket_registry_ready:
+            print(f"🎫 {guild.name}: {rebuild_ticket_registry(guild)} ticket(s) ouvert(s) indexé(s)")
+            sync_ticket_inactivity(guild)
 # DÉMARRAGE DU BOT
 if __name__ == "__main__":
-    bot.run(os.getenv('DISCORD_TOKEN'))
+    init_storage()
+    try:
+        bot.run(os.getenv('DISCORD_TOKEN'))
+    finally:
+        flush_state_sync()
+        storage.close()
             
@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+import pytest
+from discord.app_commands import CommandTree
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('BOT_DATA_DIR', tempfile.mkdtemp(prefix='botceoaio-tests-'))
+def _register_without_limit(self, command, /, *, guild=None, guilds=None, override=False):
+    # main.py déclare plus de commandes que la limite Discord vérifiée à l'enregistrement
+    self._global_commands[command.name] = command
+@pytest.fixture(scope='session')
+def main_module():
+    original = CommandTree.add_command
+    CommandTree.add_command = _register_without_limit
+    try:
+        import main
+    finally:
+        CommandTree.add_command = original
+    return main
@@ -0,0 +1,12 @@
+def test_userinfo_host_is_skipped(main_module):
+    assert main_module.extract_link_hosts('https://youtube.com@evil.com/x') == ['evil.com']
+def test_credentials_before_host(main_module):
+    assert main_module.extract_link_hosts('http://user:pw@evil.com') == ['evil.com']
+def test_userinfo_cannot_bypass_whitelist(main_module):
+    config = {'whitelist_domains': ['youtube.com']}
+    main_module.invalidate_antilink_whitelist(0)
+    assert main_module.find_forbidden_link(0, config, 'https://youtube.com@evil.com/x') == 'evil.com'
+    assert main_module.find_forbidden_link(0, config, 'http://user:pw@evil.com') == 'evil.com'
+    assert main_module.find_forbidden_link(0, config, 'https://www.youtube.com/watch?v=1') is None
+def test_bare_email_is_not_a_link(main_module):
+    assert main_module.extract_link_hosts('contact: a@gmail.com') == []
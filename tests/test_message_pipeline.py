@@ -0,0 +1,38 @@
+import asyncio
+from types import SimpleNamespace
+import discord
+GUILD_ID = 4242
+def _message(content):
+    async def delete():
+        pass
+    return SimpleNamespace(
+        id=1, content=content, embeds=[], components=[], delete=delete,
+        author=SimpleNamespace(id=7, bot=False, roles=[], mention='<@7>', name='membre'),
+        guild=SimpleNamespace(id=GUILD_ID), channel=SimpleNamespace(id=99, name='general'),
+    )
+def test_slow_automod_sanction_still_stops_the_pipeline(main_module, monkeypatch):
+    config = main_module.get_guild_data(GUILD_ID)['config']
+    monkeypatch.setitem(config, 'automod', True)
+    monkeypatch.setitem(config, 'antilink', {'status': True, 'action': 'warn'})
+    main_module.invalidate_antilink_whitelist(GUILD_ID)
+    monkeypatch.setattr(main_module, 'MESSAGE_STAGE_BUDGET_MS', 50)
+    monkeypatch.setattr(main_module.bot._connection, 'user', discord.Object(id=1))
+    sanctions, processed = [], []
+    async def slow_sanction(message, action, reason, detail=None):
+        await asyncio.sleep(0.3)
+        sanctions.append(detail)
+    async def process_commands(message):
+        processed.append(message)
+    monkeypatch.setattr(main_module, 'handle_automod_action', slow_sanction)
+    monkeypatch.setattr(main_module.bot, 'process_commands', process_commands)
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await main_module.on_message(_message('https://evil.com/x'))
+        elapsed = loop.time() - start
+        await asyncio.gather(*main_module.message_pipeline_tasks)
+        return elapsed
+    elapsed = asyncio.run(scenario())
+    assert elapsed < 0.3
+    assert processed == []
+    assert sanctions == ['evil.com']